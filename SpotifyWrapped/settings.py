@@ -19,9 +19,85 @@ SPOTIFY_CLIENT_ID = config('SPOTIFY_CLIENT_ID', default=None)
 SPOTIFY_CLIENT_SECRET = config('SPOTIFY_CLIENT_SECRET', default=None)
 SPOTIFY_REDIRECT_URI = config(
     'HEROKU_REDIRECT_URI' if IS_HEROKU else 'LOCAL_REDIRECT_URI',
-    default='http://localhost:8000/callback/'
+    default='https://spotifywrapped35-7ed41b719d25.herokuapp.com/callback/' if IS_HEROKU
+    else 'http://localhost:8000/callback/'
 )
 
+# Outbound Spotify API calls
+SPOTIFY_API_BASE_URL = config('SPOTIFY_API_BASE_URL', default='https://api.spotify.com/v1')
+SPOTIFY_ACCOUNTS_BASE_URL = config('SPOTIFY_ACCOUNTS_BASE_URL', default='https://accounts.spotify.com')
+SPOTIFY_API_TIMEOUT = config('SPOTIFY_API_TIMEOUT', default=5.0, cast=float)  # per call, in seconds
+SPOTIFY_FANOUT_DEADLINE = config('SPOTIFY_FANOUT_DEADLINE', default=8.0, cast=float)  # whole wrap fetch
+SPOTIFY_FETCH_WORKERS = config('SPOTIFY_FETCH_WORKERS', default=8, cast=int)
+SPOTIFY_PAGES_IN_FLIGHT = config('SPOTIFY_PAGES_IN_FLIGHT', default=4, cast=int)  # per paged pull
+SPOTIFY_MAX_RETRIES = config('SPOTIFY_MAX_RETRIES', default=2, cast=int)
+SPOTIFY_BACKOFF_BASE = config('SPOTIFY_BACKOFF_BASE', default=0.5, cast=float)  # seconds, doubled per retry
+SPOTIFY_MAX_BACKOFF = config('SPOTIFY_MAX_BACKOFF', default=3.0, cast=float)  # longest Retry-After we will wait
+
+# Stored Spotify tokens are encrypted with these Fernet keys (comma separated, newest
+# first, so old keys can be rotated out); derived from SECRET_KEY when unset. Access
+# tokens are refreshed SPOTIFY_TOKEN_REFRESH_MARGIN seconds before they expire
+SPOTIFY_TOKEN_KEYS = config('SPOTIFY_TOKEN_KEYS', default='', cast=lambda v: [key for key in v.split(',') if key])
+SPOTIFY_TOKEN_REFRESH_MARGIN = config('SPOTIFY_TOKEN_REFRESH_MARGIN', default=60, cast=int)
+
+# Cached Spotify responses: served as-is for SPOTIFY_CACHE_TTL seconds, then kept
+# for SPOTIFY_CACHE_STALE_TTL more so they can be revalidated with their ETag
+SPOTIFY_CACHE_TTL = config('SPOTIFY_CACHE_TTL', default=300, cast=int)
+SPOTIFY_CACHE_STALE_TTL = config('SPOTIFY_CACHE_STALE_TTL', default=3600, cast=int)
+SPOTIFY_CACHE_MAX_ENTRIES = config('SPOTIFY_CACHE_MAX_ENTRIES', default=1000, cast=int)
+
+# How long a rendered wrap stays staged for a one-click save, in seconds
+WRAP_SNAPSHOT_TTL = config('WRAP_SNAPSHOT_TTL', default=900, cast=int)
+
+# How long rendered saved-wrap pages stay cached, in seconds (every hit still checks
+# that the wrap exists, so deleted wraps are never served)
+WRAP_PAGE_CACHE_TTL = config('WRAP_PAGE_CACHE_TTL', default=86400, cast=int)
+
+# Store the track/artist lists of saved wraps zlib-compressed (`manage.py repack_wraps`
+# rewrites existing rows after this changes)
+WRAP_PAYLOAD_COMPRESSION = config('WRAP_PAYLOAD_COMPRESSION', default=False, cast=bool)
+
+# Keep the top tracks and artists of newly saved wraps in the shared Track/Artist/Album
+# catalog instead of copying them into every wrap
+WRAP_CATALOG_ENABLED = config('WRAP_CATALOG_ENABLED', default=True, cast=bool)
+
+# Keep every play seen on Spotify (`manage.py sync_play_history`) and compute listening
+# patterns and streaks from that history instead of the last 50 plays only
+PLAY_HISTORY_ENABLED = config('PLAY_HISTORY_ENABLED', default=True, cast=bool)
+
+# Saved wraps shown per dashboard page
+DASHBOARD_PAGE_SIZE = config('DASHBOARD_PAGE_SIZE', default=12, cast=int)
+
+# Generate wraps on background workers (`manage.py run_wrap_worker`) instead of in the request
+WRAP_JOBS_ENABLED = config('WRAP_JOBS_ENABLED', default=False, cast=bool)
+
+# View mode and language live in a signed cookie. Logged-in users also get a
+# per-user record (cached in memory for USER_PREFERENCE_CACHE_TTL seconds) so their
+# preferences follow them to a new browser
+USER_PREFERENCES_ENABLED = config('USER_PREFERENCES_ENABLED', default=True, cast=bool)
+USER_PREFERENCE_CACHE_TTL = config('USER_PREFERENCE_CACHE_TTL', default=3600, cast=int)
+
+# Route callback/generate-wrap to the async views; only useful when served over ASGI
+ASYNC_SPOTIFY_VIEWS = config('ASYNC_SPOTIFY_VIEWS', default=False, cast=bool)
+
+# Time every request by phase (Spotify, database, analytics, rendering): sent back in a
+# Server-Timing header and aggregated at /metrics, which staff users can read, and
+# Prometheus too when it sends `Authorization: Bearer <METRICS_TOKEN>`
+REQUEST_TIMING_ENABLED = config('REQUEST_TIMING_ENABLED', default=True, cast=bool)
+METRICS_TOKEN = config('METRICS_TOKEN', default='')
+
+# Profile single requests with cProfile (off by default): those sent with a signed
+# X-Profile-Request header (staff get one at /profiles/, valid REQUEST_PROFILING_TOKEN_TTL
+# seconds) and a REQUEST_PROFILING_SAMPLE_RATE fraction of all requests, at most
+# REQUEST_PROFILING_MAX_PER_MINUTE a minute. The newest REQUEST_PROFILING_KEEP profiles
+# are kept in REQUEST_PROFILING_DIR
+REQUEST_PROFILING_ENABLED = config('REQUEST_PROFILING_ENABLED', default=False, cast=bool)
+REQUEST_PROFILING_SAMPLE_RATE = config('REQUEST_PROFILING_SAMPLE_RATE', default=0.0, cast=float)
+REQUEST_PROFILING_MAX_PER_MINUTE = config('REQUEST_PROFILING_MAX_PER_MINUTE', default=6, cast=int)
+REQUEST_PROFILING_TOKEN_TTL = config('REQUEST_PROFILING_TOKEN_TTL', default=3600, cast=int)
+REQUEST_PROFILING_KEEP = config('REQUEST_PROFILING_KEEP', default=50, cast=int)
+REQUEST_PROFILING_DIR = config('REQUEST_PROFILING_DIR', default=str(BASE_DIR / 'profiles'))
+
 # Allowed Hosts
 ALLOWED_HOSTS = config(
     'ALLOWED_HOSTS_HEROKU' if not DEBUG else 'ALLOWED_HOSTS',
@@ -29,14 +105,62 @@ ALLOWED_HOSTS = config(
     cast=lambda v: v.split(',')
 )
 
+# Database connections: without a pool, each worker thread keeps its connection open for
+# DATABASE_CONN_MAX_AGE seconds, checked before it is reused after a request
+DATABASE_CONN_MAX_AGE = config('DATABASE_CONN_MAX_AGE', default=600, cast=int)
+
+# Postgres only: share a pool of DATABASE_POOL_MIN_SIZE to DATABASE_POOL_MAX_SIZE connections
+# between a worker's threads instead (needs psycopg 3 with psycopg-pool). A request waits up
+# to DATABASE_POOL_TIMEOUT seconds for a free connection; connections are checked before they
+# are handed out, and closed after DATABASE_POOL_MAX_IDLE seconds unused or
+# DATABASE_POOL_MAX_LIFETIME seconds in all
+DATABASE_POOL = config('DATABASE_POOL', default=False, cast=bool)
+DATABASE_POOL_MIN_SIZE = config('DATABASE_POOL_MIN_SIZE', default=2, cast=int)
+DATABASE_POOL_MAX_SIZE = config('DATABASE_POOL_MAX_SIZE', default=10, cast=int)
+DATABASE_POOL_TIMEOUT = config('DATABASE_POOL_TIMEOUT', default=10.0, cast=float)
+DATABASE_POOL_MAX_IDLE = config('DATABASE_POOL_MAX_IDLE', default=600.0, cast=float)
+DATABASE_POOL_MAX_LIFETIME = config('DATABASE_POOL_MAX_LIFETIME', default=3600.0, cast=float)
+
+# SQLite only (single-box deployments): write-ahead logging so readers never block the writer,
+# fewer fsyncs (synchronous=NORMAL is safe with WAL), the write lock taken when a transaction
+# begins so two transactions cannot deadlock upgrading their read locks, and writers waiting
+# up to SQLITE_BUSY_TIMEOUT seconds for the lock instead of failing with "database is locked"
+SQLITE_TUNING = config('SQLITE_TUNING', default=True, cast=bool)
+SQLITE_BUSY_TIMEOUT = config('SQLITE_BUSY_TIMEOUT', default=20.0, cast=float)
+SQLITE_SYNCHRONOUS = config('SQLITE_SYNCHRONOUS', default='NORMAL')
+
 # Database Configuration
 DATABASES = {
     'default': dj_database_url.config(
         default=f'sqlite:///{BASE_DIR / "db.sqlite3"}' if DEBUG else '',
-        conn_max_age=600,
+        conn_max_age=0 if DATABASE_POOL else DATABASE_CONN_MAX_AGE,  # pooled connections go back to the pool
+        conn_health_checks=True,
         ssl_require=not DEBUG
     )
 }
+DATABASE_ENGINE = DATABASES['default'].get('ENGINE', '')
+
+if DATABASE_POOL and DATABASE_ENGINE == 'django.db.backends.postgresql':
+    from psycopg_pool import ConnectionPool
+
+    DATABASES['default'].setdefault('OPTIONS', {})['pool'] = {
+        'min_size': DATABASE_POOL_MIN_SIZE,
+        'max_size': DATABASE_POOL_MAX_SIZE,
+        'timeout': DATABASE_POOL_TIMEOUT,
+        'max_idle': DATABASE_POOL_MAX_IDLE,
+        'max_lifetime': DATABASE_POOL_MAX_LIFETIME,
+        'check': ConnectionPool.check_connection,
+    }
+
+if SQLITE_TUNING and DATABASE_ENGINE == 'django.db.backends.sqlite3':
+    DATABASES['default'].setdefault('OPTIONS', {}).update({
+        'timeout': SQLITE_BUSY_TIMEOUT,
+        'transaction_mode': 'IMMEDIATE',
+        'init_command': f'PRAGMA journal_mode=WAL; PRAGMA synchronous={SQLITE_SYNCHRONOUS}',
+    })
+    # An in-memory test database shares one cache between threads, which fails lock waits at once
+    # instead of honouring the busy timeout; test on a file so the concurrency tests see the real thing
+    DATABASES['default'].setdefault('TEST', {}).setdefault('NAME', str(BASE_DIR / 'test_db.sqlite3'))
 
 """if DEBUG:
     print(f"Running on {'Heroku' if IS_HEROKU else 'Localhost'}")
@@ -45,6 +169,28 @@ DATABASES = {
     print(f"SPOTIFY_CLIENT_ID: {SPOTIFY_CLIENT_ID}")
     print(f"SPOTIFY_CLIENT_SECRET: {SPOTIFY_CLIENT_SECRET}")"""
 
+# Caches
+# The default cache holds wrap snapshots, rendered wrap pages and preferences. The in-process
+# default only works with a single worker process: with several (gunicorn -w N), a save can
+# reach a worker that never saw the snapshot. Point it at a shared backend then, e.g.
+# CACHE_BACKEND=django.core.cache.backends.redis.RedisCache CACHE_LOCATION=redis://127.0.0.1:6379,
+# or django.core.cache.backends.db.DatabaseCache with CACHE_LOCATION=wrapped_cache
+# (after `python manage.py createcachetable`)
+CACHE_BACKEND = config('CACHE_BACKEND', default='django.core.cache.backends.locmem.LocMemCache')
+CACHE_LOCATION = config('CACHE_LOCATION', default='')
+
+CACHES = {
+    'default': {
+        'BACKEND': CACHE_BACKEND,
+        'LOCATION': CACHE_LOCATION,
+    },
+    'spotify': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'spotify-responses',
+        'OPTIONS': {'MAX_ENTRIES': SPOTIFY_CACHE_MAX_ENTRIES},
+    },
+}
+
 # Installed apps
 INSTALLED_APPS = [
     'django.contrib.admin',
@@ -58,12 +204,15 @@ INSTALLED_APPS = [
 
 # Middleware
 MIDDLEWARE = [
+    'wrapped.middleware.RequestTimingMiddleware',
+    'wrapped.middleware.RequestProfilingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'wrapped.middleware.PreferenceMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -71,13 +220,17 @@ MIDDLEWARE = [
 # Root settings
 ROOT_URLCONF = 'SpotifyWrapped.urls'
 WSGI_APPLICATION = 'SpotifyWrapped.wsgi.application'
+ASGI_APPLICATION = 'SpotifyWrapped.asgi.application'
 
 # Templates
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # The Django backend, timing renders for the Server-Timing header
+        'BACKEND': 'wrapped.timing.TimedDjangoTemplates' if REQUEST_TIMING_ENABLED
+        else 'django.template.backends.django.DjangoTemplates',
+        # Keep the alias of the stock backend (`engines['django']`) either way
+        'NAME': 'django',
         'DIRS': [BASE_DIR / 'wrapped/templates'],
-        'APP_DIRS': True,
         'OPTIONS': {
             'context_processors': [
                 'django.template.context_processors.debug',
@@ -85,6 +238,14 @@ TEMPLATES = [
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
             ],
+            # Parse each template once per process and language and keep the compiled copy, with
+            # its fixed strings already translated, in memory
+            'loaders': [
+                ('wrapped.template_loaders.TranslatedLoader', [
+                    'django.template.loaders.filesystem.Loader',
+                    'django.template.loaders.app_directories.Loader',
+                ]),
+            ],
         },
     },
 ]
@@ -99,6 +260,12 @@ AUTH_PASSWORD_VALIDATORS = [
 
 # Internationalization
 LANGUAGE_CODE = 'en-us'
+# Languages a user can pick in their settings; catalogs live in wrapped/locale
+LANGUAGES = [
+    ('en', 'English'),
+    ('de', 'German'),
+    ('es', 'Spanish'),
+]
 TIME_ZONE = 'UTC'
 USE_I18N = True
 USE_TZ = True
@@ -111,7 +278,8 @@ STATICFILES_DIRS = [BASE_DIR / 'wrapped/static']
 # Heroku-specific settings
 if IS_HEROKU:
     STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
-    django_heroku.settings(locals())
+    # DATABASES above already reads DATABASE_URL; django_heroku's copy would drop the pool options
+    django_heroku.settings(locals(), databases=False)
 
 # Auto field
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
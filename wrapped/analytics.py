@@ -0,0 +1,243 @@
+"""
+Wrap analytics, computed in a single pass over the Spotify data.
+
+`WrapAggregator` consumes top tracks, top artists and recently played items one
+at a time and keeps running totals, so every metric shown on a wrap comes out of
+one traversal of each input. It has no Django dependencies and can be fed from
+lists, generators or stored history alike.
+"""
+from . import moods
+
+# Number of tracks used for the "Top Albums" slide
+TOP_ALBUMS_COUNT = 3
+# Number of tracks sorted into the mood playlists
+MOOD_TRACKS_COUNT = 9
+# Number of genres shown as favourites and in the genre chart
+TOP_GENRES_COUNT = 5
+# Number of streaks shown on the "Longest Streaks" slide
+TOP_STREAKS_COUNT = 3
+
+
+def time_of_day(hour):
+    """
+        Maps an hour (0-23) to the time-of-day bucket used by the listening chart.
+    """
+    if 5 <= hour < 12:
+        return 'morning'
+    elif 12 <= hour < 17:
+        return 'afternoon'
+    elif 17 <= hour < 22:
+        return 'evening'
+    return 'night'
+
+
+def played_at_hour(played_at):
+    """
+        Extracts the hour from a Spotify `played_at` timestamp.
+
+        Spotify timestamps are ISO 8601 (`2024-11-26T17:54:03.123Z`), so the hour
+        is always at the same offset and no datetime parsing is needed.
+    """
+    return int(played_at[11:13])
+
+
+def album_art_url(track):
+    """
+        Returns the medium-sized album artwork URL of a track, if it has one.
+    """
+    images = track.get('album', {}).get('images') or []
+    if not images:
+        return None
+    return images[1]['url'] if len(images) > 1 else images[0]['url']
+
+
+def classify_mood(track, language=None):
+    """
+        Returns the mood playlist a track belongs to based on keywords in its
+        name and first artist, or None if no keyword matches (see `wrapped.moods`).
+    """
+    return moods.classify(track, language)
+
+
+def time_of_day_percentages(counts):
+    """
+        Turns play counts per time-of-day bucket into the percentages the listening chart shows.
+    """
+    total = sum(counts.values())
+    if total == 0:
+        return {'time_of_day': dict(counts)}
+    return {'time_of_day': {key: round((count / total) * 100, 2) for key, count in counts.items()}}
+
+
+class WrapAggregator:
+    """
+    Accumulates every wrap metric from a single traversal of the inputs.
+
+    Feed it with `add_track`, `add_artist` and `add_play` (in Spotify's order)
+    and read the metrics with `result`.
+    """
+
+    def __init__(self, language=None):
+        self.language = language
+        self.track_count = 0
+        self.total_duration_ms = 0
+        self.top_albums = []
+        # Classified together in `mood_playlists`
+        self.mood_tracks = []
+
+        self.total_genres_played = 0
+        self.genre_counts = {}
+
+        self.time_of_day = {
+            'morning': 0,
+            'afternoon': 0,
+            'evening': 0,
+            'night': 0,
+        }
+        # Longest streak per track, in order of first appearance
+        self.streaks = {}
+        self.streak_tracks = {}
+        self._last_track_id = None
+        self._current_streak = 0
+
+    def add_track(self, track):
+        """
+            Adds one of the user's top tracks.
+        """
+        position = self.track_count
+        self.track_count += 1
+        self.total_duration_ms += track['duration_ms']
+
+        if position < TOP_ALBUMS_COUNT:
+            album = track['album']
+            self.top_albums.append({
+                'name': album['name'],
+                'artist': album['artists'][0]['name'],
+                'image_url': album['images'][0]['url'] if album['images'] else None
+            })
+
+        if position < MOOD_TRACKS_COUNT:
+            self.mood_tracks.append(track)
+
+    def add_artist(self, artist):
+        """
+            Adds one of the user's top artists.
+        """
+        for genre in artist.get('genres', []):
+            self.total_genres_played += 1
+            self.genre_counts[genre] = self.genre_counts.get(genre, 0) + 1
+
+    def add_play(self, item):
+        """
+            Adds one recently played item (`{'track': ..., 'played_at': ...}`).
+        """
+        self.time_of_day[time_of_day(played_at_hour(item['played_at']))] += 1
+
+        track = item['track']
+        track_id = track['id']
+        if track_id == self._last_track_id:
+            self._current_streak += 1
+        else:
+            self._close_streak()
+            self._last_track_id = track_id
+            self._current_streak = 1
+            self.streak_tracks.setdefault(track_id, track)
+
+    def _close_streak(self):
+        if self._last_track_id:
+            self.streaks[self._last_track_id] = max(self.streaks.get(self._last_track_id, 0), self._current_streak)
+
+    def listening_patterns(self):
+        """
+            Returns the time-of-day distribution as percentages.
+        """
+        return time_of_day_percentages(self.time_of_day)
+
+    def mood_playlists(self):
+        """
+            Sorts the first top tracks into the mood playlists.
+        """
+        playlists = {
+            'chill_vibes': [],
+            'workout_hits': [],
+            'study_tunes': [],
+        }
+        classifier = moods.MoodClassifier.for_language(self.language)
+        for track, mood in zip(self.mood_tracks, classifier.classify_many(self.mood_tracks)):
+            if mood is None:
+                # Distribute evenly if no keywords match
+                if len(playlists['chill_vibes']) <= len(playlists['workout_hits']) and len(playlists['chill_vibes']) <= len(playlists['study_tunes']):
+                    mood = 'chill_vibes'
+                elif len(playlists['workout_hits']) <= len(playlists['study_tunes']):
+                    mood = 'workout_hits'
+                else:
+                    mood = 'study_tunes'
+            playlists[mood].append(track)
+        return playlists
+
+    def top_genres(self):
+        """
+            Returns the most frequent genres with their counts, most frequent first.
+        """
+        return sorted(self.genre_counts.items(), key=lambda x: x[1], reverse=True)[:TOP_GENRES_COUNT]
+
+    def longest_streaks(self):
+        """
+            Returns the longest back-to-back streaks of the same track.
+        """
+        self._close_streak()
+        sorted_streaks = sorted(self.streaks.items(), key=lambda x: x[1], reverse=True)[:TOP_STREAKS_COUNT]
+        longest_streaks = []
+        for track_id, streak_count in sorted_streaks:
+            track = self.streak_tracks[track_id]
+            longest_streaks.append({
+                'name': track['name'],
+                'streak': streak_count,
+                'album_art_url': album_art_url(track),
+            })
+        return longest_streaks
+
+    def result(self):
+        """
+            Returns every wrap metric accumulated so far.
+
+            Returns:
+                dict: `favorite_genres`, `genre_breakdown`, `total_genres_played`,
+                `top_albums`, `mood_playlists`, `listening_patterns`,
+                `longest_streaks`, `total_songs_played` and `total_duration_minutes`.
+        """
+        top_genres = self.top_genres()
+        return {
+            'favorite_genres': [genre for genre, _ in top_genres],
+            'genre_breakdown': dict(top_genres),
+            'total_genres_played': self.total_genres_played,
+            'top_albums': self.top_albums,
+            'mood_playlists': self.mood_playlists(),
+            'listening_patterns': self.listening_patterns(),
+            'longest_streaks': self.longest_streaks(),
+            'total_songs_played': self.track_count,
+            'total_duration_minutes': round(self.total_duration_ms / (1000 * 60), 2),  # Convert ms to minutes
+        }
+
+
+def compute_wrap_metrics(top_tracks, top_artists, recently_played, language=None):
+    """
+        Computes every wrap metric from the raw Spotify data.
+
+        Args:
+            top_tracks (iterable): The user's top tracks.
+            top_artists (iterable): The user's top artists.
+            recently_played (iterable): Recently played items, most recent first.
+            language (str): The user's language, which picks the mood keywords.
+
+        Returns:
+            dict: The metrics described in `WrapAggregator.result`.
+    """
+    aggregator = WrapAggregator(language)
+    for track in top_tracks:
+        aggregator.add_track(track)
+    for artist in top_artists:
+        aggregator.add_artist(artist)
+    for item in recently_played:
+        aggregator.add_play(item)
+    return aggregator.result()
@@ -1,6 +1,15 @@
 from django.apps import AppConfig
+from django.conf import settings
+from django.db.backends.signals import connection_created
 
 
 class WrappedConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'wrapped'
+
+    def ready(self):
+        from . import signals  # noqa: F401  (connects the signal receivers)
+
+        if settings.REQUEST_TIMING_ENABLED:
+            from . import timing
+            connection_created.connect(timing.instrument_connection)
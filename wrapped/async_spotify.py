@@ -0,0 +1,259 @@
+"""
+Async counterpart of `wrapped.spotify` for the ASGI views.
+
+Uses one `httpx.AsyncClient` per event loop, so a single process can keep many
+Spotify calls in flight at once. Timeouts, 429/`Retry-After` handling, latency
+metrics and the per-user response cache behave exactly like the sync client.
+"""
+import asyncio
+from collections import deque
+from itertools import islice
+import logging
+import time
+
+import httpx
+from django.conf import settings
+
+from . import timing
+from .spotify import (
+    cache_key,
+    cache_timeout,
+    is_fresh,
+    is_last_page,
+    new_cache_entry,
+    next_retry_delay,
+    page_offsets,
+    parse_page,
+    response_cache,
+    token_request_data,
+    wrap_source_requests,
+)
+
+logger = logging.getLogger(__name__)
+
+# Event loop -> (its client, the task closing it when the loop shuts down)
+_clients = {}
+
+
+async def _close_with_loop(loop, client):
+    # Waits until the loop shuts down: asyncio.run and async_to_sync cancel the
+    # tasks left on a loop before closing it, which lets the client close cleanly
+    try:
+        await loop.create_future()
+    except asyncio.CancelledError:
+        if _clients.get(loop, (None,))[0] is client:
+            del _clients[loop]
+        await client.aclose()
+        raise
+
+
+def get_async_client():
+    """
+        Returns the `httpx.AsyncClient` for the running event loop.
+
+        A long-lived loop (under ASGI) keeps one client, and its connections,
+        for the life of the process. A loop made for a single call (e.g. by
+        `async_to_sync` under WSGI) has its client closed and forgotten when it
+        shuts down, so neither the client nor the loop outlive it.
+    """
+    loop = asyncio.get_running_loop()
+    entry = _clients.get(loop)
+    if entry is not None and not entry[0].is_closed:
+        return entry[0]
+
+    # Loops closed without cancelling their tasks never reach `_close_with_loop`
+    for closed in [other for other in _clients if other.is_closed()]:
+        del _clients[closed]
+    client = httpx.AsyncClient(
+        limits=httpx.Limits(max_keepalive_connections=settings.SPOTIFY_FETCH_WORKERS),
+    )
+    _clients[loop] = (client, loop.create_task(_close_with_loop(loop, client)))
+    return client
+
+
+async def send(method, url, endpoint, timeout=None, **kwargs):
+    """
+        Async version of `wrapped.spotify.send`.
+
+        Raises:
+            httpx.HTTPError: If the request could not be sent at all.
+    """
+    if timeout is None:
+        timeout = settings.SPOTIFY_API_TIMEOUT
+    client = get_async_client()
+
+    attempt = 0
+    while True:
+        started = time.perf_counter()
+        try:
+            response = await client.request(method, url, timeout=timeout, **kwargs)
+        except httpx.HTTPError:
+            timing.record_spotify_call(endpoint, time.perf_counter() - started, ok=False)
+            raise
+        timing.record_spotify_call(endpoint, time.perf_counter() - started, ok=response.is_success)
+
+        delay = next_retry_delay(response, method, endpoint, attempt)
+        if delay is None:
+            return response
+        await asyncio.sleep(delay)
+        attempt += 1
+
+
+class AsyncSpotifyClient:
+    """
+    Async version of `wrapped.spotify.SpotifyClient`.
+    """
+
+    def __init__(self, access_token, timeout=None, cache_user=None):
+        self.access_token = access_token
+        self.timeout = timeout
+        self.cache_user = cache_user
+
+    @property
+    def headers(self):
+        return {'Authorization': f'Bearer {self.access_token}'}
+
+    async def get(self, path, params=None, extra_headers=None):
+        url = f'{settings.SPOTIFY_API_BASE_URL}{path}'
+        headers = self.headers
+        if extra_headers:
+            headers.update(extra_headers)
+        return await send('GET', url, path, timeout=self.timeout, headers=headers, params=params)
+
+    async def get_items(self, path, params=None, cache=False):
+        """
+            Async version of `SpotifyClient.get_items`.
+        """
+        use_cache = cache and self.cache_user is not None
+        entry = None
+        extra_headers = None
+        if use_cache:
+            key = cache_key(self.cache_user, path, params)
+            entry = await response_cache().aget(key)
+            if entry is not None:
+                if is_fresh(entry):
+                    return entry['items']
+                if entry['etag']:
+                    extra_headers = {'If-None-Match': entry['etag']}
+
+        try:
+            response = await self.get(path, params, extra_headers)
+        except httpx.HTTPError as exc:
+            logger.warning("Spotify request to %s failed: %s", path, exc)
+            return entry['items'] if entry is not None else []
+
+        if response.status_code == 304 and entry is not None:
+            entry['fetched_at'] = time.time()
+            await response_cache().aset(key, entry, cache_timeout())
+            return entry['items']
+
+        page = parse_page(response, path)
+        if page is None:
+            return entry['items'] if entry is not None else []
+
+        items = page['items']
+        if use_cache:
+            await response_cache().aset(key, new_cache_entry(items, response.headers.get('ETag')), cache_timeout())
+        return items
+
+    async def get_page(self, path, params=None, offset=0, limit=50):
+        """
+            Async version of `SpotifyClient.get_page`.
+        """
+        params = {**(params or {}), 'limit': limit}
+        if offset is not None:
+            params['offset'] = offset
+        try:
+            response = await self.get(path, params)
+        except httpx.HTTPError as exc:
+            logger.warning("Spotify request to %s failed: %s", path, exc)
+            return None
+        return parse_page(response, path)
+
+    async def iter_items(self, path, params=None, limit=50):
+        """
+            Async version of `SpotifyClient.iter_items`; the remaining pages are
+            fetched concurrently on the event loop.
+        """
+        first_page = await self.get_page(path, params, 0, limit)
+        if first_page is None:
+            return
+        for item in first_page['items']:
+            yield item
+
+        offsets = page_offsets(first_page, limit)
+        if offsets is None:
+            # No total: one page at a time until the last one
+            offset = limit
+            while True:
+                page = await self.get_page(path, params, offset, limit)
+                if page is None:
+                    return
+                for item in page['items']:
+                    yield item
+                if is_last_page(page, limit):
+                    return
+                offset += limit
+
+        # Keep up to SPOTIFY_PAGES_IN_FLIGHT pages requested ahead of the consumer
+        offsets = iter(offsets)
+        tasks = deque(asyncio.ensure_future(self.get_page(path, params, offset, limit))
+                      for offset in islice(offsets, settings.SPOTIFY_PAGES_IN_FLIGHT))
+        try:
+            while tasks:
+                page = await tasks.popleft()
+                for offset in islice(offsets, 1):
+                    tasks.append(asyncio.ensure_future(self.get_page(path, params, offset, limit)))
+                if page is None:
+                    return
+                for item in page['items']:
+                    yield item
+                if is_last_page(page, limit):
+                    return
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def fetch_wrap_sources(self, time_frame):
+        """
+            Async version of `SpotifyClient.fetch_wrap_sources`; the calls run
+            concurrently on the event loop instead of a thread pool.
+        """
+        started = time.perf_counter()
+        requests_to_make = wrap_source_requests(time_frame)
+        tasks = {
+            name: asyncio.ensure_future(self.get_items(path, params, cache))
+            for name, (path, params, cache) in requests_to_make.items()
+        }
+        await asyncio.wait(tasks.values(), timeout=settings.SPOTIFY_FANOUT_DEADLINE)
+
+        results = {}
+        for name, task in tasks.items():
+            if not task.done():
+                logger.warning("Spotify fetch for %s missed the %ss deadline", name, settings.SPOTIFY_FANOUT_DEADLINE)
+                task.cancel()
+                results[name] = []
+            elif task.exception() is not None:
+                logger.error("Spotify fetch for %s failed", name, exc_info=task.exception())
+                results[name] = []
+            else:
+                results[name] = task.result()
+
+        logger.debug("Spotify fan-out finished in %.3fs", time.perf_counter() - started)
+        return results
+
+
+async def exchange_code(code, redirect_uri):
+    """
+        Async version of `wrapped.spotify.exchange_code`.
+    """
+    url = f'{settings.SPOTIFY_ACCOUNTS_BASE_URL}/api/token'
+    try:
+        response = await send('POST', url, '/api/token', data=token_request_data(code, redirect_uri))
+    except httpx.HTTPError as exc:
+        logger.warning("Spotify token exchange failed: %s", exc)
+        return None
+
+    if response.status_code != 200:
+        return None
+    return response.json()
@@ -0,0 +1,121 @@
+"""
+Async versions of the Spotify-bound views, for serving over ASGI.
+
+While a request waits on Spotify these views yield the event loop instead of a
+whole worker, so one process can keep many wraps in flight. They are routed in
+place of their sync counterparts when `ASYNC_SPOTIFY_VIEWS` is enabled; see the
+README for how to serve the project over ASGI.
+"""
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.decorators import login_required
+from django.shortcuts import redirect
+from django.utils.translation import gettext_lazy as _
+
+from . import async_spotify, generation, history, jobs, snapshots, token_store
+from .views import SPOTIFY_REDIRECT_URI, create_wrap, render_localized, render_wrap
+
+
+# Spotify callback view
+async def callback(request):
+    """
+        Handles the Spotify OAuth callback, exchanging the code for an access token.
+
+        Args:
+            request (HttpRequest): The HTTP request object.
+
+        Returns:
+            HttpResponse: A redirect to the generate-wrap view or an error page.
+    """
+    code = request.GET.get('code')
+    tokens = await async_spotify.exchange_code(code, SPOTIFY_REDIRECT_URI)
+    if tokens is not None:
+        user = await request.auser()
+        if user.is_authenticated:
+            # Kept with the refresh token so the next visits skip this redirect
+            await sync_to_async(token_store.save_tokens)(user, tokens)
+        else:
+            await request.session.aset('spotify_access_token', tokens.get('access_token'))
+        return redirect('generate-wrap')  # Redirect to the updated wrap view
+    else:
+        return await sync_to_async(render_localized)(
+            request, 'error.html', {'message': _('Spotify login failed.')}, request.preferences[1],
+        )
+
+async def get_top_tracks(access_token, time_frame):
+    """
+        Async version of `views.get_top_tracks`.
+    """
+    client = async_spotify.AsyncSpotifyClient(access_token)
+    return [track async for track in client.iter_items('/me/top/tracks', {'time_range': time_frame})]
+
+async def get_user_top_tracks(access_token):
+    """
+        Async version of `views.get_user_top_tracks`.
+    """
+    response = await async_spotify.AsyncSpotifyClient(access_token).get('/me/top/tracks', {'limit': 10})
+
+    page = async_spotify.parse_page(response, '/me/top/tracks')
+    return page['items'] if page is not None else None
+
+# Generate the user's Spotify wrap
+@login_required
+async def generate_wrap(request):
+    """
+        Async version of `views.generate_wrap`.
+
+        Spotify is called with the async client; sessions, the cache and the ORM
+        are used through their async APIs, and template rendering runs in a
+        worker thread because it touches the lazily loaded `request.user`.
+
+        Args:
+            request (HttpRequest): The HTTP request object.
+
+        Returns:
+            HttpResponse: The rendered wrap template or a redirect to Spotify login.
+    """
+    user = await request.auser()
+    saving = request.method == 'POST' and 'save_wrap' in request.POST
+
+    # Save straight from the snapshot staged when the wrap was rendered
+    if saving:
+        staged = await sync_to_async(snapshots.take_wrap)(user.pk, request.POST.get('snapshot_id'))
+        if staged is not None:
+            await sync_to_async(create_wrap)(user, staged)
+            return redirect('dashboard')
+
+    # From the token store (refreshed if needed), else a token left in the session
+    access_token = await sync_to_async(token_store.get_access_token)(user)
+    if not access_token:
+        access_token = await request.session.aget('spotify_access_token')
+    if not access_token:
+        return redirect('spotify-login')
+
+    time_frame = request.POST.get('time_frame', 'short_term')
+    view_mode, language = request.preferences
+
+    if settings.WRAP_JOBS_ENABLED:
+        # Hand the work to a wrap worker and let the page poll for the result
+        job = await sync_to_async(jobs.enqueue_wrap_job)(
+            user, access_token, time_frame, view_mode, language, save=saving,
+        )
+        return await sync_to_async(render_localized)(
+            request, "wrap_pending.html", {"job": job, "view_mode": view_mode}, language,
+        )
+
+    client = async_spotify.AsyncSpotifyClient(access_token, cache_user=user.pk)
+    spotify_data = await client.fetch_wrap_sources(time_frame)
+    if saving:
+        await sync_to_async(history.record_plays)(user, spotify_data['recently_played'])
+    history_metrics = await sync_to_async(history.wrap_metrics)(user, spotify_data['recently_played'], time_frame)
+    context, wrap_data = generation.build_wrap_from_sources(
+        spotify_data, time_frame, view_mode, language, history_metrics=history_metrics,
+    )
+
+    # Save the wrap if requested (the snapshot was missing or had expired)
+    if saving:
+        await sync_to_async(create_wrap)(user, wrap_data)
+        return redirect('dashboard')
+
+    context['snapshot_id'] = await sync_to_async(snapshots.stage_wrap)(user.pk, wrap_data)
+    return await sync_to_async(render_wrap)(request, context)
@@ -0,0 +1,241 @@
+"""
+Shared catalog of the tracks, artists and albums shown in saved wraps.
+
+Popular tracks and artists appear in many users' wraps. With
+`WRAP_CATALOG_ENABLED` on, a saved wrap's top tracks and artists are upserted
+into `Track`, `Artist` and `Album` (keyed by their Spotify ids, a few bulk
+statements per save) and the wrap itself only keeps `WrapTrack`/`WrapArtist`
+rows holding the id and rank. `hydrate_wraps` turns those rows back into the
+nested dicts the templates read, for any number of wraps in two queries.
+
+Catalog rows hold the latest metadata seen for an item. What changes over time
+(an artist's genres, followers and image, an album's cover) is also kept on the
+rank rows as it was when the wrap was saved, so a saved wrap always shows what
+it was saved with; ids and names come from the catalog.
+
+Rows are upserted in primary key order, so concurrent saves touching the same
+popular tracks lock them in the same order and cannot deadlock.
+"""
+from django.conf import settings
+from django.db import transaction
+
+from . import payload
+from .models import Album, Artist, Track, WrapArtist, WrapTrack
+
+CATALOG_KEYS = ('top_tracks', 'top_artists')
+
+
+def _has_ids(items):
+    return isinstance(items, list) and all(isinstance(item, dict) and item.get('id') for item in items)
+
+
+def _first_image_url(item):
+    images = item.get('images') or []
+    return (images[0].get('url') or '') if images else ''
+
+
+def _by_id(rows):
+    # Rows keyed by primary key, in key order: every save locks shared rows in the same order
+    return [rows[key] for key in sorted(rows)]
+
+
+def split_wrap_data(data):
+    """
+        Separates a wrap's top tracks and artists from the rest of its data.
+
+        Args:
+            data (dict): Projected wrap data.
+
+        Returns:
+            tuple: The remaining data, the tracks and the artists; the tracks and
+            artists are None (and the data untouched) when they cannot go in the
+            catalog, e.g. because an item has no Spotify id.
+    """
+    if not isinstance(data, dict):
+        return data, None, None
+    tracks, artists = data.get('top_tracks'), data.get('top_artists')
+    if not (_has_ids(tracks) and _has_ids(artists)):
+        return data, None, None
+    rest = {key: value for key, value in data.items() if key not in CATALOG_KEYS}
+    return rest, tracks, artists
+
+
+def upsert_catalog(tracks, artists):
+    """
+        Inserts or updates the catalog rows for projected Spotify tracks and artists.
+
+        Rows are deduplicated first, so every table takes at most one bulk statement
+        (artists take two: performers only known by name must not wipe the genres
+        and followers of an artist already in the catalog).
+    """
+    albums, performers, track_rows = {}, {}, {}
+    for track in tracks:
+        album = track.get('album') or {}
+        if album.get('id'):
+            albums[album['id']] = Album(id=album['id'], name=album.get('name') or '', image_url=_first_image_url(album))
+        credited = [artist for artist in track.get('artists') or [] if artist.get('id')]
+        for artist in credited:
+            performers.setdefault(artist['id'], Artist(id=artist['id'], name=artist.get('name') or ''))
+        track_rows[track['id']] = Track(
+            id=track['id'],
+            name=track.get('name') or '',
+            duration_ms=track.get('duration_ms'),
+            album_id=album.get('id'),
+            artist_id=credited[0]['id'] if credited else None,
+        )
+    artist_rows = {artist['id']: Artist(
+        id=artist['id'],
+        name=artist.get('name') or '',
+        genres=artist.get('genres') or [],
+        followers=(artist.get('followers') or {}).get('total'),
+        image_url=_first_image_url(artist),
+    ) for artist in artists}
+
+    if albums:
+        Album.objects.bulk_create(
+            _by_id(albums), update_conflicts=True, unique_fields=['id'], update_fields=['name', 'image_url'],
+        )
+    name_only = {artist_id: artist for artist_id, artist in performers.items() if artist_id not in artist_rows}
+    if name_only:
+        Artist.objects.bulk_create(_by_id(name_only), ignore_conflicts=True)
+    if artist_rows:
+        Artist.objects.bulk_create(
+            _by_id(artist_rows), update_conflicts=True, unique_fields=['id'],
+            update_fields=['name', 'genres', 'followers', 'image_url'],
+        )
+    if track_rows:
+        Track.objects.bulk_create(
+            _by_id(track_rows), update_conflicts=True, unique_fields=['id'],
+            update_fields=['name', 'duration_ms', 'album', 'artist'],
+        )
+
+
+def store_catalog(entries, replace=False):
+    """
+        Puts the top tracks and artists of several wraps into the catalog.
+
+        Args:
+            entries (list): `(wrap_id, tracks, artists)` tuples, from `split_wrap_data`.
+            replace (bool): Drop the wraps' existing rank rows first.
+    """
+    if not entries:
+        return
+    upsert_catalog(
+        [track for _, tracks, _ in entries for track in tracks],
+        [artist for _, _, artists in entries for artist in artists],
+    )
+    if replace:
+        wrap_ids = [wrap_id for wrap_id, _, _ in entries]
+        WrapTrack.objects.filter(wrap_id__in=wrap_ids).delete()
+        WrapArtist.objects.filter(wrap_id__in=wrap_ids).delete()
+    WrapTrack.objects.bulk_create([
+        WrapTrack(wrap_id=wrap_id, track_id=track['id'], rank=rank,
+                  image_url=_first_image_url(track.get('album') or {}))
+        for wrap_id, tracks, _ in entries for rank, track in enumerate(tracks)
+    ])
+    WrapArtist.objects.bulk_create([
+        WrapArtist(wrap_id=wrap_id, artist_id=artist['id'], rank=rank, genres=artist.get('genres') or [],
+                   followers=(artist.get('followers') or {}).get('total'), image_url=_first_image_url(artist))
+        for wrap_id, _, artists in entries for rank, artist in enumerate(artists)
+    ])
+
+
+def save_wrap(wrap):
+    """
+        Saves a new wrap, moving its top tracks and artists into the catalog.
+
+        Without `WRAP_CATALOG_ENABLED`, or for data the catalog cannot hold, the
+        wrap is saved as it is. Either way `wrap.data` is left whole.
+
+        Args:
+            wrap (SpotifyWrap): The unsaved wrap.
+
+        Returns:
+            SpotifyWrap: The saved wrap.
+    """
+    data = wrap.data = payload.project_wrap_data(wrap.data)
+    rest, tracks, artists = split_wrap_data(data)
+    if not settings.WRAP_CATALOG_ENABLED or tracks is None:
+        wrap.save()
+        return wrap
+
+    # The thumbnail comes from the tracks, so take it before they leave `data`
+    wrap.refresh_summary()
+    wrap.data = rest
+    try:
+        with transaction.atomic():
+            wrap.save()
+            store_catalog([(wrap.id, tracks, artists)])
+    finally:
+        wrap.data = data
+    return wrap
+
+
+def _image_list(url):
+    return [{'url': url}] if url else []
+
+
+def track_dict(row):
+    """
+        Returns a wrap's catalog track shaped like a projected Spotify track
+        object, with the album cover the wrap was saved with.
+
+        Args:
+            row (WrapTrack): The rank row, with its track, album and artist loaded.
+    """
+    track = row.track
+    album, artist = track.album, track.artist
+    return {
+        'id': track.id,
+        'name': track.name,
+        'duration_ms': track.duration_ms,
+        'artists': [{'id': artist.id, 'name': artist.name}] if artist else [],
+        'album': {'id': album.id, 'name': album.name, 'images': _image_list(row.image_url)} if album else {},
+    }
+
+
+def artist_dict(row):
+    """
+        Returns a wrap's catalog artist shaped like a projected Spotify artist
+        object, with the genres, followers and image the wrap was saved with.
+
+        Args:
+            row (WrapArtist): The rank row, with its artist loaded.
+    """
+    return {
+        'id': row.artist.id,
+        'name': row.artist.name,
+        'genres': row.genres,
+        'followers': {'total': row.followers},
+        'images': _image_list(row.image_url),
+    }
+
+
+def hydrate_wraps(wraps):
+    """
+        Fills in the top tracks and artists of wraps whose lists live in the catalog.
+
+        Wraps that still carry the lists in their data are left alone. Whatever
+        the number of wraps, this takes at most two queries.
+
+        Args:
+            wraps (iterable): `SpotifyWrap` instances with `data` loaded.
+
+        Returns:
+            list: The same wraps.
+    """
+    wraps = list(wraps)
+    missing_tracks = {wrap.id: wrap for wrap in wraps if isinstance(wrap.data, dict) and 'top_tracks' not in wrap.data}
+    missing_artists = {wrap.id: wrap for wrap in wraps if isinstance(wrap.data, dict) and 'top_artists' not in wrap.data}
+
+    if missing_tracks:
+        rows = (WrapTrack.objects.filter(wrap_id__in=missing_tracks)
+                .select_related('track__album', 'track__artist').order_by('wrap_id', 'rank'))
+        for row in rows:
+            missing_tracks[row.wrap_id].data.setdefault('top_tracks', []).append(track_dict(row))
+    if missing_artists:
+        rows = (WrapArtist.objects.filter(wrap_id__in=missing_artists)
+                .select_related('artist').order_by('wrap_id', 'rank'))
+        for row in rows:
+            missing_artists[row.wrap_id].data.setdefault('top_artists', []).append(artist_dict(row))
+    return wraps
@@ -0,0 +1,156 @@
+"""
+Cross-user cohort reports over stored wraps.
+
+Only the fields a report needs are pulled out of `SpotifyWrap.data` (via JSON key
+lookups in the query, not by loading whole blobs), in chunks, and turned into
+columnar NumPy arrays. All aggregation then happens with vectorized operations
+on those arrays instead of per-row Python loops.
+
+A cohort is the month a user signed up; every report row is one
+(cohort, time_frame) group.
+"""
+import time
+
+import numpy as np
+
+from .models import SpotifyWrap
+
+TIME_OF_DAY_BUCKETS = ('morning', 'afternoon', 'evening', 'night')
+
+REPORT_FIELDS = (
+    'time_frame',
+    'user__date_joined',
+    'data__listening_patterns__time_of_day',
+    'data__total_duration_minutes',
+    'data__genre_breakdown',
+)
+
+
+class CohortReport:
+    """
+    Accumulates cohort aggregates chunk by chunk.
+
+    Groups and genres are interned to integer ids as they are first seen; the
+    per-group sums live in NumPy arrays that grow with the number of groups and
+    genres, not with the number of wraps.
+    """
+
+    def __init__(self):
+        self.groups = {}
+        self.genres = {}
+        self.wrap_counts = np.zeros(0, dtype=np.int64)
+        self.duration_sums = np.zeros(0, dtype=np.float64)
+        self.time_of_day_sums = np.zeros((0, len(TIME_OF_DAY_BUCKETS)), dtype=np.float64)
+        self.time_of_day_counts = np.zeros(0, dtype=np.int64)
+        self.genre_counts = np.zeros((0, 0), dtype=np.int64)
+        self.rows = 0
+
+    def _intern(self, table, key):
+        value = table.get(key)
+        if value is None:
+            value = table[key] = len(table)
+        return value
+
+    def _grow(self):
+        group_count, genre_count = len(self.groups), len(self.genres)
+        extra_groups = group_count - self.wrap_counts.shape[0]
+        if extra_groups:
+            self.wrap_counts = np.pad(self.wrap_counts, (0, extra_groups))
+            self.duration_sums = np.pad(self.duration_sums, (0, extra_groups))
+            self.time_of_day_sums = np.pad(self.time_of_day_sums, ((0, extra_groups), (0, 0)))
+            self.time_of_day_counts = np.pad(self.time_of_day_counts, (0, extra_groups))
+        extra_genres = genre_count - self.genre_counts.shape[1]
+        if extra_groups or extra_genres:
+            self.genre_counts = np.pad(self.genre_counts, ((0, extra_groups), (0, extra_genres)))
+
+    def add_chunk(self, rows):
+        """
+            Adds a chunk of rows shaped like `REPORT_FIELDS`.
+        """
+        if not rows:
+            return
+
+        group_ids = np.empty(len(rows), dtype=np.int64)
+        durations = np.zeros(len(rows), dtype=np.float64)
+        time_of_day = np.zeros((len(rows), len(TIME_OF_DAY_BUCKETS)), dtype=np.float64)
+        has_time_of_day = np.zeros(len(rows), dtype=bool)
+        genre_rows, genre_ids, genre_values = [], [], []
+
+        # Columnize the chunk; this is the only per-row Python work
+        for index, (time_frame, date_joined, patterns, duration, breakdown) in enumerate(rows):
+            group_ids[index] = self._intern(self.groups, (date_joined.strftime('%Y-%m'), time_frame))
+            if duration is not None:
+                durations[index] = duration
+            if patterns:
+                has_time_of_day[index] = True
+                time_of_day[index] = [patterns.get(bucket, 0) for bucket in TIME_OF_DAY_BUCKETS]
+            for genre, count in (breakdown or {}).items():
+                genre_rows.append(group_ids[index])
+                genre_ids.append(self._intern(self.genres, genre))
+                genre_values.append(count)
+
+        self._grow()
+        group_count = len(self.groups)
+        self.wrap_counts += np.bincount(group_ids, minlength=group_count)
+        self.duration_sums += np.bincount(group_ids, weights=durations, minlength=group_count)
+        np.add.at(self.time_of_day_sums, group_ids[has_time_of_day], time_of_day[has_time_of_day])
+        self.time_of_day_counts += np.bincount(group_ids[has_time_of_day], minlength=group_count)
+        if genre_values:
+            np.add.at(self.genre_counts, (np.array(genre_rows), np.array(genre_ids)), np.array(genre_values))
+        self.rows += len(rows)
+
+    def summary(self, top_genres=5):
+        """
+            Returns one dict per (cohort, time_frame) group, sorted by cohort.
+
+            Each dict has the wrap count, total and mean listening minutes, the
+            mean time-of-day distribution (in percent) and the most frequent genres.
+        """
+        genre_names = np.array(list(self.genres), dtype=object)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean_durations = self.duration_sums / self.wrap_counts
+            mean_time_of_day = self.time_of_day_sums / self.time_of_day_counts[:, None]
+        mean_time_of_day = np.nan_to_num(mean_time_of_day)
+        # Highest counts first; argsort is stable so ties keep first-seen order
+        genre_order = np.argsort(-self.genre_counts, axis=1, kind='stable')[:, :top_genres]
+
+        results = []
+        for (cohort, time_frame), group_id in sorted(self.groups.items()):
+            order = genre_order[group_id]
+            counts = self.genre_counts[group_id, order]
+            results.append({
+                'cohort': cohort,
+                'time_frame': time_frame,
+                'wraps': int(self.wrap_counts[group_id]),
+                'total_duration_minutes': round(float(self.duration_sums[group_id]), 2),
+                'mean_duration_minutes': round(float(mean_durations[group_id]), 2),
+                'time_of_day': dict(zip(TIME_OF_DAY_BUCKETS, np.round(mean_time_of_day[group_id], 2).tolist())),
+                'top_genres': dict(zip(genre_names[order[counts > 0]].tolist(), counts[counts > 0].tolist())),
+            })
+        return results
+
+
+def build_cohort_report(queryset=None, chunk_size=2000):
+    """
+        Builds a cohort report over stored wraps.
+
+        Args:
+            queryset (QuerySet): The wraps to include; all wraps by default.
+            chunk_size (int): How many rows to load and columnize at a time.
+
+        Returns:
+            tuple: The filled `CohortReport` and the elapsed time in seconds.
+    """
+    if queryset is None:
+        queryset = SpotifyWrap.objects.all()
+
+    started = time.perf_counter()
+    report = CohortReport()
+    chunk = []
+    for row in queryset.values_list(*REPORT_FIELDS).iterator(chunk_size=chunk_size):
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            report.add_chunk(chunk)
+            chunk = []
+    report.add_chunk(chunk)
+    return report, time.perf_counter() - started
@@ -0,0 +1,114 @@
+"""
+Builds a wrap from the user's Spotify data.
+
+Shared by the `generate_wrap` view, its async counterpart and the background
+wrap worker, so all of them produce exactly the same context and saved data.
+"""
+from . import analytics, history, payload, timing
+
+
+def build_wrap(client, time_frame, view_mode, language, progress=None, user=None, save=False):
+    """
+        Fetches the user's Spotify data and computes a wrap from it.
+
+        Args:
+            client (SpotifyClient): A client for the user's access token.
+            time_frame (str): The Spotify `time_range` to build the wrap for.
+            view_mode (str): The user's view mode, stored with the wrap.
+            language (str): The user's language, stored with the wrap.
+            progress (callable): Optional callback receiving a 0-100 progress value.
+            user (User): The listener; when given, listening patterns and streaks
+                come from their stored history (see `history.wrap_metrics`).
+            save (bool): Whether the wrap is going to be saved; only then are the
+                fetched plays added to the user's stored history.
+
+        Returns:
+            tuple: The template context and the data to store on `SpotifyWrap.data`.
+    """
+    # Fetch tracks, artists, recently played and playlists concurrently
+    spotify_data = client.fetch_wrap_sources(time_frame)
+    history_metrics = None
+    if user is not None:
+        if save:
+            history.record_plays(user, spotify_data['recently_played'])
+        history_metrics = history.wrap_metrics(user, spotify_data['recently_played'], time_frame)
+    if progress:
+        progress(60)
+
+    return build_wrap_from_sources(spotify_data, time_frame, view_mode, language, progress, history_metrics)
+
+
+def build_wrap_from_sources(spotify_data, time_frame, view_mode, language, progress=None, history_metrics=None):
+    """
+        Computes a wrap from already fetched Spotify data.
+
+        Args:
+            spotify_data (dict): The result of `fetch_wrap_sources`.
+            time_frame (str): The Spotify `time_range` the data was fetched for.
+            view_mode (str): The user's view mode, stored with the wrap.
+            language (str): The user's language, stored with the wrap.
+            progress (callable): Optional callback receiving a 0-100 progress value.
+            history_metrics (dict): Metrics from the stored history (`history.wrap_metrics`)
+                that replace the ones computed from the fetched plays.
+
+        Returns:
+            tuple: The template context and the data to store on `SpotifyWrap.data`.
+    """
+    top_tracks = spotify_data['top_tracks']
+    top_artists = spotify_data['top_artists']
+    recently_played = spotify_data['recently_played']
+    user_playlists = spotify_data['playlists']
+
+    #display limit to 5
+    top_tracks_display = top_tracks[:3]
+    top_artists_display = top_artists[:3]
+    top_tracks_details = top_tracks[:5]
+    top_artists_details = top_artists[:5]
+
+    # Compute every metric in a single pass over the fetched data
+    with timing.phase('compute'):
+        metrics = analytics.compute_wrap_metrics(top_tracks, top_artists, recently_played, language)
+    if history_metrics:
+        metrics.update(history_metrics)
+    if progress:
+        progress(90)
+
+    # Get the most popular playlist (first one is usually most relevant)
+    most_played_playlist = user_playlists[0] if user_playlists else None
+
+    wrap_name = f"Top Tracks - {time_frame.replace('_', ' ').title()}"
+    wrap_data = {
+        'wrap_name': wrap_name,
+        'time_frame': time_frame,
+        'top_tracks': [payload.project_track(track) for track in top_tracks_details],
+        'top_artists': [payload.project_artist(artist) for artist in top_artists_details],
+        'favorite_genres': metrics['favorite_genres'],
+        'top_albums': metrics['top_albums'],
+        'longest_streaks': metrics['longest_streaks'],
+        'total_songs_played': metrics['total_songs_played'],  # Total number of songs played
+        'total_duration_minutes': metrics['total_duration_minutes'],  # Total listening time in minutes
+        'total_genres_played': metrics['total_genres_played'],  # Total number of genres played
+        'listening_patterns': metrics['listening_patterns'],  # The time-of-day patterns
+        'genre_breakdown': metrics['genre_breakdown'],  # Detailed genre breakdown (if needed for charts)
+        "view_mode": view_mode,
+        "language": language
+    }
+
+    context = {
+        'time_frame': time_frame,
+        'top_tracks': top_tracks_display,
+        'top_artists': top_artists_display,
+        'favorite_genres': metrics['favorite_genres'],
+        'top_albums': metrics['top_albums'],
+        'listening_patterns': metrics['listening_patterns'],
+        'genre_breakdown': metrics['genre_breakdown'],
+        'mood_playlists': metrics['mood_playlists'],
+        'longest_streaks': metrics['longest_streaks'],
+        'total_songs_played': metrics['total_songs_played'],
+        'total_genres_played': metrics['total_genres_played'],
+        'total_duration_minutes': metrics['total_duration_minutes'],
+        'most_played_playlist': most_played_playlist,
+        "view_mode": view_mode,
+        "language": language
+    }
+    return context, wrap_data
@@ -0,0 +1,220 @@
+"""
+Persistent listening history.
+
+Spotify's `recently-played` endpoint only ever returns the last 50 plays, which
+makes listening patterns and streaks computed from a single response tiny and
+noisy. Plays are therefore accumulated as `PlayEvent` rows: `sync_user` asks for
+the plays after the newest stored one (the `after` cursor), so each sync only
+does work for new plays, and `(user, played_at)` is unique, so syncing the same
+plays twice stores them once. `manage.py sync_play_history` syncs every user
+with a stored Spotify token; saving a freshly generated wrap also stores the
+plays it fetched.
+
+Storing plays also updates the listening rollups (see `wrapped.rollups`), which
+is what wraps read their patterns and streaks from. Rendering a wrap only reads
+them: fetched plays that are not stored yet are counted in memory, so a wrap
+that is looked at but never saved takes no locks and writes nothing.
+`recent_plays` streams the stored history itself back in Spotify's item shape,
+most recent first.
+"""
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from . import catalog, payload, rollups
+from .models import PlayEvent
+
+RECENTLY_PLAYED_PATH = '/me/player/recently-played'
+PAGE_SIZE = 50
+
+# How far back each wrap time frame looks in the stored history (None: all of it),
+# matching the periods Spotify uses for its top items
+TIME_FRAME_DAYS = {
+    'short_term': 28,
+    'medium_term': 182,
+    'long_term': None,
+}
+
+
+def parse_played_at(played_at):
+    """
+        Parses a Spotify `played_at` timestamp (`2024-11-26T17:54:03.123Z`) to an aware datetime.
+    """
+    return parse_datetime(played_at)
+
+
+def cursor(user):
+    """
+        Returns the `after` cursor for `user`: the newest stored play in Unix
+        milliseconds, or None if nothing is stored yet.
+    """
+    latest = (PlayEvent.objects.filter(user=user).order_by('-played_at')
+              .values_list('played_at', flat=True).first())
+    return round(latest.timestamp() * 1000) if latest else None
+
+
+def parse_plays(user, items, after=None):
+    """
+        Turns recently played items into unsaved `PlayEvent`s.
+
+        Args:
+            user (User): The listener.
+            items (iterable): `{'track': ..., 'played_at': ...}` items from Spotify.
+            after (int): A cursor; plays at or before it are skipped.
+
+        Returns:
+            tuple: The events keyed by `played_at`, and the projected tracks they
+            played keyed by id.
+    """
+    after_time = datetime.fromtimestamp(after / 1000, dt_timezone.utc) if after is not None else None
+    tracks, events = {}, {}
+    for item in items:
+        track = item.get('track') or {}
+        if not track.get('id'):
+            continue  # Local files have no Spotify id
+        played_at = parse_played_at(item['played_at'])
+        if after_time is not None and played_at <= after_time:
+            continue
+        tracks[track['id']] = payload.project_track(track)
+        events[played_at] = PlayEvent(user=user, track_id=track['id'], played_at=played_at)
+    return events, tracks
+
+
+def store_plays(user, items, after=None):
+    """
+        Stores recently played items for `user` and adds them to the rollups.
+
+        Args:
+            user (User): The listener.
+            items (iterable): `{'track': ..., 'played_at': ...}` items from Spotify.
+            after (int): The cursor the items were fetched with; older plays are
+                already stored and skipped without a query.
+
+        Returns:
+            int: The number of plays that were new.
+    """
+    events, tracks = parse_plays(user, items, after)
+    if not events:
+        return 0
+    catalog.upsert_catalog(list(tracks.values()), [])
+    with transaction.atomic():
+        # A concurrent sync may have stored some of these plays; re-read the
+        # newest play under the lock so the rollups count each play once
+        rollups.lock_history(user)
+        latest = (PlayEvent.objects.filter(user=user).order_by('-played_at')
+                  .values_list('played_at', flat=True).first())
+        new_events = [events[played_at] for played_at in sorted(events) if latest is None or played_at > latest]
+        PlayEvent.objects.bulk_create(new_events)
+        rollups.add_plays(user, new_events)
+    return len(new_events)
+
+
+def sync_user(user, client):
+    """
+        Fetches and stores the plays newer than `user`'s stored history.
+
+        Args:
+            user (User): The listener.
+            client (SpotifyClient): A client for the user's access token.
+
+        Returns:
+            int: The number of new plays, or None if Spotify could not be read.
+    """
+    after = cursor(user)
+    added = 0
+    while True:
+        params = {'after': after} if after is not None else None
+        page = client.get_page(RECENTLY_PLAYED_PATH, params, offset=None, limit=PAGE_SIZE)
+        if page is None:
+            return added or None
+        added += store_plays(user, page['items'], after)
+
+        # A full page may have more plays after it; the response says where to resume
+        next_after = (page.get('cursors') or {}).get('after')
+        if len(page['items']) < PAGE_SIZE or not next_after or int(next_after) == after:
+            return added
+        after = int(next_after)
+
+
+def recent_plays(user, time_frame=None, chunk_size=2000):
+    """
+        Streams `user`'s stored plays, most recent first, shaped like Spotify's
+        recently played items.
+
+        Args:
+            user (User): The listener.
+            time_frame (str): Only plays within this wrap time frame (see `TIME_FRAME_DAYS`).
+            chunk_size (int): Rows fetched from the database at a time.
+
+        Yields:
+            dict: `{'track': ..., 'played_at': ...}` items.
+    """
+    queryset = PlayEvent.objects.filter(user=user)
+    days = TIME_FRAME_DAYS.get(time_frame)
+    if days is not None:
+        queryset = queryset.filter(played_at__gte=timezone.now() - timedelta(days=days))
+    rows = (queryset.order_by('-played_at')
+            .values_list('played_at', 'track_id', 'track__name', 'track__album__image_url')
+            .iterator(chunk_size=chunk_size))
+    for played_at, track_id, name, image_url in rows:
+        yield {
+            'track': {
+                'id': track_id,
+                'name': name,
+                'album': {'images': [{'url': image_url}] if image_url else []},
+            },
+            'played_at': played_at.astimezone(dt_timezone.utc).isoformat(),
+        }
+
+
+def record_plays(user, items):
+    """
+        Stores the plays fetched for a wrap that is being saved.
+
+        Does nothing with `PLAY_HISTORY_ENABLED` off.
+
+        Args:
+            user (User): The listener.
+            items (iterable): The recently played items fetched for the wrap.
+
+        Returns:
+            int: The number of plays that were new.
+    """
+    if not settings.PLAY_HISTORY_ENABLED:
+        return 0
+    return store_plays(user, items, cursor(user))
+
+
+def wrap_metrics(user, fetched_plays, time_frame):
+    """
+        Returns the listening patterns and streaks of a wrap, from `user`'s
+        stored history.
+
+        Only reads: the fetched plays newer than the stored history are added
+        to the rollups in memory, so the wrap is up to date even without
+        `sync_play_history`, and they are stored only if the wrap is saved
+        (`record_plays`). With `PLAY_HISTORY_ENABLED` off this returns None and
+        the wrap uses the fetched plays as they are.
+
+        Args:
+            user (User): The listener.
+            fetched_plays (list): The recently played items fetched for the wrap.
+            time_frame (str): The wrap's time frame.
+
+        Returns:
+            dict: `listening_patterns` and `longest_streaks`, as in
+            `WrapAggregator.result`, or None.
+    """
+    if not settings.PLAY_HISTORY_ENABLED:
+        return None
+    events, tracks = parse_plays(user, fetched_plays, cursor(user))
+    pending = [events[played_at] for played_at in sorted(events)]
+    days = TIME_FRAME_DAYS.get(time_frame)
+    since = timezone.now() - timedelta(days=days) if days is not None else None
+    return {
+        'listening_patterns': rollups.listening_patterns(user, since, pending),
+        'longest_streaks': rollups.longest_streaks(user, since, pending, tracks),
+    }
@@ -0,0 +1,125 @@
+"""
+Database-backed queue for generating wraps in the background.
+
+Jobs are `WrapJob` rows. Workers (`manage.py run_wrap_worker`) claim the oldest
+pending job with a conditional UPDATE, so several workers can share the table
+without an external broker and without two of them running the same job.
+
+The Spotify access token a job runs with is stored encrypted by `token_store`
+and cleared as soon as the job has finished.
+"""
+import logging
+
+from django.db.models import Q
+from django.utils import timezone
+
+from . import catalog, generation, spotify, token_store
+from .models import SpotifyWrap, WrapJob
+
+logger = logging.getLogger(__name__)
+
+
+def enqueue_wrap_job(user, access_token, time_frame, view_mode, language, save=False):
+    """
+        Queues a wrap for generation.
+
+        Args:
+            save (bool): Save the wrap once it is generated, as a save request
+                whose snapshot had expired asked for.
+
+        Returns:
+            WrapJob: The pending job.
+    """
+    return WrapJob.objects.create(
+        user=user,
+        access_token=token_store.encrypt(access_token),
+        time_frame=time_frame,
+        view_mode=view_mode,
+        language=language,
+        save_on_completion=save,
+    )
+
+
+def claim_next_job():
+    """
+        Claims the oldest pending job for this worker.
+
+        Returns:
+            WrapJob: The claimed job, now marked running, or None if the queue is empty.
+    """
+    while True:
+        job_id = (WrapJob.objects.filter(status=WrapJob.STATUS_PENDING)
+                  .order_by('created_at', 'id').values_list('id', flat=True).first())
+        if job_id is None:
+            return None
+
+        # Only one worker can move the row out of "pending"; the others retry
+        claimed = WrapJob.objects.filter(id=job_id, status=WrapJob.STATUS_PENDING).update(
+            status=WrapJob.STATUS_RUNNING,
+            started_at=timezone.now(),
+        )
+        if claimed:
+            return WrapJob.objects.select_related('user').get(id=job_id)
+
+
+def requeue_stale_jobs(older_than):
+    """
+        Puts jobs that have been running for longer than `older_than` back on the
+        queue, e.g. after a worker was killed mid-job. A job that was only slow
+        is run again; its first run then finds it requeued and drops its own
+        outcome (see `run_job`).
+
+        Returns:
+            int: The number of jobs requeued.
+    """
+    cutoff = timezone.now() - older_than
+    return WrapJob.objects.filter(
+        Q(started_at__lt=cutoff) | Q(started_at__isnull=True),
+        status=WrapJob.STATUS_RUNNING,
+    ).update(status=WrapJob.STATUS_PENDING, started_at=None, progress=0)
+
+
+def run_job(job):
+    """
+        Generates the wrap for a claimed job and stores the outcome on it.
+
+        If the job was requeued while it ran (see `requeue_stale_jobs`), this run
+        no longer owns it: its progress, outcome and saved wrap are dropped so
+        they cannot overwrite those of the run that claimed the job since.
+    """
+    # The job as this run claimed it
+    owned = WrapJob.objects.filter(id=job.id, status=WrapJob.STATUS_RUNNING, started_at=job.started_at)
+
+    def report_progress(value):
+        owned.update(progress=value)
+
+    try:
+        access_token = token_store.decrypt(job.access_token)
+        if access_token is None:
+            raise ValueError("Spotify access token is missing.")
+        client = spotify.SpotifyClient(access_token, cache_user=job.user_id)
+        context, wrap_data = generation.build_wrap(
+            client, job.time_frame, job.view_mode, job.language, progress=report_progress, user=job.user,
+            save=job.save_on_completion,
+        )
+        result = {'context': context, 'data': wrap_data}
+        if job.save_on_completion and owned.exists():
+            result['wrap_id'] = catalog.save_wrap(SpotifyWrap(
+                user=job.user, time_frame=wrap_data['time_frame'], created_at=timezone.now(), data=wrap_data,
+            )).id
+    except Exception as exc:
+        logger.exception("Wrap job %s failed", job.id)
+        job.status = WrapJob.STATUS_FAILED
+        job.error = str(exc) or exc.__class__.__name__
+    else:
+        job.status = WrapJob.STATUS_DONE
+        job.progress = 100
+        job.result = result
+
+    job.access_token = ''
+    job.finished_at = timezone.now()
+    fields = ['status', 'progress', 'result', 'error', 'access_token', 'finished_at']
+    if not owned.update(**{field: getattr(job, field) for field in fields}):
+        logger.warning("Wrap job %s was requeued while it ran; dropping this run's outcome", job.id)
+        job.refresh_from_db()
+    return job
@@ -0,0 +1,93 @@
+import json
+import random
+import statistics
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from wrapped import moods
+
+
+def sample_tracks(count, seed=0):
+    """
+        Returns made-up tracks whose names mix mood keywords with other words.
+    """
+    rng = random.Random(seed)
+    keywords = [keyword for language in moods.KEYWORDS.values() for words in language.values() for keyword in words]
+    filler = ['love', 'summer', 'heart', 'city', 'lights', 'forever', 'blue', 'home', 'road', 'girl', 'stars', 'gold']
+    tracks = []
+    for index in range(count):
+        words = rng.sample(filler, 3) + ([rng.choice(keywords)] if rng.random() < 0.4 else [])
+        rng.shuffle(words)
+        tracks.append({
+            'id': f'track{index}',
+            'name': ' '.join(words).title(),
+            'artists': [{'name': f'{rng.choice(filler).title()} {rng.choice(filler).title()}'}],
+        })
+    return tracks
+
+
+def keyword_scan(tracks, language):
+    """
+        Classifies tracks the way wraps used to: a substring scan per keyword and track.
+    """
+    keywords = moods.keywords_for(language)
+    results = []
+    for track in tracks:
+        track_name = track.get('name', '').lower()
+        artist_name = track.get('artists', [{}])[0].get('name', '').lower()
+        results.append(next((
+            mood for mood in moods.MOODS
+            if any(keyword in track_name or keyword in artist_name for keyword in keywords[mood])
+        ), None))
+    return results
+
+
+class Command(BaseCommand):
+    help = "Measures mood classification throughput against the old per-keyword scan."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[9, 50, 10000],
+                            help="Batch sizes to measure (top tracks shown, all top tracks, a play history).")
+        parser.add_argument('--iterations', type=int, default=20, help="Runs per batch size and language.")
+        parser.add_argument('--json', action='store_true', help="Print the results as JSON.")
+
+    def measure(self, function, iterations):
+        timings = []
+        for _ in range(iterations):
+            started = time.perf_counter()
+            function()
+            timings.append(time.perf_counter() - started)
+        return statistics.median(timings)
+
+    def handle(self, *args, **options):
+        rows = []
+        for language, _ in settings.LANGUAGES:
+            classifier = moods.MoodClassifier.for_language(language)
+            for size in options['sizes']:
+                tracks = sample_tracks(size)
+                # Both must agree before their speed means anything
+                if classifier.classify_many(tracks) != keyword_scan(tracks, language):
+                    raise CommandError(f"Batch and scan disagree on {size} {language} tracks")
+                scan = self.measure(lambda: keyword_scan(tracks, language), options['iterations'])
+                batch = self.measure(lambda: classifier.classify_many(tracks), options['iterations'])
+                rows.append({
+                    'language': language,
+                    'tracks': size,
+                    'scan_ms': round(scan * 1000, 3),
+                    'batch_ms': round(batch * 1000, 3),
+                    'batch_tracks_per_second': round(size / batch) if batch else None,
+                    'speedup': round(scan / batch, 1) if batch else None,
+                })
+
+        if options['json']:
+            self.stdout.write(json.dumps(rows, indent=2))
+            return
+        for row in rows:
+            self.stdout.write(
+                f"{row['language']}  {row['tracks']:>6} tracks  scan {row['scan_ms']:9.3f} ms  "
+                f"batch {row['batch_ms']:9.3f} ms  {row['batch_tracks_per_second']:>10,} tracks/s  "
+                f"x{row['speedup']}"
+            )
+        self.stdout.write(self.style.SUCCESS("Batch and scan classified every track the same"))
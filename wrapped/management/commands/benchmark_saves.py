@@ -0,0 +1,132 @@
+import json
+import threading
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import DatabaseError, connection
+
+from wrapped import spotify_stub
+from wrapped.generation import build_wrap_from_sources
+from wrapped.management.commands.load_test import percentile
+from wrapped.models import Album, Artist, Track
+from wrapped.views import create_wrap
+
+# Catalog rows written by the benchmark; Spotify ids never contain a hyphen
+BENCH_PREFIX = 'bench-'
+
+
+def bench_item(item):
+    """
+        Returns a copy of a Spotify track or artist with its ids (and those of
+        its album and artists) under `BENCH_PREFIX`, so the rows can be removed.
+    """
+    item = json.loads(json.dumps(item))
+    item['id'] = BENCH_PREFIX + item['id']
+    if item.get('album', {}).get('id'):
+        item['album']['id'] = BENCH_PREFIX + item['album']['id']
+    for artist in item.get('artists', []):
+        if artist.get('id'):
+            artist['id'] = BENCH_PREFIX + artist['id']
+    return item
+
+
+def database_profile():
+    """
+        Describes the connection settings that matter for concurrent writes.
+    """
+    options = connection.settings_dict.get('OPTIONS', {})
+    profile = {'vendor': connection.vendor, 'conn_max_age': connection.settings_dict.get('CONN_MAX_AGE')}
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            profile['journal_mode'] = cursor.execute('PRAGMA journal_mode').fetchone()[0]
+            profile['synchronous'] = cursor.execute('PRAGMA synchronous').fetchone()[0]
+        profile['busy_timeout'] = options.get('timeout')
+        profile['transaction_mode'] = options.get('transaction_mode')
+    elif 'pool' in options:
+        profile['pool'] = {key: value for key, value in options['pool'].items() if key != 'check'}
+    return profile
+
+
+class Command(BaseCommand):
+    help = ("Saves wraps from concurrent threads, as simultaneous save-wrap requests would, and reports "
+            "throughput, latency percentiles and failed saves for the configured database.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8, help="Concurrent writers, each with its own connection.")
+        parser.add_argument('--saves', type=int, default=25, help="Wraps each writer saves.")
+        parser.add_argument('--json', action='store_true', help="Print the results as JSON.")
+
+    def writer(self, user, wrap_data, saves, start, timings, errors):
+        try:
+            start.wait()
+            for _ in range(saves):
+                started = time.perf_counter()
+                try:
+                    create_wrap(user, wrap_data)
+                except DatabaseError as exc:
+                    errors.append(str(exc))
+                timings.append(time.perf_counter() - started)
+        finally:
+            connection.close()
+
+    def handle(self, *args, **options):
+        sources = {
+            'top_tracks': [bench_item(track) for track in spotify_stub.scaled_items('top_tracks', 20)],
+            'top_artists': [bench_item(artist) for artist in spotify_stub.scaled_items('top_artists', 20)],
+            'recently_played': list(spotify_stub.scaled_items('recently_played_initial', 50)),
+            'playlists': [],
+        }
+        _, wrap_data = build_wrap_from_sources(sources, 'medium_term', 'dark', 'en')
+        users = [User.objects.create(username=f'{BENCH_PREFIX}saves-{index}') for index in range(options['threads'])]
+        profile = database_profile()
+
+        timings, errors = [], []
+        start = threading.Barrier(len(users) + 1)
+        threads = [
+            threading.Thread(target=self.writer, args=(user, wrap_data, options['saves'], start, timings, errors))
+            for user in users
+        ]
+        try:
+            for thread in threads:
+                thread.start()
+            start.wait()
+            started = time.perf_counter()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - started
+        finally:
+            # Their wraps (and the wraps' catalog ranks) go with the users
+            User.objects.filter(pk__in=[user.pk for user in users]).delete()
+            Track.objects.filter(id__startswith=BENCH_PREFIX).delete()
+            Album.objects.filter(id__startswith=BENCH_PREFIX).delete()
+            Artist.objects.filter(id__startswith=BENCH_PREFIX).delete()
+
+        timings.sort()
+        saved = len(timings) - len(errors)
+        results = {
+            'database': profile,
+            'threads': options['threads'],
+            'saves': len(timings),
+            'errors': len(errors),
+            'seconds': round(elapsed, 3),
+            'saves_per_second': round(saved / elapsed, 1) if elapsed else None,
+            'p50_ms': round(percentile(timings, 50) * 1000, 1) if timings else None,
+            'p95_ms': round(percentile(timings, 95) * 1000, 1) if timings else None,
+            'p99_ms': round(percentile(timings, 99) * 1000, 1) if timings else None,
+            'max_ms': round(timings[-1] * 1000, 1) if timings else None,
+            'first_error': errors[0] if errors else None,
+        }
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+
+        self.stdout.write(f"database: {json.dumps(profile)}")
+        self.stdout.write(f"p50 {results['p50_ms']} ms  p95 {results['p95_ms']} ms  "
+                          f"p99 {results['p99_ms']} ms  max {results['max_ms']} ms")
+        style = self.style.SUCCESS if not errors else self.style.WARNING
+        self.stdout.write(style(
+            f"{saved} of {results['saves']} saves from {options['threads']} threads in {results['seconds']}s "
+            f"({results['saves_per_second']} saves/s), {len(errors)} failed"
+            + (f": {errors[0]}" if errors else "")
+        ))
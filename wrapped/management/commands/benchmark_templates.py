@@ -0,0 +1,169 @@
+import json
+import os
+import resource
+import statistics
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.contrib.auth.forms import UserCreationForm
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.template import engines
+from django.template.loader import get_template
+from django.test import RequestFactory
+from django.utils import translation
+
+from wrapped.generation import build_wrap_from_sources
+from wrapped.models import SpotifyWrap
+
+PAGES = ('landing', 'login', 'register', 'about', 'user_settings', 'dashboard', 'wrapper', 'wrap_detail')
+
+
+def sample_spotify_data(count=20):
+    """
+        Returns made-up Spotify data shaped like `SpotifyClient.fetch_wrap_sources`.
+    """
+    images = [{'url': f'https://i.scdn.co/image/{size}'} for size in (640, 300, 64)]
+    tracks = [{
+        'id': f'track{index}',
+        'name': f'Track {index}',
+        'duration_ms': 180000 + index * 1000,
+        'artists': [{'name': f'Artist {index % 5}'}],
+        'album': {'name': f'Album {index}', 'artists': [{'name': f'Artist {index % 5}'}], 'images': images},
+    } for index in range(count)]
+    artists = [{
+        'name': f'Artist {index}',
+        'genres': ['pop', 'indie', f'genre {index}'],
+        'followers': {'total': 1000 * index},
+        'images': images,
+    } for index in range(count)]
+    plays = [{
+        'track': tracks[index % 4],
+        'played_at': f'2024-11-26T{index % 24:02d}:15:00.000Z',
+    } for index in range(count)]
+    playlists = [{
+        'name': 'Favourites',
+        'images': images,
+        'owner': {'display_name': 'bench'},
+        'tracks': {'total': 42},
+        'external_urls': {'spotify': 'https://open.spotify.com/playlist/bench'},
+    }]
+    return {'top_tracks': tracks, 'top_artists': artists, 'recently_played': plays, 'playlists': playlists}
+
+
+def _rss_bytes():
+    # Current resident set size; falls back to the peak where /proc is missing
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _reset_template_cache():
+    for loader in engines['django'].engine.template_loaders:
+        if hasattr(loader, 'reset'):
+            loader.reset()
+
+
+class Command(BaseCommand):
+    help = "Measures template parse time, memory and render time for every page and language."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=200, help="Renders per page and language.")
+        parser.add_argument('--json', action='store_true', help="Print the results as JSON.")
+
+    def page_contexts(self, request):
+        context, wrap_data = build_wrap_from_sources(sample_spotify_data(), 'medium_term', 'dark', 'en')
+        wrap = SpotifyWrap(
+            id=1, user=request.user, name=wrap_data['wrap_name'], time_frame='medium_term',
+            data=wrap_data, created_at=datetime(2024, 11, 26, tzinfo=timezone.utc),
+            thumbnail_url='https://i.scdn.co/image/300',
+        )
+        simple = {'view_mode': 'dark'}
+        return {
+            'landing': simple,
+            'login': simple,
+            'register': {'view_mode': 'dark', 'form': UserCreationForm()},
+            'about': simple,
+            'user_settings': simple,
+            'dashboard': {'view_mode': 'dark', 'wraps': [wrap] * 12, 'next_cursor': 'cursor'},
+            'wrapper': {**context, 'snapshot_id': 'bench'},
+            'wrap_detail': {
+                'wrap': wrap,
+                'top_tracks': wrap_data['top_tracks'],
+                'top_artists': wrap_data['top_artists'],
+                'view_mode': 'dark',
+                'language': 'en',
+            },
+        }
+
+    def handle(self, *args, **options):
+        languages = [code for code, _ in settings.LANGUAGES]
+        request = RequestFactory().get('/')
+        request.user = User(username='bench')
+        request.session = {}
+        contexts = self.page_contexts(request)
+
+        # Cold load: parse every page in every language into an empty cache
+        _reset_template_cache()
+        rss_before = _rss_bytes()
+        tracemalloc.start()
+        started = time.perf_counter()
+        templates = {}
+        for page in PAGES:
+            for language in languages:
+                with translation.override(language):
+                    templates[page, language] = get_template(f'{page}.html')
+        load_seconds = time.perf_counter() - started
+        template_bytes = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        rss_after = _rss_bytes()
+
+        sources = {template.origin.name for template in templates.values()}
+        disk_bytes = sum(os.path.getsize(name) for name in sources)
+
+        renders = []
+        for page in PAGES:
+            for language in languages:
+                with translation.override(language):
+                    template = get_template(f'{page}.html')
+                    template.render(contexts[page], request)
+                    timings = []
+                    for _ in range(options['iterations']):
+                        started = time.perf_counter()
+                        template.render(contexts[page], request)
+                        timings.append((time.perf_counter() - started) * 1000)
+                timings.sort()
+                renders.append({
+                    'page': page,
+                    'language': language,
+                    'mean_ms': round(statistics.fmean(timings), 3),
+                    'p95_ms': round(timings[int(len(timings) * 0.95) - 1], 3),
+                })
+
+        results = {
+            'template_files': len(sources),
+            'template_disk_bytes': disk_bytes,
+            'load_seconds': round(load_seconds, 4),
+            'template_memory_bytes': template_bytes,
+            'rss_delta_bytes': rss_after - rss_before,
+            'renders': renders,
+        }
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+
+        for row in renders:
+            self.stdout.write(f"{row['page']:<14} {row['language']}  {row['mean_ms']:8.3f} ms  p95 {row['p95_ms']:8.3f} ms")
+        self.stdout.write(
+            f"{len(sources)} template files ({disk_bytes / 1024:,.0f} KB on disk) "
+            f"parsed in {load_seconds * 1000:.1f} ms"
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"Parsed templates hold {template_bytes / 1024:,.0f} KB "
+            f"(RSS grew by {(rss_after - rss_before) / 1024:,.0f} KB)"
+        ))
@@ -0,0 +1,149 @@
+import json
+import platform
+import statistics
+import subprocess
+import time
+from datetime import datetime, timezone
+
+import django
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from wrapped import analytics, moods, page_cache, payload, spotify, spotify_stub, token_store
+from wrapped.generation import build_wrap_from_sources
+from wrapped.views import create_wrap
+
+
+def measure(function, iterations, before=None):
+    """
+        Runs `function` `iterations` times and returns its timings and the most
+        queries one run made. `before` runs ahead of each run, untimed.
+    """
+    timings, queries = [], 0
+    for _ in range(iterations):
+        if before:
+            before()
+        with CaptureQueriesContext(connection) as captured:
+            started = time.perf_counter()
+            function()
+            timings.append((time.perf_counter() - started) * 1000)
+        queries = max(queries, len(captured))
+    timings.sort()
+    return {
+        'mean_ms': round(statistics.fmean(timings), 3),
+        'p95_ms': round(timings[max(int(len(timings) * 0.95) - 1, 0)], 3),
+        'queries': queries,
+    }
+
+
+def forget_spotify_responses(user_id, time_frame):
+    keys = [spotify.cache_key(user_id, path, params)
+            for path, params, cache in spotify.wrap_source_requests(time_frame).values() if cache]
+    spotify.response_cache().delete_many(keys)
+
+
+def current_commit():
+    try:
+        result = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR,
+                                capture_output=True, text=True, timeout=5)
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return result.stdout.strip() or None
+
+
+class Command(BaseCommand):
+    help = ("Times generate_wrap, dashboard and wrap_detail against recorded Spotify responses, "
+            "and the analytics helpers, at several input sizes.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[5, 20, 50],
+                            help="Items per Spotify endpoint, and saved wraps on the dashboard.")
+        parser.add_argument('--analytics-sizes', type=int, nargs='+', default=[50, 500, 5000],
+                            help="Tracks, artists and plays fed to the analytics helpers.")
+        parser.add_argument('--iterations', type=int, default=20, help="Runs per view or helper and size.")
+        parser.add_argument('--json', action='store_true', help="Print the results as JSON.")
+
+    def view_rows(self, sizes, iterations):
+        rows = []
+        for size in sizes:
+            user = User.objects.create(username=f'bench-{size}')
+            token_store.save_tokens(user, {'access_token': 'bench', 'refresh_token': 'bench', 'expires_in': 3600})
+            client = Client()
+            client.force_login(user)
+
+            with spotify_stub.stub_spotify(size):
+                sources = spotify.SpotifyClient('bench').fetch_wrap_sources('medium_term')
+                _, wrap_data = build_wrap_from_sources(sources, 'medium_term', 'dark', 'en')
+                wraps = [create_wrap(user, wrap_data) for _ in range(size)]
+
+                # Only this user's cache entries are dropped before the runs that should miss them
+                requests = {
+                    'generate_wrap': (lambda: client.post(reverse('generate-wrap'), {'time_frame': 'medium_term'}),
+                                      lambda: forget_spotify_responses(user.pk, 'medium_term')),
+                    'dashboard': (lambda: client.get(reverse('dashboard')), None),
+                    'wrap_detail': (lambda: client.get(reverse('wrap_detail', args=[wraps[0].id])),
+                                    lambda: page_cache.invalidate_wrap_pages(wraps[0])),
+                    'wrap_detail_cached': (lambda: client.get(reverse('wrap_detail', args=[wraps[0].id])), None),
+                }
+                for view, (function, before) in requests.items():
+                    rows.append({'view': view, 'size': size, **measure(function, iterations, before)})
+
+            # The rows are rolled back and their ids may be handed out again
+            forget_spotify_responses(user.pk, 'medium_term')
+            page_cache.invalidate_wrap_pages(wraps[0])
+        return rows
+
+    def analytics_rows(self, sizes, iterations):
+        rows = []
+        for size in sizes:
+            top_tracks = list(spotify_stub.scaled_items('top_tracks', size))
+            top_artists = list(spotify_stub.scaled_items('top_artists', size))
+            plays = list(spotify_stub.scaled_items('recently_played_initial', size))
+            _, wrap_data = build_wrap_from_sources({
+                'top_tracks': top_tracks, 'top_artists': top_artists, 'recently_played': plays, 'playlists': [],
+            }, 'medium_term', 'dark', 'en')
+            helpers = {
+                'compute_wrap_metrics': lambda: analytics.compute_wrap_metrics(top_tracks, top_artists, plays),
+                'classify_moods': lambda: moods.classify_many(top_tracks),
+                'encode_payload': lambda: payload.encode(payload.project_wrap_data(wrap_data)),
+            }
+            for helper, function in helpers.items():
+                rows.append({'helper': helper, 'size': size, **measure(function, iterations)})
+        return rows
+
+    def handle(self, *args, **options):
+        # The test client's host has to be allowed; everything the runs write is rolled back
+        allowed_hosts = [*settings.ALLOWED_HOSTS, 'testserver']
+        with override_settings(WRAP_JOBS_ENABLED=False, ALLOWED_HOSTS=allowed_hosts), transaction.atomic():
+            views = self.view_rows(options['sizes'], options['iterations'])
+            helpers = self.analytics_rows(options['analytics_sizes'], options['iterations'])
+            transaction.set_rollback(True)
+
+        results = {
+            'commit': current_commit(),
+            'created_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': connection.vendor,
+            'iterations': options['iterations'],
+            'views': views,
+            'analytics': helpers,
+        }
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+
+        for row in views:
+            self.stdout.write(f"{row['view']:<20} {row['size']:>6}  {row['mean_ms']:9.3f} ms  "
+                              f"p95 {row['p95_ms']:9.3f} ms  {row['queries']:>3} queries")
+        for row in helpers:
+            self.stdout.write(f"{row['helper']:<20} {row['size']:>6}  {row['mean_ms']:9.3f} ms  "
+                              f"p95 {row['p95_ms']:9.3f} ms")
+        self.stdout.write(self.style.SUCCESS(
+            f"Measured {len(views)} view and {len(helpers)} helper runs at commit {results['commit'] or 'unknown'}"
+        ))
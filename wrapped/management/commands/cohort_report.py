@@ -0,0 +1,45 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from wrapped.cohorts import build_cohort_report
+from wrapped.models import SpotifyWrap
+
+
+class Command(BaseCommand):
+    help = "Aggregates stored wraps per signup-month cohort and time frame."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--time-frame', help="Only include wraps for this time frame.")
+        parser.add_argument('--chunk-size', type=int, default=2000, help="Rows loaded per chunk.")
+        parser.add_argument('--top-genres', type=int, default=5, help="Genres listed per group.")
+        parser.add_argument('--json', action='store_true', help="Print the report as JSON.")
+
+    def handle(self, *args, **options):
+        queryset = SpotifyWrap.objects.all()
+        if options['time_frame']:
+            queryset = queryset.filter(time_frame=options['time_frame'])
+
+        report, elapsed = build_cohort_report(queryset, chunk_size=options['chunk_size'])
+        summary = report.summary(top_genres=options['top_genres'])
+        rows_per_second = report.rows / elapsed if elapsed else 0.0
+
+        if options['json']:
+            self.stdout.write(json.dumps({
+                'rows': report.rows,
+                'seconds': round(elapsed, 4),
+                'rows_per_second': round(rows_per_second, 1),
+                'groups': summary,
+            }, indent=2))
+            return
+
+        for group in summary:
+            self.stdout.write(
+                f"{group['cohort']} {group['time_frame']}: {group['wraps']} wraps, "
+                f"{group['total_duration_minutes']} min total ({group['mean_duration_minutes']} avg)"
+            )
+            self.stdout.write(f"  time of day: {group['time_of_day']}")
+            self.stdout.write(f"  top genres: {group['top_genres']}")
+        self.stdout.write(self.style.SUCCESS(
+            f"Processed {report.rows} wraps in {elapsed:.3f}s ({rows_per_second:,.0f} rows/s)"
+        ))
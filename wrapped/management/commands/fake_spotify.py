@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand
+
+from wrapped.spotify_stub import FakeSpotifyServer
+
+
+class Command(BaseCommand):
+    help = ("Serves a local stand-in for the Spotify accounts and Web API, with configurable latency, "
+            "jitter, 429 bursts and payload sizes, for load tests.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8001)
+        parser.add_argument('--latency', type=float, default=100.0, help="Mean response delay in milliseconds.")
+        parser.add_argument('--jitter', type=float, default=30.0, help="Delays vary by up to this many milliseconds.")
+        parser.add_argument('--size', type=int, default=50, help="Items per Web API endpoint.")
+        parser.add_argument('--burst-every', type=int, default=0,
+                            help="Answer the last --burst-length of every this many API calls with 429 (0: never).")
+        parser.add_argument('--burst-length', type=int, default=10)
+        parser.add_argument('--retry-after', type=int, default=1, help="Retry-After sent with a 429, in seconds.")
+
+    def handle(self, *args, **options):
+        server = FakeSpotifyServer(
+            (options['host'], options['port']),
+            latency=options['latency'],
+            jitter=options['jitter'],
+            size=options['size'],
+            burst_every=options['burst_every'],
+            burst_length=options['burst_length'],
+            retry_after=options['retry_after'],
+            verbose=options['verbosity'] > 1,
+        )
+        base_url = f"http://{options['host']}:{server.server_port}"
+        self.stdout.write(f"Fake Spotify listening on {base_url}; run the app with")
+        self.stdout.write(f"  SPOTIFY_ACCOUNTS_BASE_URL={base_url} SPOTIFY_API_BASE_URL={base_url}{server.api_prefix}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+        self.stdout.write(self.style.SUCCESS(
+            f"Served {server.api_calls} API call(s), {server.throttled_calls} of them throttled"
+        ))
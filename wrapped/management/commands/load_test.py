@@ -0,0 +1,171 @@
+import json
+import re
+import secrets
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from django.core.management.base import BaseCommand, CommandError
+
+SNAPSHOT_ID = re.compile(r'name="snapshot_id" value="([^"]*)"')
+
+
+def percentile(sorted_values, percent):
+    """
+        Returns the nearest-rank percentile of an already sorted list.
+    """
+    if not sorted_values:
+        return None
+    rank = max(int(round(percent / 100 * len(sorted_values))) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+class Recorder:
+    """
+    Collects the latency and outcome of every request, per step, across threads.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.timings = {}
+        self.errors = {}
+
+    def record(self, step, seconds, ok):
+        with self._lock:
+            self.timings.setdefault(step, []).append(seconds)
+            if not ok:
+                self.errors[step] = self.errors.get(step, 0) + 1
+
+    def summary(self, elapsed):
+        steps = []
+        for step, timings in self.timings.items():
+            timings = sorted(timings)
+            steps.append({
+                'step': step,
+                'requests': len(timings),
+                'errors': self.errors.get(step, 0),
+                'p50_ms': round(percentile(timings, 50) * 1000, 1),
+                'p95_ms': round(percentile(timings, 95) * 1000, 1),
+                'p99_ms': round(percentile(timings, 99) * 1000, 1),
+                'max_ms': round(timings[-1] * 1000, 1),
+            })
+        total = sum(step['requests'] for step in steps)
+        return {
+            'seconds': round(elapsed, 2),
+            'requests': total,
+            'errors': sum(step['errors'] for step in steps),
+            'requests_per_second': round(total / elapsed, 1) if elapsed else None,
+            'steps': steps,
+        }
+
+
+class SimulatedUser:
+    """
+    One user clicking through register, login, Spotify login, generate,
+    save and dashboard with their own cookie jar.
+    """
+
+    def __init__(self, base_url, username, recorder, timeout):
+        self.base_url = base_url.rstrip('/')
+        self.username = username
+        self.password = secrets.token_urlsafe(12)
+        self.recorder = recorder
+        self.timeout = timeout
+        self.session = requests.Session()
+
+    def request(self, step, method, url, expect, **kwargs):
+        if url.startswith('/'):
+            url = self.base_url + url
+        headers = {'X-CSRFToken': self.session.cookies.get('csrftoken', ''), 'Referer': self.base_url + '/'}
+        started = time.perf_counter()
+        try:
+            response = self.session.request(method, url, headers=headers, allow_redirects=False,
+                                            timeout=self.timeout, **kwargs)
+        except requests.RequestException:
+            self.recorder.record(step, time.perf_counter() - started, ok=False)
+            return None
+        ok = response.status_code == expect
+        self.recorder.record(step, time.perf_counter() - started, ok)
+        return response if ok else None
+
+    def sign_up(self):
+        # The GETs set the CSRF cookie the POSTs need
+        self.request('register_page', 'GET', '/register/', 200)
+        form = {'username': self.username, 'password1': self.password, 'password2': self.password}
+        if self.request('register', 'POST', '/register/', 302, data=form) is None:
+            return False
+        self.request('login_page', 'GET', '/login/', 200)
+        form = {'username': self.username, 'password': self.password}
+        return self.request('login', 'POST', '/login/', 302, data=form) is not None
+
+    def connect_spotify(self):
+        # spotify_login -> (Spotify) /authorize -> callback -> generate_wrap
+        response = self.request('spotify_login', 'GET', '/spotify-login/', 302)
+        if response is not None:
+            response = self.request('authorize', 'GET', response.headers['Location'], 302)
+        if response is not None:
+            response = self.request('callback', 'GET', response.headers['Location'], 302)
+        return response is not None
+
+    def wrap_and_save(self, time_frame):
+        response = self.request('generate_wrap', 'POST', '/generate-wrap/', 200, data={'time_frame': time_frame})
+        match = SNAPSHOT_ID.search(response.text) if response is not None else None
+        if match is None:
+            return
+        form = {'time_frame': time_frame, 'snapshot_id': match.group(1), 'save_wrap': ''}
+        self.request('save_wrap', 'POST', '/generate-wrap/', 302, data=form)
+        self.request('dashboard', 'GET', '/dashboard/', 200)
+
+    def run(self, iterations, time_frame):
+        if self.sign_up() and self.connect_spotify():
+            for _ in range(iterations):
+                self.wrap_and_save(time_frame)
+        self.session.close()
+
+
+class Command(BaseCommand):
+    help = ("Runs concurrent simulated users through login, Spotify login, generate, save and dashboard "
+            "against a running app and reports latency percentiles and throughput.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--base-url', default='http://127.0.0.1:8000', help="Where the app is served.")
+        parser.add_argument('--users', type=int, default=10, help="Concurrent simulated users.")
+        parser.add_argument('--iterations', type=int, default=3, help="Wraps each user generates and saves.")
+        parser.add_argument('--time-frame', default='short_term')
+        parser.add_argument('--timeout', type=float, default=30.0, help="Per-request timeout in seconds.")
+        parser.add_argument('--json', action='store_true', help="Print the results as JSON.")
+
+    def handle(self, *args, **options):
+        try:
+            requests.get(options['base_url'], timeout=options['timeout'])
+        except requests.RequestException as exc:
+            raise CommandError(f"The app is not reachable at {options['base_url']}: {exc}")
+
+        recorder = Recorder()
+        run_id = secrets.token_hex(3)
+        users = [SimulatedUser(options['base_url'], f'load-{run_id}-{index}', recorder, options['timeout'])
+                 for index in range(options['users'])]
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=len(users) or 1) as pool:
+            for future in [pool.submit(user.run, options['iterations'], options['time_frame']) for user in users]:
+                future.result()
+        results = recorder.summary(time.perf_counter() - started)
+        results.update(users=options['users'], iterations=options['iterations'])
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+
+        self.stdout.write(f"{'step':<14} {'requests':>8} {'errors':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+        for step in results['steps']:
+            self.stdout.write(
+                f"{step['step']:<14} {step['requests']:>8} {step['errors']:>6} {step['p50_ms']:>9} "
+                f"{step['p95_ms']:>9} {step['p99_ms']:>9} {step['max_ms']:>9}"
+            )
+        style = self.style.SUCCESS if not results['errors'] else self.style.WARNING
+        self.stdout.write(style(
+            f"{results['requests']} requests from {options['users']} users in {results['seconds']}s "
+            f"({results['requests_per_second']} req/s), {results['errors']} error(s)"
+        ))
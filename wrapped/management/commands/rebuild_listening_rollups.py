@@ -0,0 +1,45 @@
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from wrapped import rollups
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the listening rollups from the stored play history, or checks them against it."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--username', help="Only this user.")
+        parser.add_argument('--check', action='store_true',
+                            help="Report users whose rollups differ from their history instead of rebuilding.")
+
+    def handle(self, *args, **options):
+        users = User.objects.filter(play_events__isnull=False).distinct().order_by('id')
+        if options['username']:
+            users = User.objects.filter(username=options['username'])
+            if not users.exists():
+                raise CommandError(f"No user {options['username']!r}")
+
+        started = time.perf_counter()
+        checked = inconsistent = 0
+        for user in users.iterator():
+            checked += 1
+            if not options['check']:
+                rollups.rebuild(user)
+                continue
+            problems = rollups.check(user)
+            if problems:
+                inconsistent += 1
+                self.stderr.write(f"{user.username}: {len(problems)} difference(s)")
+                for problem in problems[:10]:
+                    self.stderr.write(f"  {problem}")
+
+        elapsed = time.perf_counter() - started
+        if not options['check']:
+            self.stdout.write(self.style.SUCCESS(f"Rebuilt the rollups of {checked} user(s) in {elapsed:.2f}s"))
+        elif inconsistent:
+            raise CommandError(f"{inconsistent} of {checked} user(s) have inconsistent rollups; "
+                               "run rebuild_listening_rollups to fix them")
+        else:
+            self.stdout.write(self.style.SUCCESS(f"The rollups of {checked} user(s) match their history ({elapsed:.2f}s)"))
@@ -0,0 +1,89 @@
+import argparse
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from wrapped import catalog, payload
+from wrapped.models import Album, Artist, SpotifyWrap, Track, WrapArtist, WrapTrack
+
+
+class Command(BaseCommand):
+    help = ("Rewrites stored wraps in the compact payload format (and the shared catalog) "
+            "and reports the bytes saved in the wrap table.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=500, help="Wraps rewritten per transaction.")
+        parser.add_argument(
+            '--compress', action=argparse.BooleanOptionalAction, default=None,
+            help="Compress the track/artist lists (default: WRAP_PAYLOAD_COMPRESSION).",
+        )
+        parser.add_argument(
+            '--catalog', action=argparse.BooleanOptionalAction, default=None,
+            help="Move top tracks/artists into the shared catalog, or back out of it (default: WRAP_CATALOG_ENABLED).",
+        )
+        parser.add_argument('--dry-run', action='store_true', help="Report the savings without writing.")
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        use_catalog = options['catalog']
+        if use_catalog is None:
+            use_catalog = settings.WRAP_CATALOG_ENABLED
+        rows = rewritten = bytes_before = bytes_after = 0
+        last_id = 0
+
+        # Walk the table by primary key; raw column values, so nothing is decoded twice
+        while True:
+            chunk = list(SpotifyWrap.objects.filter(id__gt=last_id).order_by('id')
+                         .values_list('id', 'data', 'packed')[:chunk_size])
+            if not chunk:
+                break
+            last_id = chunk[-1][0]
+
+            wraps = [SpotifyWrap(id=wrap_id, data=payload.project_wrap_data(payload.decode(data, packed)))
+                     for wrap_id, data, packed in chunk]
+            if not use_catalog:
+                catalog.hydrate_wraps(wraps)
+
+            changed, entries = [], []
+            for wrap, (wrap_id, data, packed) in zip(wraps, chunk):
+                full = wrap.data
+                if use_catalog:
+                    full, tracks, artists = catalog.split_wrap_data(full)
+                    if tracks is not None:
+                        entries.append((wrap_id, tracks, artists))
+                new_data, new_packed = payload.encode(full, options['compress'])
+                rows += 1
+                bytes_before += payload.stored_size(data, packed)
+                bytes_after += payload.stored_size(new_data, new_packed)
+                if new_data != data or new_packed != (bytes(packed) if packed else None):
+                    changed.append(SpotifyWrap(id=wrap_id, data=new_data, packed=new_packed))
+
+            if changed and not options['dry_run']:
+                with transaction.atomic():
+                    if use_catalog:
+                        catalog.store_catalog(entries, replace=True)
+                    else:
+                        # Their lists are back in the data
+                        WrapTrack.objects.filter(wrap_id__in=[wrap.id for wrap in changed]).delete()
+                        WrapArtist.objects.filter(wrap_id__in=[wrap.id for wrap in changed]).delete()
+                    SpotifyWrap.objects.bulk_update(changed, ['data', 'packed'])
+            rewritten += len(changed)
+            self.stdout.write(f"{rows} wraps checked, {rewritten} rewritten")
+
+        saved = bytes_before - bytes_after
+        percent = saved / bytes_before * 100 if bytes_before else 0.0
+        if saved >= 0:
+            verb = "Would save" if options['dry_run'] else "Saved"
+        else:
+            # e.g. after turning compression off
+            verb = "Would grow by" if options['dry_run'] else "Grew by"
+        self.stdout.write(self.style.SUCCESS(
+            f"{verb} {abs(saved) / 1024:,.1f} KB of {bytes_before / 1024:,.1f} KB ({abs(percent):.1f}%) "
+            f"across {rewritten} of {rows} wraps"
+        ))
+        if use_catalog:
+            self.stdout.write(
+                f"Catalog: {Track.objects.count()} tracks, {Artist.objects.count()} artists, "
+                f"{Album.objects.count()} albums"
+            )
@@ -0,0 +1,50 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from wrapped import jobs
+
+
+class Command(BaseCommand):
+    help = "Runs queued wrap generation jobs. Start as many workers as you need."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--poll-interval', type=float, default=1.0,
+                            help="Seconds to sleep when the queue is empty.")
+        parser.add_argument('--burst', action='store_true',
+                            help="Exit once the queue is empty instead of polling.")
+        parser.add_argument('--stale-after', type=int, default=300,
+                            help="Requeue jobs that have been running this many seconds.")
+        parser.add_argument('--requeue-interval', type=float, default=60.0,
+                            help="Seconds between checks for stale jobs while the worker runs.")
+
+    def requeue_stale(self, stale_after):
+        requeued = jobs.requeue_stale_jobs(timedelta(seconds=stale_after))
+        if requeued:
+            self.stdout.write(f"Requeued {requeued} stale job(s)")
+
+    def handle(self, *args, **options):
+        processed = 0
+        next_requeue = 0
+        while True:
+            close_old_connections()
+            # Jobs of a worker that died are picked up by the ones still running
+            if time.monotonic() >= next_requeue:
+                self.requeue_stale(options['stale_after'])
+                next_requeue = time.monotonic() + options['requeue_interval']
+
+            job = jobs.claim_next_job()
+            if job is None:
+                if options['burst']:
+                    break
+                time.sleep(options['poll_interval'])
+                continue
+
+            started = time.perf_counter()
+            job = jobs.run_job(job)
+            processed += 1
+            self.stdout.write(f"Job {job.id} {job.status} in {time.perf_counter() - started:.2f}s")
+
+        self.stdout.write(self.style.SUCCESS(f"Processed {processed} job(s)"))
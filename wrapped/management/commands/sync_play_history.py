@@ -0,0 +1,38 @@
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from wrapped import history, spotify, token_store
+
+
+class Command(BaseCommand):
+    help = "Stores the plays every user with a Spotify token made since the last sync."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--username', help="Only sync this user.")
+
+    def handle(self, *args, **options):
+        users = User.objects.filter(spotify_token__isnull=False).order_by('id')
+        if options['username']:
+            users = users.filter(username=options['username'])
+            if not users.exists():
+                raise CommandError(f"No user {options['username']!r} with a stored Spotify token")
+
+        started = time.perf_counter()
+        synced = failed = plays = 0
+        for user in users.iterator():
+            access_token = token_store.get_access_token(user)
+            added = history.sync_user(user, spotify.SpotifyClient(access_token)) if access_token else None
+            if added is None:
+                failed += 1
+                self.stderr.write(f"{user.username}: could not read recently played tracks")
+                continue
+            synced += 1
+            plays += added
+            self.stdout.write(f"{user.username}: {added} new play(s)")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Synced {synced} user(s), {plays} new play(s) in {time.perf_counter() - started:.2f}s"
+            + (f"; {failed} failed" if failed else "")
+        ))
@@ -0,0 +1,90 @@
+import time
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.utils.deprecation import MiddlewareMixin
+
+from . import preferences, profiling, timing
+
+
+class PreferenceMiddleware(MiddlewareMixin):
+    """
+    Sets `request.preferences` to the visitor's `(view_mode, language)` and
+    writes the preference cookie whenever they change.
+
+    Must come after `AuthenticationMiddleware`.
+    """
+
+    def process_request(self, request):
+        request.preferences, request.preferences_changed = preferences.load(request)
+
+    def process_response(self, request, response):
+        if getattr(request, 'preferences_changed', False):
+            preferences.set_cookie(response, *request.preferences)
+        return response
+
+
+class RequestTimingMiddleware(MiddlewareMixin):
+    """
+    Times every request by phase (see `wrapped.timing`), records it in the
+    `/metrics` histograms and sends the breakdown in a `Server-Timing` header.
+
+    Goes first, so the time spent in the other middleware counts too.
+    """
+
+    def __init__(self, get_response):
+        if not settings.REQUEST_TIMING_ENABLED:
+            raise MiddlewareNotUsed
+        super().__init__(get_response)
+
+    def process_request(self, request):
+        request.timer = timing.start()
+
+    def process_response(self, request, response):
+        timer = getattr(request, 'timer', None)
+        if timer is None:
+            return response
+        timing.stop()
+        match = request.resolver_match
+        # URL names rather than paths keep the number of series bounded
+        view = (match.url_name or match.view_name) if match else 'unmatched'
+        response['Server-Timing'] = timing.server_timing(*timing.finish(timer, view, request.method))
+        return response
+
+
+class RequestProfilingMiddleware:
+    """
+    Runs the requests picked by `wrapped.profiling.trigger` under cProfile and
+    stores their profiles; the response carries the profile's id in
+    `X-Profile-Id`.
+
+    Goes right after `RequestTimingMiddleware`, so the rest of the stack is profiled.
+    """
+
+    def __init__(self, get_response):
+        if not settings.REQUEST_PROFILING_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.budget = profiling.Budget(settings.REQUEST_PROFILING_MAX_PER_MINUTE)
+
+    def __call__(self, request):
+        reason = profiling.trigger(request)
+        if reason is None or not self.budget.take():
+            return self.get_response(request)
+
+        started = time.perf_counter()
+        response, profiler = profiling.run_profiled(self.get_response, request)
+        if profiler is None:
+            return response
+        match = request.resolver_match
+        user = getattr(request, 'user', None)
+        response['X-Profile-Id'] = profiling.save_profile(profiler, {
+            'method': request.method,
+            'path': request.path,
+            'view': match.url_name if match else None,
+            'status': response.status_code,
+            'duration_ms': round((time.perf_counter() - started) * 1000, 1),
+            'user': user.get_username() if user is not None and user.is_authenticated else None,
+            'trigger': reason,
+        })
+        return response
@@ -0,0 +1,60 @@
+# Generated by Django 5.1.3 on 2026-10-18 18:27
+
+from django.db import migrations, models
+
+
+def backfill_summary_columns(apps, schema_editor):
+    """
+    Fills the new summary columns of existing wraps from their data, in chunks.
+    """
+    SpotifyWrap = apps.get_model('wrapped', 'SpotifyWrap')
+    fields = ['name', 'thumbnail_url', 'total_songs_played', 'total_genres_played', 'total_duration_minutes']
+    batch = []
+    for wrap in SpotifyWrap.objects.only('id', 'name', 'data').iterator(chunk_size=500):
+        data = wrap.data or {}
+        top_tracks = data.get('top_tracks') or []
+        first_track = top_tracks[0] if isinstance(top_tracks, list) and top_tracks else None
+        images = first_track.get('album', {}).get('images') if isinstance(first_track, dict) else None
+        wrap.thumbnail_url = images[0]['url'] if images else ''
+        wrap.total_songs_played = data.get('total_songs_played') or 0
+        wrap.total_genres_played = data.get('total_genres_played') or 0
+        wrap.total_duration_minutes = data.get('total_duration_minutes') or 0
+        if not wrap.name:
+            wrap.name = data.get('wrap_name', '')
+        batch.append(wrap)
+        if len(batch) >= 500:
+            SpotifyWrap.objects.bulk_update(batch, fields)
+            batch = []
+    if batch:
+        SpotifyWrap.objects.bulk_update(batch, fields)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wrapped', '0002_wrapjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='spotifywrap',
+            name='thumbnail_url',
+            field=models.CharField(blank=True, max_length=500),
+        ),
+        migrations.AddField(
+            model_name='spotifywrap',
+            name='total_duration_minutes',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='spotifywrap',
+            name='total_genres_played',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='spotifywrap',
+            name='total_songs_played',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_summary_columns, migrations.RunPython.noop),
+    ]
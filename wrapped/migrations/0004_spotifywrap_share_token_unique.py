@@ -0,0 +1,47 @@
+# Generated by Django 5.1.3 on 2026-10-18 18:28
+
+import secrets
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def deduplicate_share_tokens(apps, schema_editor):
+    """
+    Gives every wrap that shares its token with an older wrap a fresh token,
+    so the unique constraint can be added. The oldest wrap keeps the token,
+    which keeps the link that was most likely shared first working.
+    """
+    SpotifyWrap = apps.get_model('wrapped', 'SpotifyWrap')
+    duplicates = (SpotifyWrap.objects.exclude(share_token__isnull=True)
+                  .values('share_token').annotate(count=Count('id')).filter(count__gt=1)
+                  .values_list('share_token', flat=True))
+    for token in list(duplicates):
+        for wrap in SpotifyWrap.objects.filter(share_token=token).order_by('id')[1:]:
+            new_token = secrets.token_urlsafe(9)
+            while SpotifyWrap.objects.filter(share_token=new_token).exists():
+                new_token = secrets.token_urlsafe(9)
+            wrap.share_token = new_token
+            wrap.save(update_fields=['share_token'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wrapped', '0003_spotifywrap_summary_columns'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(deduplicate_share_tokens, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='spotifywrap',
+            name='share_token',
+            field=models.CharField(blank=True, max_length=255, null=True, unique=True),
+        ),
+        migrations.AddIndex(
+            model_name='spotifywrap',
+            index=models.Index(fields=['user', 'created_at', 'id'], name='spotifywrap_user_created_idx'),
+        ),
+    ]
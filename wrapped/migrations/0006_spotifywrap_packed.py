@@ -0,0 +1,18 @@
+# Generated by Django 5.1.3 on 2026-10-18 18:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wrapped', '0005_userpreference'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='spotifywrap',
+            name='packed',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,66 @@
+# Generated by Django 5.1.3 on 2026-10-18 18:44
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wrapped', '0006_spotifywrap_packed'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Album',
+            fields=[
+                ('id', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('name', models.CharField(max_length=500)),
+                ('image_url', models.CharField(blank=True, max_length=500)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Artist',
+            fields=[
+                ('id', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('name', models.CharField(max_length=500)),
+                ('genres', models.JSONField(default=list)),
+                ('followers', models.PositiveIntegerField(blank=True, null=True)),
+                ('image_url', models.CharField(blank=True, max_length=500)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Track',
+            fields=[
+                ('id', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('name', models.CharField(max_length=500)),
+                ('duration_ms', models.PositiveIntegerField(blank=True, null=True)),
+                ('album', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='tracks', to='wrapped.album')),
+                ('artist', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='tracks', to='wrapped.artist')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='WrapArtist',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('rank', models.PositiveSmallIntegerField()),
+                ('artist', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='+', to='wrapped.artist')),
+                ('wrap', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='catalog_artists', to='wrapped.spotifywrap')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('wrap', 'rank'), name='wrapartist_wrap_rank_uniq')],
+            },
+        ),
+        migrations.CreateModel(
+            name='WrapTrack',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('rank', models.PositiveSmallIntegerField()),
+                ('track', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='+', to='wrapped.track')),
+                ('wrap', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='catalog_tracks', to='wrapped.spotifywrap')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('wrap', 'rank'), name='wraptrack_wrap_rank_uniq')],
+            },
+        ),
+    ]
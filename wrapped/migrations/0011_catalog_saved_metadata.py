@@ -0,0 +1,66 @@
+# Generated by Django 5.1.3 on 2026-10-18 19:22
+
+from django.db import migrations, models
+
+
+def backfill_saved_metadata(apps, schema_editor):
+    """
+    Copies the catalog's metadata onto the rank rows of existing wraps, in chunks.
+
+    What those wraps were saved with is gone, so the latest catalog values are
+    the closest there is; from here on they stay put.
+    """
+    WrapTrack = apps.get_model('wrapped', 'WrapTrack')
+    WrapArtist = apps.get_model('wrapped', 'WrapArtist')
+    batch = []
+    for row in WrapTrack.objects.select_related('track__album').iterator(chunk_size=500):
+        album = row.track.album
+        row.image_url = album.image_url if album else ''
+        batch.append(row)
+        if len(batch) >= 500:
+            WrapTrack.objects.bulk_update(batch, ['image_url'])
+            batch = []
+    if batch:
+        WrapTrack.objects.bulk_update(batch, ['image_url'])
+
+    fields = ['genres', 'followers', 'image_url']
+    batch = []
+    for row in WrapArtist.objects.select_related('artist').iterator(chunk_size=500):
+        row.genres, row.followers, row.image_url = row.artist.genres, row.artist.followers, row.artist.image_url
+        batch.append(row)
+        if len(batch) >= 500:
+            WrapArtist.objects.bulk_update(batch, fields)
+            batch = []
+    if batch:
+        WrapArtist.objects.bulk_update(batch, fields)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wrapped', '0010_listening_rollups'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='wrapartist',
+            name='followers',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='wrapartist',
+            name='genres',
+            field=models.JSONField(default=list),
+        ),
+        migrations.AddField(
+            model_name='wrapartist',
+            name='image_url',
+            field=models.CharField(blank=True, max_length=500),
+        ),
+        migrations.AddField(
+            model_name='wraptrack',
+            name='image_url',
+            field=models.CharField(blank=True, max_length=500),
+        ),
+        migrations.RunPython(backfill_saved_metadata, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.1.3 on 2026-10-18 20:05
+
+from django.db import migrations, models
+
+
+def encrypt_job_tokens(apps, schema_editor):
+    """
+    Encrypts the access tokens of unfinished jobs, which used to be stored in
+    plain text, and clears any left on finished ones.
+    """
+    from wrapped import token_store
+
+    WrapJob = apps.get_model('wrapped', 'WrapJob')
+    WrapJob.objects.filter(status__in=['done', 'failed']).exclude(access_token='').update(access_token='')
+    for job in WrapJob.objects.exclude(access_token='').only('id', 'access_token'):
+        WrapJob.objects.filter(id=job.id).update(access_token=token_store.encrypt(job.access_token))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wrapped', '0011_catalog_saved_metadata'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='wrapjob',
+            name='save_on_completion',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.RunPython(encrypt_job_tokens, migrations.RunPython.noop),
+    ]
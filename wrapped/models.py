@@ -1,6 +1,8 @@
 from django.db import models
 from django.contrib.auth.models import User
-import uuid
+import secrets
+
+from . import payload
 
 class SpotifyWrap(models.Model):
     """
@@ -11,15 +13,90 @@ class SpotifyWrap(models.Model):
     time_frame = models.CharField(max_length=50)  # e.g., 'short_term', 'medium_term', 'long_term'
     created_at = models.DateTimeField(auto_now_add=True)
     data = models.JSONField()  # Store the actual Spotify data, like top tracks, artists, etc.
-    share_token = models.CharField(max_length=255, blank=True, null=True)
+    packed = models.BinaryField(blank=True, null=True)  # Compressed list parts of `data`, see wrapped.payload
+    share_token = models.CharField(max_length=255, unique=True, blank=True, null=True)
+
+    # Summary columns denormalized from `data` so listings never load the JSON
+    thumbnail_url = models.CharField(max_length=500, blank=True)
+    total_songs_played = models.PositiveIntegerField(default=0)
+    total_genres_played = models.PositiveIntegerField(default=0)
+    total_duration_minutes = models.FloatField(default=0)
+
+    # Columns the dashboard listing needs
+    SUMMARY_FIELDS = (
+        'id', 'name', 'time_frame', 'created_at', 'thumbnail_url',
+        'total_songs_played', 'total_genres_played', 'total_duration_minutes',
+    )
+
+    class Meta:
+        indexes = [
+            # Per-user listings, newest first (the dashboard's keyset pagination)
+            models.Index(fields=['user', 'created_at', 'id'], name='spotifywrap_user_created_idx'),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        """
+        Loads a wrap, merging the compressed parts of its data back into `data`.
+        """
+        instance = super().from_db(db, field_names, values)
+        if 'data' in instance.__dict__ and instance.__dict__.get('packed'):
+            instance.data = payload.decode(instance.data, instance.packed)
+            instance.packed = None
+        return instance
+
+    @classmethod
+    def generate_share_token(cls):
+        """
+        Returns a random 12-character share token that no other wrap is using.
+        """
+        while True:
+            token = secrets.token_urlsafe(9)  # 9 random bytes encode to 12 URL-safe characters
+            if not cls.objects.filter(share_token=token).exists():
+                return token
+
+    def refresh_summary(self):
+        """
+        Fills the summary columns (and a missing name) from the wrap's data.
+        """
+        data = self.data or {}
+        # Wraps whose tracks moved to the catalog keep the thumbnail they were saved with
+        if 'top_tracks' in data:
+            top_tracks = data['top_tracks'] or []
+            first_track = top_tracks[0] if isinstance(top_tracks, list) and top_tracks else None
+            images = first_track.get('album', {}).get('images') if isinstance(first_track, dict) else None
+            self.thumbnail_url = images[0]['url'] if images else ''
+        self.total_songs_played = data.get('total_songs_played') or 0
+        self.total_genres_played = data.get('total_genres_played') or 0
+        self.total_duration_minutes = data.get('total_duration_minutes') or 0
+        if not self.name:
+            self.name = data.get('wrap_name', '')
 
     def save(self, *args, **kwargs):
         """
-        Saves the SpotifyWrap instance, generating a unique share token if it does not already exist.
+        Saves the SpotifyWrap instance, generating a unique share token if it does not already exist
+        and keeping the summary columns in step with the data.
+
+        The data is projected and, with `WRAP_PAYLOAD_COMPRESSION` on, partly
+        compressed into `packed` on the way to the database; `data` itself is
+        left whole.
         """
         if not self.share_token:
-            self.share_token = str(uuid.uuid4())[:12]  # Use the first 12 characters of UUID
-        super().save(*args, **kwargs)
+            self.share_token = self.generate_share_token()
+        if 'data' not in self.__dict__:
+            super().save(*args, **kwargs)
+            return
+
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'data' in update_fields:
+            kwargs['update_fields'] = {*update_fields, 'packed'}
+        data = self.data = payload.project_wrap_data(self.data)
+        self.refresh_summary()
+        self.data, self.packed = payload.encode(data)
+        try:
+            super().save(*args, **kwargs)
+        finally:
+            self.data, self.packed = data, None
 
     def __str__(self):
         """
@@ -27,6 +104,155 @@ class SpotifyWrap(models.Model):
         """
         return f"{self.user.username}'s wrap for {self.time_frame}"
 
+class Album(models.Model):
+    """
+    A Spotify album in the shared catalog, stored once however many wraps show it.
+    """
+    id = models.CharField(max_length=64, primary_key=True)  # Spotify album id
+    name = models.CharField(max_length=500)
+    image_url = models.CharField(max_length=500, blank=True)
+
+    def __str__(self):
+        """
+        Returns the album name.
+        """
+        return self.name
+
+class Artist(models.Model):
+    """
+    A Spotify artist in the shared catalog.
+
+    Artists only seen as a track's performer have just a name until they show
+    up in someone's top artists.
+    """
+    id = models.CharField(max_length=64, primary_key=True)  # Spotify artist id
+    name = models.CharField(max_length=500)
+    genres = models.JSONField(default=list)
+    followers = models.PositiveIntegerField(blank=True, null=True)
+    image_url = models.CharField(max_length=500, blank=True)
+
+    def __str__(self):
+        """
+        Returns the artist name.
+        """
+        return self.name
+
+class Track(models.Model):
+    """
+    A Spotify track in the shared catalog.
+    """
+    id = models.CharField(max_length=64, primary_key=True)  # Spotify track id
+    name = models.CharField(max_length=500)
+    duration_ms = models.PositiveIntegerField(blank=True, null=True)
+    album = models.ForeignKey(Album, on_delete=models.PROTECT, blank=True, null=True, related_name='tracks')
+    artist = models.ForeignKey(Artist, on_delete=models.PROTECT, blank=True, null=True, related_name='tracks')  # The first credited artist
+
+    def __str__(self):
+        """
+        Returns the track name.
+        """
+        return self.name
+
+class WrapTrack(models.Model):
+    """
+    One of a wrap's top tracks, by rank (0 is the top track).
+
+    The album cover is kept as it was when the wrap was saved; the catalog
+    only has the latest one.
+    """
+    wrap = models.ForeignKey(SpotifyWrap, on_delete=models.CASCADE, related_name='catalog_tracks')
+    track = models.ForeignKey(Track, on_delete=models.PROTECT, related_name='+')
+    rank = models.PositiveSmallIntegerField()
+    image_url = models.CharField(max_length=500, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['wrap', 'rank'], name='wraptrack_wrap_rank_uniq'),
+        ]
+
+class WrapArtist(models.Model):
+    """
+    One of a wrap's top artists, by rank (0 is the top artist).
+
+    Genres, followers and image are kept as they were when the wrap was saved;
+    the catalog only has the latest ones.
+    """
+    wrap = models.ForeignKey(SpotifyWrap, on_delete=models.CASCADE, related_name='catalog_artists')
+    artist = models.ForeignKey(Artist, on_delete=models.PROTECT, related_name='+')
+    rank = models.PositiveSmallIntegerField()
+    genres = models.JSONField(default=list)
+    followers = models.PositiveIntegerField(blank=True, null=True)
+    image_url = models.CharField(max_length=500, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['wrap', 'rank'], name='wrapartist_wrap_rank_uniq'),
+        ]
+
+class PlayEvent(models.Model):
+    """
+    One play from a user's Spotify listening history, kept by `wrapped.history`
+    so wraps can look further back than Spotify's last 50 plays.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='play_events')
+    track = models.ForeignKey(Track, on_delete=models.PROTECT, related_name='+')
+    played_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            # Also serves the per-user, newest-first history reads and the sync cursor
+            models.UniqueConstraint(fields=['user', 'played_at'], name='playevent_user_played_at_uniq'),
+        ]
+
+    def __str__(self):
+        """
+        Returns a string representation of the PlayEvent instance, including the username and time.
+        """
+        return f"{self.user.username} played {self.track_id} at {self.played_at:%Y-%m-%d %H:%M}"
+
+class ListeningRollup(models.Model):
+    """
+    How many plays a user made in one hour of one (UTC) day, kept up to date by
+    `wrapped.rollups` as plays are stored.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='listening_rollups')
+    day = models.DateField()
+    hour = models.PositiveSmallIntegerField()  # 0-23
+    plays = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'day', 'hour'], name='listeningrollup_user_day_hour_uniq'),
+        ]
+
+    def __str__(self):
+        """
+        Returns a string representation of the ListeningRollup instance, including the username and bucket.
+        """
+        return f"{self.user.username} {self.day} {self.hour:02d}h: {self.plays} plays"
+
+class PlayRun(models.Model):
+    """
+    A run of back-to-back plays of the same track (a streak), kept up to date by
+    `wrapped.rollups` as plays are stored.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='play_runs')
+    track = models.ForeignKey(Track, on_delete=models.PROTECT, related_name='+')
+    started_at = models.DateTimeField()
+    ended_at = models.DateTimeField()
+    plays = models.PositiveIntegerField(default=1)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'started_at'], name='playrun_user_started_at_uniq'),
+        ]
+
+    def __str__(self):
+        """
+        Returns a string representation of the PlayRun instance, including the username and length.
+        """
+        return f"{self.user.username} played {self.track_id} {self.plays} times from {self.started_at:%Y-%m-%d %H:%M}"
+
 class Wrap(models.Model):
     """
     Represents a generic wrap for a user, allowing for flexible data storage related to their activity.
@@ -41,3 +267,81 @@ class Wrap(models.Model):
         Returns a string representation of the Wrap instance, including the name and username.
         """
         return f"{self.name} by {self.user.username}"
+
+class WrapJob(models.Model):
+    """
+    A wrap queued for generation by a background worker (`run_wrap_worker`).
+    """
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_DONE, 'Done'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='wrap_jobs')
+    time_frame = models.CharField(max_length=50)
+    view_mode = models.CharField(max_length=50, default='dark')
+    language = models.CharField(max_length=10, default='en')
+    access_token = models.TextField(blank=True)  # Encrypted like SpotifyToken; cleared once the job has finished
+    save_on_completion = models.BooleanField(default=False)  # Save the wrap instead of showing it
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    progress = models.PositiveSmallIntegerField(default=0)  # 0-100
+    result = models.JSONField(blank=True, null=True)  # {'context': ..., 'data': ...}
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(blank=True, null=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'created_at'], name='wrapjob_status_created_idx'),
+        ]
+
+    def __str__(self):
+        """
+        Returns a string representation of the WrapJob instance, including the username and status.
+        """
+        return f"{self.user.username}'s {self.time_frame} wrap job ({self.status})"
+
+class UserPreference(models.Model):
+    """
+    A user's display preferences, so they follow the user to a new browser.
+
+    Read through `wrapped.preferences`, which caches it in memory; the
+    preference cookie is what page loads normally use.
+    """
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='preference')
+    view_mode = models.CharField(max_length=20, default='dark')
+    language = models.CharField(max_length=10, default='en')
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        """
+        Returns a string representation of the UserPreference instance, including the username.
+        """
+        return f"{self.user.username}'s preferences ({self.view_mode}, {self.language})"
+
+class SpotifyToken(models.Model):
+    """
+    A user's Spotify OAuth tokens, encrypted at rest.
+
+    Use `wrapped.token_store` to read and write it; it refreshes the access token
+    before it expires so returning users skip the Spotify login redirect.
+    """
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='spotify_token')
+    access_token = models.TextField()  # Fernet-encrypted
+    refresh_token = models.TextField(blank=True)  # Fernet-encrypted
+    expires_at = models.DateTimeField()
+    scope = models.CharField(max_length=255, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        """
+        Returns a string representation of the SpotifyToken instance, including the username.
+        """
+        return f"{self.user.username}'s Spotify token (expires {self.expires_at:%Y-%m-%d %H:%M})"
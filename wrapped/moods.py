@@ -0,0 +1,162 @@
+"""
+Keyword-based mood classification for tracks.
+
+A track goes into the first mood (workout, then chill, then study) with a keyword
+in its name or first artist's name. Instead of one substring scan per keyword
+and track, `MoodClassifier` compiles each of a language's keyword sets once into
+a prefix-factored regular expression, and `classify_many` joins the names of
+all the tracks it is given and runs each expression over them once, so
+classifying 50 top tracks or a whole play history costs three passes of the
+regex engine over their names (`manage.py benchmark_moods` measures it).
+
+Keywords are matched as substrings of the lowercased names, as they always have
+been ("beats" matches "heartbeats"). Every language also uses the English
+keywords, since most titles are English whatever language the user reads.
+Like `analytics`, this module has no Django dependencies.
+"""
+import re
+from bisect import bisect_right
+from functools import lru_cache
+
+# Moods in priority order: a track matching several goes into the first
+MOODS = ('workout_hits', 'chill_vibes', 'study_tunes')
+
+KEYWORDS = {
+    'en': {
+        'workout_hits': ['workout', 'gym', 'pump', 'energy', 'power', 'strong', 'beat', 'bass', 'dance', 'party', 'fire', 'lit', 'hype'],
+        'chill_vibes': ['chill', 'calm', 'peace', 'quiet', 'soft', 'gentle', 'slow', 'acoustic', 'ambient', 'dream', 'sleep', 'night'],
+        'study_tunes': ['study', 'focus', 'concentration', 'classical', 'instrumental', 'piano', 'jazz', 'lofi', 'beats'],
+    },
+    'de': {
+        'workout_hits': ['training', 'kraft', 'stark', 'tanz', 'feuer', 'energie'],
+        'chill_vibes': ['ruhe', 'ruhig', 'sanft', 'leise', 'traum', 'schlaf', 'nacht', 'entspann'],
+        'study_tunes': ['lernen', 'konzentration', 'klassik', 'klavier'],
+    },
+    'es': {
+        'workout_hits': ['entrena', 'fuerza', 'fuerte', 'baile', 'bailar', 'fiesta', 'fuego', 'energía'],
+        'chill_vibes': ['calma', 'tranquil', 'suave', 'sueño', 'dormir', 'noche', 'paz'],
+        'study_tunes': ['estudi', 'concentración', 'clásic', 'piano'],
+    },
+}
+
+# Joins names in a batch; no keyword contains it, so no match spans two names
+_SEPARATOR = '\n'
+
+
+def _track_text(track):
+    artists = track.get('artists') or [{}]
+    return f"{track.get('name', '')}{_SEPARATOR}{artists[0].get('name', '')}"
+
+
+def _trie_pattern(keywords):
+    """
+        Returns a regular expression matching any of `keywords`, with shared
+        prefixes factored out (`bass|beat` becomes `b(?:ass|eat)`), which
+        Python's backtracking engine tries faster than a flat alternation.
+    """
+    trie = {}
+    for keyword in keywords:
+        node = trie
+        for char in keyword:
+            node = node.setdefault(char, {})
+        node[''] = {}
+
+    def pattern(node):
+        branches = [re.escape(char) + pattern(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ''
+        group = branches[0] if len(branches) == 1 else f"(?:{'|'.join(branches)})"
+        if '' in node:
+            # A keyword ends here and longer ones continue
+            return f'(?:{group})?'
+        return group
+
+    return pattern(trie)
+
+
+class MoodClassifier:
+    """
+    Classifies tracks by the keywords of one language (plus the English ones).
+
+    Use `for_language` to get a shared, already compiled instance.
+    """
+
+    def __init__(self, keywords):
+        """
+            Args:
+                keywords (dict): Keyword lists per mood in `MOODS`.
+        """
+        self.patterns = [(mood, re.compile(_trie_pattern(keywords[mood]))) for mood in MOODS if keywords.get(mood)]
+
+    @classmethod
+    def for_language(cls, language=None):
+        """
+            Returns the classifier for a language code (e.g. `de` or `es-mx`);
+            unknown languages get the English keywords.
+        """
+        return _classifier((language or 'en').split('-')[0].lower())
+
+    def classify(self, track):
+        """
+            Returns the mood of one track, or None if no keyword matches.
+        """
+        return self.classify_many([track])[0]
+
+    def classify_many(self, tracks):
+        """
+            Classifies a batch of tracks with one scan per mood over all their names.
+
+            Args:
+                tracks (iterable): Spotify track objects.
+
+            Returns:
+                list: The mood of each track (or None), in order.
+        """
+        # Lowercased one by one: lower() can change a string's length, which
+        # would shift the offsets if done on the joined batch
+        texts = [_track_text(track).lower() for track in tracks]
+        starts, offset = [], 0
+        for text in texts:
+            starts.append(offset)
+            offset += len(text) + len(_SEPARATOR)
+
+        joined = _SEPARATOR.join(texts)
+        moods = [None] * len(texts)
+        # Highest priority first, so a track keeps the first mood it matched
+        for mood, pattern in self.patterns:
+            for match in pattern.finditer(joined):
+                index = bisect_right(starts, match.start()) - 1
+                if moods[index] is None:
+                    moods[index] = mood
+        return moods
+
+
+def keywords_for(language):
+    """
+        Returns the keyword lists per mood used for a language: the English ones
+        plus the language's own.
+    """
+    keywords = {mood: list(KEYWORDS['en'][mood]) for mood in MOODS}
+    if language != 'en':
+        for mood, extra in KEYWORDS.get(language, {}).items():
+            keywords[mood] += extra
+    return keywords
+
+
+@lru_cache(maxsize=16)
+def _classifier(language):
+    return MoodClassifier(keywords_for(language))
+
+
+def classify(track, language=None):
+    """
+        Returns the mood playlist a track belongs to, or None if no keyword matches.
+    """
+    return MoodClassifier.for_language(language).classify(track)
+
+
+def classify_many(tracks, language=None):
+    """
+        Returns the mood of every track in `tracks` (see `MoodClassifier.classify_many`).
+    """
+    return MoodClassifier.for_language(language).classify_many(tracks)
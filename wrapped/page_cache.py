@@ -0,0 +1,138 @@
+"""
+Rendered-page cache for saved wraps.
+
+A saved wrap's content is fixed when it is saved (what its top tracks and
+artists looked like then is kept with it; see `catalog`), so its detail and
+share pages only vary by language, view mode and whether the viewer is logged
+in (the navigation bar). The rendered HTML is cached under those keys with the
+CSRF token swapped for a placeholder, and the visitor's own token is put back in
+on every hit.
+
+Every wrap has a cache "version"; deleting the wrap (directly or through account
+deletion) drops the version, which orphans all of its cached pages at once. That
+only reaches the cache of the process that ran the delete when the `default`
+cache is per process (locmem), so every hit also checks, with one indexed query,
+that the wrap still exists: a deleted wrap is never served from another
+worker's cache. Responses carry an ETag and Last-Modified so browsers revalidate
+with a 304.
+"""
+import hashlib
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import Http404, HttpResponse, HttpResponseNotModified
+from django.middleware.csrf import get_token
+from django.utils.http import http_date, parse_http_date_safe
+
+CSRF_PLACEHOLDER = '__wrap_page_csrf_token__'
+
+
+def _version_key(page_id):
+    return f'wrap-page-version:{page_id}'
+
+
+def _page_version(page_id):
+    key = _version_key(page_id)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, uuid.uuid4().hex, None)
+        version = cache.get(key)
+    return version
+
+
+def detail_page_id(wrap_id):
+    return f'detail:{wrap_id}'
+
+
+def share_page_id(share_token):
+    return f'share:{share_token}'
+
+
+def page_key(page_id, language, view_mode, authenticated):
+    """
+        Returns the cache key of one rendering of a wrap page.
+    """
+    return f'wrap-page:{page_id}:{_page_version(page_id)}:{language}:{view_mode}:{int(authenticated)}'
+
+
+def invalidate_wrap_pages(wrap):
+    """
+        Drops every cached rendering of a wrap's detail and share pages.
+    """
+    page_ids = [detail_page_id(wrap.id)]
+    if wrap.share_token:
+        page_ids.append(share_page_id(wrap.share_token))
+    cache.delete_many([_version_key(page_id) for page_id in page_ids])
+
+
+def _etag(request, key):
+    # The visitor's CSRF secret is part of the tag so a page holding a stale
+    # token (e.g. from before logging in) is never revalidated as current
+    secret = request.META.get('CSRF_COOKIE', '')
+    return '"%s"' % hashlib.md5(f'{key}:{secret}'.encode(), usedforsecurity=False).hexdigest()
+
+
+def _not_modified(request, etag, last_modified):
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match is not None:
+        return etag in [tag.strip() for tag in if_none_match.split(',')]
+    if_modified_since = parse_http_date_safe(request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+    return if_modified_since is not None and int(last_modified) <= if_modified_since
+
+
+def _finish(response, etag, last_modified):
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    # Personalised by the CSRF token and login state: browsers only, always revalidate
+    response['Cache-Control'] = 'private, no-cache'
+    response['Vary'] = 'Cookie'
+    return response
+
+
+def cached_wrap_page(request, page_id, language, view_mode, render_page, wraps):
+    """
+        Serves a wrap page from the cache, rendering and storing it on a miss.
+
+        Args:
+            request (HttpRequest): The HTTP request object.
+            page_id (str): The page, from `detail_page_id` or `share_page_id`.
+            language (str): The page language.
+            view_mode (str): The page view mode.
+            render_page (callable): Called with the CSRF token to use when the page
+                is not cached; returns `(HttpResponse, wrap)` and may raise Http404.
+            wraps (QuerySet): Matches the page's wrap; a hit is only served while
+                it still does.
+
+        Raises:
+            Http404: If the wrap of a cached page has been deleted.
+
+        Returns:
+            HttpResponse: The page, or a 304 if the visitor's copy is current.
+    """
+    # Also makes sure the visitor has a CSRF secret before it goes into the ETag
+    token = get_token(request)
+    key = page_key(page_id, language, view_mode, request.user.is_authenticated)
+    etag = _etag(request, key)
+    conditional = request.method in ('GET', 'HEAD')
+
+    entry = cache.get(key)
+    if entry is not None:
+        # Deleted by another worker, whose invalidation never reached this cache
+        if not wraps.exists():
+            cache.delete(key)
+            raise Http404("No SpotifyWrap matches the given query.")
+        if conditional and _not_modified(request, etag, entry['last_modified']):
+            return _finish(HttpResponseNotModified(), etag, entry['last_modified'])
+        html = entry['html'].replace(CSRF_PLACEHOLDER, token)
+        return _finish(HttpResponse(html), etag, entry['last_modified'])
+
+    response, wrap = render_page(token)
+    last_modified = wrap.created_at.timestamp()
+    if response.status_code == 200:
+        html = response.content.decode(response.charset)
+        cache.set(key, {
+            'html': html.replace(token, CSRF_PLACEHOLDER),
+            'last_modified': last_modified,
+        }, settings.WRAP_PAGE_CACHE_TTL)
+    return _finish(response, etag, last_modified)
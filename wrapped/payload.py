@@ -0,0 +1,134 @@
+"""
+Compact storage for saved wrap data.
+
+Spotify track and artist objects carry far more than the wrap pages show
+(`available_markets`, external ids and URLs, every image size, a second copy of
+the album and its artists...). `project_wrap_data` trims them down to the fields
+the templates and summary columns read, keeping the same nesting so templates
+do not change.
+
+With `WRAP_PAYLOAD_COMPRESSION` on, the list-valued parts of the data are also
+moved out of the JSON column into `SpotifyWrap.packed` as zlib-compressed JSON.
+The scalar metrics, listening patterns and genre breakdown stay in the JSON
+column, where cohort reports query them by key. `SpotifyWrap` encodes on save
+and decodes on load, so `wrap.data` always looks the same.
+"""
+import json
+import zlib
+
+from django.conf import settings
+
+# Fields kept from Spotify objects; nested dicts list the fields kept from them.
+# Only the first (largest) image of a list is ever shown, so only it is kept
+IMAGE_FIELDS = {'url': None}
+TRACK_FIELDS = {
+    'id': None,
+    'name': None,
+    'duration_ms': None,
+    'artists': {'id': None, 'name': None},
+    'album': {'id': None, 'name': None, 'images': IMAGE_FIELDS},
+}
+ARTIST_FIELDS = {
+    'id': None,
+    'name': None,
+    'genres': None,
+    'followers': {'total': None},
+    'images': IMAGE_FIELDS,
+}
+
+# Parts of the data moved into the compressed column
+PACKED_KEYS = ('top_tracks', 'top_artists', 'top_albums', 'longest_streaks', 'favorite_genres')
+
+# First byte of every packed value, so the format can change later
+PACK_FORMAT = b'\x01'
+
+
+def _project(value, fields):
+    if fields is None:
+        return value
+    if isinstance(value, list):
+        items = value[:1] if fields is IMAGE_FIELDS else value
+        return [_project(item, fields) for item in items]
+    if not isinstance(value, dict):
+        return value
+    return {key: _project(value[key], nested) for key, nested in fields.items() if key in value}
+
+
+def project_track(track):
+    """
+        Returns a Spotify track object with only the fields a wrap shows.
+    """
+    return _project(track, TRACK_FIELDS)
+
+
+def project_artist(artist):
+    """
+        Returns a Spotify artist object with only the fields a wrap shows.
+    """
+    return _project(artist, ARTIST_FIELDS)
+
+
+def project_wrap_data(data):
+    """
+        Returns wrap data with its tracks and artists projected.
+
+        Projecting already projected data changes nothing, and data that is not
+        shaped like a generated wrap is returned as it is.
+
+        Args:
+            data (dict): The data stored on `SpotifyWrap.data`.
+
+        Returns:
+            dict: A projected copy of the data.
+    """
+    if not isinstance(data, dict):
+        return data
+    data = dict(data)
+    if isinstance(data.get('top_tracks'), list):
+        data['top_tracks'] = [project_track(track) for track in data['top_tracks']]
+    if isinstance(data.get('top_artists'), list):
+        data['top_artists'] = [project_artist(artist) for artist in data['top_artists']]
+    return data
+
+
+def encode(data, compress=None):
+    """
+        Splits wrap data into the values of the `data` and `packed` columns.
+
+        Args:
+            data (dict): The wrap data.
+            compress (bool): Whether to compress; defaults to `WRAP_PAYLOAD_COMPRESSION`.
+
+        Returns:
+            tuple: The JSON column value and the packed bytes (None when not compressed).
+    """
+    if compress is None:
+        compress = settings.WRAP_PAYLOAD_COMPRESSION
+    if not compress or not isinstance(data, dict):
+        return data, None
+
+    packed = {key: data[key] for key in PACKED_KEYS if key in data}
+    if not packed:
+        return data, None
+    rest = {key: value for key, value in data.items() if key not in packed}
+    encoded = json.dumps(packed, separators=(',', ':')).encode()
+    return rest, PACK_FORMAT + zlib.compress(encoded, 9)
+
+
+def decode(data, packed):
+    """
+        Rebuilds wrap data from the values of the `data` and `packed` columns.
+    """
+    if not packed:
+        return data
+    packed = bytes(packed)
+    if packed[:1] != PACK_FORMAT:
+        raise ValueError(f"Unknown wrap payload format {packed[:1]!r}")
+    return {**(data or {}), **json.loads(zlib.decompress(packed[1:]))}
+
+
+def stored_size(data, packed):
+    """
+        Returns the approximate number of bytes a wrap's data takes up in the database.
+    """
+    return len(json.dumps(data).encode()) + len(packed or b'')
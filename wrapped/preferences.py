@@ -0,0 +1,132 @@
+"""
+Display preferences (view mode and language) without session writes.
+
+Preferences are kept in a signed cookie, so reading them on a page load costs
+neither a session lookup nor a query. Logged-in users also get a
+`UserPreference` record, cached in memory, so their choice follows them to a new
+browser; it is only consulted when a request arrives without the cookie.
+
+`PreferenceMiddleware` puts the current `(view_mode, language)` on
+`request.preferences`; views change them with `update`.
+"""
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import UserPreference
+
+COOKIE_NAME = 'wrapped_prefs'
+COOKIE_SALT = 'wrapped.preferences'
+COOKIE_MAX_AGE = 365 * 24 * 60 * 60
+
+VIEW_MODES = ('light', 'dark', 'high_contrast')
+DEFAULT_VIEW_MODE = 'dark'
+DEFAULT_LANGUAGE = 'en'
+
+
+def clean(view_mode, language):
+    """
+        Returns `(view_mode, language)` with unknown values replaced by the defaults.
+    """
+    if view_mode not in VIEW_MODES:
+        view_mode = DEFAULT_VIEW_MODE
+    if language not in dict(settings.LANGUAGES):
+        language = DEFAULT_LANGUAGE
+    return view_mode, language
+
+
+def _cache_key(user_id):
+    return f'user-preference:{user_id}'
+
+
+def stored_preferences(user):
+    """
+        Returns a user's saved `(view_mode, language)`, or None if they never saved any.
+    """
+    key = _cache_key(user.pk)
+    stored = cache.get(key)
+    if stored is None:
+        record = UserPreference.objects.filter(user=user).values_list('view_mode', 'language').first()
+        # Users without a record are cached too, as an empty tuple
+        stored = tuple(record) if record else ()
+        cache.set(key, stored, settings.USER_PREFERENCE_CACHE_TTL)
+    return stored or None
+
+
+def store_preferences(user, view_mode, language):
+    """
+        Saves a user's preferences to their record and the in-memory cache.
+    """
+    UserPreference.objects.update_or_create(
+        user=user, defaults={'view_mode': view_mode, 'language': language},
+    )
+    cache.set(_cache_key(user.pk), (view_mode, language), settings.USER_PREFERENCE_CACHE_TTL)
+
+
+def load(request):
+    """
+        Works out the preferences of a request.
+
+        The cookie wins; without it, a logged-in user's record is used and then
+        any values left in the session from before preferences moved out of it.
+
+        Args:
+            request (HttpRequest): The HTTP request object.
+
+        Returns:
+            tuple: The `(view_mode, language)` pair and whether the cookie
+            needs to be (re)written.
+    """
+    value = request.get_signed_cookie(COOKIE_NAME, default=None, salt=COOKIE_SALT)
+    if value is not None:
+        view_mode, _, language = value.partition(':')
+        return clean(view_mode, language), False
+
+    if settings.USER_PREFERENCES_ENABLED and request.user.is_authenticated:
+        stored = stored_preferences(request.user)
+        if stored is not None:
+            return clean(*stored), True
+
+    if settings.SESSION_COOKIE_NAME in request.COOKIES:
+        view_mode = request.session.get('view_mode')
+        language = request.session.get('language')
+        if view_mode or language:
+            return clean(view_mode, language), True
+
+    return (DEFAULT_VIEW_MODE, DEFAULT_LANGUAGE), False
+
+
+def update(request, view_mode=None, language=None):
+    """
+        Changes the preferences for this request and the following ones.
+
+        Values that are not given keep their current setting. The cookie is
+        written by `PreferenceMiddleware` on the way out.
+
+        Args:
+            request (HttpRequest): The HTTP request object.
+            view_mode (str): The new view mode, if it changes.
+            language (str): The new language, if it changes.
+
+        Returns:
+            tuple: The resulting `(view_mode, language)`.
+    """
+    current_view_mode, current_language = request.preferences
+    preferences = clean(view_mode or current_view_mode, language or current_language)
+    if preferences != request.preferences:
+        request.preferences = preferences
+        request.preferences_changed = True
+        if settings.USER_PREFERENCES_ENABLED and request.user.is_authenticated:
+            store_preferences(request.user, *preferences)
+    return preferences
+
+
+def set_cookie(response, view_mode, language):
+    response.set_signed_cookie(
+        COOKIE_NAME,
+        f'{view_mode}:{language}',
+        salt=COOKIE_SALT,
+        max_age=COOKIE_MAX_AGE,
+        secure=settings.SESSION_COOKIE_SECURE,
+        httponly=True,
+        samesite='Lax',
+    )
@@ -0,0 +1,200 @@
+"""
+On-demand cProfile profiles of single requests.
+
+`RequestProfilingMiddleware` runs a request under cProfile when it carries a
+valid `X-Profile-Request` header (signed, from `trigger_header_value`; staff
+can copy one from `/profiles/`) or is picked by `REQUEST_PROFILING_SAMPLE_RATE`.
+Either way at most `REQUEST_PROFILING_MAX_PER_MINUTE` requests a minute and one
+at a time are profiled, so a leaked header or a high rate cannot slow a worker
+down much. With `REQUEST_PROFILING_ENABLED` off the middleware is not installed
+at all.
+
+Profiles are written to `REQUEST_PROFILING_DIR` as a `.prof` file (for
+`python -m pstats` or snakeviz) next to a `.json` file with the request's
+metadata; only the newest `REQUEST_PROFILING_KEEP` are kept. Only the request's
+own thread is profiled, not the Spotify fetch pool.
+"""
+import cProfile
+import json
+import pstats
+import random
+import re
+import secrets
+import threading
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+from django.conf import settings
+from django.core import signing
+
+HEADER = 'X-Profile-Request'
+_SALT = 'wrapped.profiling'
+
+# Profile ids are generated here; anything else is not looked up on disk
+PROFILE_ID_RE = re.compile(r'\d{8}-\d{6}-[0-9a-f]{6}')
+
+# cProfile can only profile one request per process at a time
+_profiling = threading.Lock()
+
+
+def trigger_header_value():
+    """
+        Returns a value for the `X-Profile-Request` header, valid for
+        `REQUEST_PROFILING_TOKEN_TTL` seconds.
+    """
+    return signing.TimestampSigner(salt=_SALT).sign('profile')
+
+
+def is_valid_trigger(value):
+    try:
+        signing.TimestampSigner(salt=_SALT).unsign(value, max_age=settings.REQUEST_PROFILING_TOKEN_TTL)
+    except signing.BadSignature:
+        return False
+    return True
+
+
+class Budget:
+    """
+    Allows up to `per_minute` profiles in any sliding minute.
+    """
+
+    def __init__(self, per_minute):
+        self.per_minute = per_minute
+        self._lock = threading.Lock()
+        self._started = []
+
+    def take(self):
+        now = time.monotonic()
+        with self._lock:
+            self._started = [started for started in self._started if now - started < 60]
+            if len(self._started) >= self.per_minute:
+                return False
+            self._started.append(now)
+            return True
+
+
+def trigger(request):
+    """
+        Returns why `request` should be profiled (`header` or `sample`), or None.
+    """
+    value = request.headers.get(HEADER)
+    if value is not None:
+        return 'header' if is_valid_trigger(value) else None
+    rate = settings.REQUEST_PROFILING_SAMPLE_RATE
+    if rate > 0 and random.random() < rate:
+        return 'sample'
+    return None
+
+
+def profile_dir():
+    return Path(settings.REQUEST_PROFILING_DIR)
+
+
+def run_profiled(function, *args):
+    """
+        Runs `function(*args)` under cProfile if no other profile is running.
+
+        Returns:
+            tuple: The result, and the profiler (None if the call was not profiled).
+    """
+    if not _profiling.acquire(blocking=False):
+        return function(*args), None
+    try:
+        profiler = cProfile.Profile()
+        result = profiler.runcall(function, *args)
+        return result, profiler
+    finally:
+        _profiling.release()
+
+
+def save_profile(profiler, metadata):
+    """
+        Stores a profile and its request metadata, dropping the oldest profiles
+        beyond `REQUEST_PROFILING_KEEP`.
+
+        Args:
+            profiler (cProfile.Profile): The finished profiler.
+            metadata (dict): What to show about the request on the profiles page.
+
+        Returns:
+            str: The profile's id.
+    """
+    directory = profile_dir()
+    directory.mkdir(parents=True, exist_ok=True)
+    profile_id = f"{datetime.now(timezone.utc).strftime('%Y%m%d-%H%M%S')}-{secrets.token_hex(3)}"
+    profiler.dump_stats(directory / f'{profile_id}.prof')
+    metadata = {'id': profile_id, 'created_at': datetime.now(timezone.utc).isoformat(timespec='seconds'), **metadata}
+    (directory / f'{profile_id}.json').write_text(json.dumps(metadata))
+
+    for stale in sorted(directory.glob('*.json'), reverse=True)[settings.REQUEST_PROFILING_KEEP:]:
+        stale.unlink(missing_ok=True)
+        stale.with_suffix('.prof').unlink(missing_ok=True)
+    return profile_id
+
+
+def list_profiles():
+    """
+        Returns the metadata of every stored profile, newest first.
+    """
+    directory = profile_dir()
+    if not directory.is_dir():
+        return []
+    profiles = []
+    for path in sorted(directory.glob('*.json'), reverse=True):
+        try:
+            profiles.append(json.loads(path.read_text()))
+        except (OSError, ValueError):
+            continue
+    return profiles
+
+
+def profile_path(profile_id):
+    """
+        Returns the `.prof` file of a stored profile, or None if there is none.
+    """
+    if not PROFILE_ID_RE.fullmatch(profile_id):
+        return None
+    path = profile_dir() / f'{profile_id}.prof'
+    return path if path.is_file() else None
+
+
+def load_profile(profile_id):
+    """
+        Returns the metadata of a stored profile, or None if there is none.
+    """
+    path = profile_path(profile_id)
+    if path is None:
+        return None
+    try:
+        return json.loads(path.with_suffix('.json').read_text())
+    except (OSError, ValueError):
+        return None
+
+
+def top_entries(profile_id, sort='cumulative', limit=40):
+    """
+        Returns the functions of a stored profile that took the longest.
+
+        Args:
+            profile_id (str): The profile's id.
+            sort (str): `cumulative` (including callees) or `tottime` (own time only).
+            limit (int): How many functions to return.
+
+        Returns:
+            list: Dicts with `function`, `location`, `calls`, `tottime` and
+            `cumtime` (seconds), the slowest first.
+    """
+    stats = pstats.Stats(str(profile_path(profile_id)))
+    index = 2 if sort == 'tottime' else 3
+    rows = sorted(stats.stats.items(), key=lambda item: item[1][index], reverse=True)[:limit]
+    entries = []
+    for (filename, line, function), (primitive_calls, calls, tottime, cumtime, _) in rows:
+        entries.append({
+            'function': function,
+            'location': f'{filename}:{line}' if line else filename,
+            'calls': f'{calls}/{primitive_calls}' if calls != primitive_calls else str(calls),
+            'tottime': tottime,
+            'cumtime': cumtime,
+        })
+    return entries
@@ -0,0 +1,231 @@
+"""
+Listening-pattern rollups maintained alongside the stored play history.
+
+Computing a wrap's time-of-day chart and longest streaks from `PlayEvent` rows
+means reading every play in the time frame, which grows without bound as the
+history accumulates. Two summaries are therefore kept up to date as plays are
+stored (`add_plays`, called by `history.store_plays`):
+
+* `ListeningRollup`: the number of plays per user, UTC day and hour. The chart
+  for any date range is one grouped query returning at most 24 rows.
+* `PlayRun`: runs of back-to-back plays of the same track, so the longest
+  streaks are the longest runs in the range instead of a scan over every play.
+
+New plays are always newer than the stored ones, so the only existing rows they
+touch are the latest run and the hour buckets they land in. `rebuild` recomputes
+both from the stored plays; `manage.py rebuild_listening_rollups --check`
+reports users whose rollups have drifted from their history.
+"""
+from collections import Counter
+from datetime import timezone as dt_timezone
+
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import Max, Sum
+
+from .analytics import TOP_STREAKS_COUNT, time_of_day, time_of_day_percentages
+from .models import ListeningRollup, PlayEvent, PlayRun
+
+
+def lock_history(user):
+    """
+        Serialises writes to `user`'s play history and rollups until the current
+        transaction ends, so each play is counted exactly once.
+    """
+    User.objects.select_for_update().filter(pk=user.pk).exists()
+
+
+def _bucket(played_at):
+    played_at = played_at.astimezone(dt_timezone.utc)
+    return played_at.date(), played_at.hour
+
+
+def _runs(events, last_run=None):
+    """
+        Groups plays, oldest first, into runs of the same track, extending
+        `last_run` if the first plays continue it.
+
+        Returns:
+            tuple: The new runs, and whether `last_run` was extended.
+    """
+    runs, extended = [], False
+    for event in events:
+        if last_run is not None and last_run.track_id == event.track_id:
+            last_run.plays += 1
+            last_run.ended_at = event.played_at
+            extended = extended or not runs
+            continue
+        last_run = PlayRun(user_id=event.user_id, track_id=event.track_id,
+                           started_at=event.played_at, ended_at=event.played_at)
+        runs.append(last_run)
+    return runs, extended
+
+
+def add_plays(user, events):
+    """
+        Adds newly stored plays to `user`'s rollups.
+
+        Must run in the transaction that stored the plays, after `lock_history`.
+
+        Args:
+            user (User): The listener.
+            events (list): The new `PlayEvent`s, oldest first, all newer than any
+                play already stored for the user.
+    """
+    if not events:
+        return
+    counts = Counter(_bucket(event.played_at) for event in events)
+    existing = {
+        (rollup.day, rollup.hour): rollup
+        for rollup in ListeningRollup.objects.filter(user=user, day__in={day for day, _ in counts})
+    }
+    updated, created = [], []
+    for (day, hour), plays in counts.items():
+        rollup = existing.get((day, hour))
+        if rollup is None:
+            created.append(ListeningRollup(user=user, day=day, hour=hour, plays=plays))
+        else:
+            rollup.plays += plays
+            updated.append(rollup)
+    ListeningRollup.objects.bulk_update(updated, ['plays'])
+    ListeningRollup.objects.bulk_create(created)
+
+    last_run = PlayRun.objects.filter(user=user).order_by('-started_at').first()
+    runs, extended = _runs(events, last_run)
+    if extended:
+        last_run.save(update_fields=['plays', 'ended_at'])
+    PlayRun.objects.bulk_create(runs)
+
+
+def listening_patterns(user, since=None, pending=()):
+    """
+        Returns the share of `user`'s plays in each part of the day, in the shape
+        of `WrapAggregator.listening_patterns`.
+
+        Args:
+            user (User): The listener.
+            since (datetime): Only count plays from this day on (None: all of them).
+            pending (list): Unsaved `PlayEvent`s newer than the stored plays,
+                counted as if they had been added.
+    """
+    rollups = ListeningRollup.objects.filter(user=user)
+    since_day = since.astimezone(dt_timezone.utc).date() if since is not None else None
+    if since_day is not None:
+        rollups = rollups.filter(day__gte=since_day)
+    counts = {'morning': 0, 'afternoon': 0, 'evening': 0, 'night': 0}
+    for hour, plays in rollups.values('hour').annotate(total=Sum('plays')).values_list('hour', 'total'):
+        counts[time_of_day(hour)] += plays
+    for event in pending:
+        day, hour = _bucket(event.played_at)
+        if since_day is None or day >= since_day:
+            counts[time_of_day(hour)] += 1
+    return time_of_day_percentages(counts)
+
+
+def _streak_rows(runs):
+    return (runs.values('track_id', 'track__name', 'track__album__image_url')
+            .annotate(streak=Max('plays'), latest=Max('started_at')))
+
+
+def longest_streaks(user, since=None, pending=(), tracks=None):
+    """
+        Returns `user`'s longest runs of one track, in the shape of
+        `WrapAggregator.longest_streaks`.
+
+        Args:
+            user (User): The listener.
+            since (datetime): Only count runs that started at or after this time.
+            pending (list): Unsaved `PlayEvent`s, oldest first, newer than the
+                stored plays, counted as if they had been added.
+            tracks (dict): The projected tracks of `pending`, keyed by id, for
+                the ones not in the catalog yet.
+    """
+    runs = PlayRun.objects.filter(user=user)
+    if since is not None:
+        runs = runs.filter(started_at__gte=since)
+    rows = list(_streak_rows(runs).order_by('-streak', '-latest')[:TOP_STREAKS_COUNT])
+    if pending:
+        # The pending plays only add runs, or extend the latest one; a track
+        # outside the stored top can only enter it through one of those runs
+        last_run = PlayRun.objects.filter(user=user).order_by('-started_at').first()
+        new_runs, extended = _runs(pending, last_run)
+        changed = [run for run in new_runs + ([last_run] if extended else [])
+                   if since is None or run.started_at >= since]
+        merged = {row['track_id']: row for row in rows}
+        merged.update((row['track_id'], row) for row in
+                      _streak_rows(runs.filter(track_id__in={run.track_id for run in changed})))
+        for run in changed:
+            row = merged.get(run.track_id)
+            if row is None:
+                track = (tracks or {}).get(run.track_id, {})
+                images = track.get('album', {}).get('images') or []
+                row = merged[run.track_id] = {
+                    'track_id': run.track_id, 'track__name': track.get('name'), 'streak': 0, 'latest': run.started_at,
+                    'track__album__image_url': images[0].get('url') if images else None,
+                }
+            row['streak'] = max(row['streak'], run.plays)
+            row['latest'] = max(row['latest'], run.started_at)
+        rows = sorted(merged.values(), key=lambda row: (row['streak'], row['latest']), reverse=True)[:TOP_STREAKS_COUNT]
+    return [
+        {'name': row['track__name'], 'streak': row['streak'], 'album_art_url': row['track__album__image_url'] or None}
+        for row in rows
+    ]
+
+
+def compute(user, chunk_size=2000):
+    """
+        Computes `user`'s rollups from scratch from the stored plays.
+
+        Returns:
+            tuple: `{(day, hour): plays}` and the list of unsaved `PlayRun`s.
+    """
+    counts, runs, last_run = Counter(), [], None
+    events = (PlayEvent.objects.filter(user=user).order_by('played_at')
+              .only('user_id', 'track_id', 'played_at').iterator(chunk_size=chunk_size))
+    for event in events:
+        counts[_bucket(event.played_at)] += 1
+        new_runs, _ = _runs([event], last_run)
+        if new_runs:
+            last_run = new_runs[0]
+            runs.append(last_run)
+    return counts, runs
+
+
+def rebuild(user):
+    """
+        Replaces `user`'s rollups with ones computed from the stored plays.
+    """
+    with transaction.atomic():
+        lock_history(user)
+        counts, runs = compute(user)
+        ListeningRollup.objects.filter(user=user).delete()
+        PlayRun.objects.filter(user=user).delete()
+        ListeningRollup.objects.bulk_create(
+            ListeningRollup(user=user, day=day, hour=hour, plays=plays) for (day, hour), plays in counts.items()
+        )
+        PlayRun.objects.bulk_create(runs)
+
+
+def check(user):
+    """
+        Compares `user`'s rollups with ones computed from the stored plays.
+
+        Returns:
+            list: Descriptions of the differences; empty if the rollups are consistent.
+    """
+    counts, runs = compute(user)
+    stored = {(day, hour): plays for day, hour, plays
+              in ListeningRollup.objects.filter(user=user).values_list('day', 'hour', 'plays')}
+    problems = [
+        f"{day} {hour:02d}h: {stored.get((day, hour), 0)} stored, {counts.get((day, hour), 0)} played"
+        for day, hour in sorted(set(stored) | set(counts))
+        if stored.get((day, hour), 0) != counts.get((day, hour), 0)
+    ]
+    expected_runs = {(run.started_at, run.track_id, run.plays) for run in runs}
+    stored_runs = set(PlayRun.objects.filter(user=user).values_list('started_at', 'track_id', 'plays'))
+    if expected_runs != stored_runs:
+        problems.append(
+            f"streaks: {len(stored_runs - expected_runs)} stored run(s) not in the history, "
+            f"{len(expected_runs - stored_runs)} missing"
+        )
+    return problems
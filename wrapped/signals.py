@@ -0,0 +1,14 @@
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+
+from . import page_cache
+from .models import SpotifyWrap
+
+
+@receiver(post_delete, sender=SpotifyWrap)
+def drop_cached_wrap_pages(sender, instance, **kwargs):
+    """
+    Drops a wrap's cached pages when it is deleted, including when its owner's
+    account is deleted and the wrap goes with it.
+    """
+    page_cache.invalidate_wrap_pages(instance)
@@ -0,0 +1,61 @@
+"""
+Short-lived server-side snapshots of rendered wraps.
+
+When `generate_wrap` renders a wrap it stages the exact data it would save under
+a random snapshot id. The "Save Wrap" form posts that id back, so saving is a
+single insert instead of another round of Spotify calls and analytics. Snapshots
+expire after `WRAP_SNAPSHOT_TTL` seconds and are scoped to the user who rendered
+them; a missing or expired snapshot simply means the wrap is recomputed.
+
+Snapshots live in the default cache, which has to be shared by every worker
+process (see `CACHE_BACKEND`): with the in-process default, a save posted to
+another worker finds no snapshot and recomputes the wrap.
+"""
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+
+
+def _key(user_id, snapshot_id):
+    return f'wrap-snapshot:{user_id}:{snapshot_id}'
+
+
+def stage_wrap(user_id, data):
+    """
+        Stages wrap data for a later save.
+
+        Args:
+            user_id (int): The owner of the wrap.
+            data (dict): The data that would be stored on `SpotifyWrap.data`.
+
+        Returns:
+            str: The snapshot id to post back when saving.
+    """
+    snapshot_id = uuid.uuid4().hex
+    cache.set(_key(user_id, snapshot_id), data, settings.WRAP_SNAPSHOT_TTL)
+    return snapshot_id
+
+
+def take_wrap(user_id, snapshot_id):
+    """
+        Removes and returns a staged snapshot.
+
+        Taking the snapshot consumes it, so a double-submitted form saves the
+        wrap only once from the snapshot: of two concurrent takes, only the one
+        whose delete removed the entry gets the data.
+
+        Args:
+            user_id (int): The user trying to save the wrap.
+            snapshot_id (str): The id returned by `stage_wrap`.
+
+        Returns:
+            dict: The staged wrap data, or None if it is unknown or expired.
+    """
+    if not snapshot_id:
+        return None
+    key = _key(user_id, snapshot_id)
+    data = cache.get(key)
+    if data is None or not cache.delete(key):
+        return None
+    return data
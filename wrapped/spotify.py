@@ -0,0 +1,527 @@
+"""
+Spotify Web API client shared by the views.
+
+All outbound Spotify traffic goes through a single pooled `requests.Session`
+per worker process, so keep-alive connections and TLS sessions are reused
+between requests. Calls get a configurable timeout, 429 responses are retried
+after their `Retry-After` delay (bounded by `SPOTIFY_MAX_BACKOFF`), and the
+latency of every endpoint is recorded in `timing`.
+
+Responses that are expensive and rarely change (top tracks and artists) can be
+cached per user, endpoint and query string. Fresh entries are served without any
+outbound call; stale ones are revalidated with `If-None-Match` so an unchanged
+payload only costs a 304.
+"""
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
+import contextvars
+from itertools import islice
+import logging
+import threading
+import time
+from urllib.parse import urlencode
+
+import requests
+from django.conf import settings
+from django.core.cache import caches
+from requests.adapters import HTTPAdapter
+
+from . import timing
+
+logger = logging.getLogger(__name__)
+
+# Statuses worth retrying; anything else is returned to the caller as-is.
+RETRY_STATUSES = {429, 502, 503, 504}
+
+# Other methods are only retried on a 429, which Spotify answers without acting on
+# the request; after a 5xx a POST to /api/token may already have used up its code.
+IDEMPOTENT_METHODS = {'GET', 'HEAD'}
+
+_session = None
+_session_lock = threading.Lock()
+
+# Shared pool for fanning out independent Spotify calls; reused across requests
+# so each wrap does not pay for spinning up its own threads.
+_fetch_pool = ThreadPoolExecutor(
+    max_workers=settings.SPOTIFY_FETCH_WORKERS,
+    thread_name_prefix='spotify-fetch',
+)
+
+
+def _submit(function, *args):
+    # Run in a copy of the caller's context, so the calls count towards its request's timings
+    return _fetch_pool.submit(contextvars.copy_context().run, function, *args)
+
+
+def get_session():
+    """
+        Returns the worker's shared Spotify session, creating it on first use.
+
+        Returns:
+            requests.Session: A session whose connection pool is sized for the
+            concurrent fan-out in `fetch_wrap_sources`.
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(
+                    pool_connections=4,
+                    pool_maxsize=settings.SPOTIFY_FETCH_WORKERS,
+                )
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                _session = session
+    return _session
+
+
+def _retry_delay(response, attempt):
+    """
+        Works out how long to wait before retrying `response`.
+
+        Uses the `Retry-After` header when Spotify sends one and falls back to
+        exponential backoff otherwise.
+    """
+    retry_after = response.headers.get('Retry-After')
+    if retry_after is not None:
+        try:
+            return max(0.0, float(retry_after))
+        except ValueError:
+            pass
+    return settings.SPOTIFY_BACKOFF_BASE * (2 ** attempt)
+
+
+def next_retry_delay(response, method, endpoint, attempt):
+    """
+        Decides whether `response` should be retried.
+
+        Returns:
+            float: Seconds to wait before the next attempt, or None to give up
+            and hand the response to the caller.
+    """
+    if response.status_code not in RETRY_STATUSES or attempt >= settings.SPOTIFY_MAX_RETRIES:
+        return None
+    if method.upper() not in IDEMPOTENT_METHODS and response.status_code != 429:
+        return None
+
+    delay = _retry_delay(response, attempt)
+    if delay > settings.SPOTIFY_MAX_BACKOFF:
+        # Spotify wants us to back off longer than a page view can wait
+        logger.warning("Spotify %s asked to retry after %ss; giving up", endpoint, delay)
+        return None
+
+    logger.info("Spotify %s returned %s; retrying in %ss", endpoint, response.status_code, delay)
+    return delay
+
+
+def send(method, url, endpoint, timeout=None, **kwargs):
+    """
+        Sends a request through the pooled session with retries and timing.
+
+        Args:
+            method (str): The HTTP method.
+            url (str): The absolute URL to call.
+            endpoint (str): A stable name for the endpoint, used for the latency metrics.
+            timeout (float): Per-attempt timeout in seconds.
+            **kwargs: Passed through to `requests.Session.request`.
+
+        Returns:
+            requests.Response: The final response.
+
+        Raises:
+            requests.RequestException: If the request could not be sent at all.
+    """
+    if timeout is None:
+        timeout = settings.SPOTIFY_API_TIMEOUT
+    session = get_session()
+
+    attempt = 0
+    while True:
+        started = time.perf_counter()
+        try:
+            response = session.request(method, url, timeout=timeout, **kwargs)
+        except requests.RequestException:
+            timing.record_spotify_call(endpoint, time.perf_counter() - started, ok=False)
+            raise
+        timing.record_spotify_call(endpoint, time.perf_counter() - started, ok=response.ok)
+
+        delay = next_retry_delay(response, method, endpoint, attempt)
+        if delay is None:
+            return response
+        time.sleep(delay)
+        attempt += 1
+
+
+def response_cache():
+    """
+        Returns the cache backing Spotify responses (the `spotify` alias).
+    """
+    return caches['spotify']
+
+
+def cache_key(cache_user, path, params):
+    """
+        Returns the response cache key for a call: every query parameter is
+        part of it (sorted, so their order does not matter), so calls that
+        differ in `limit`, `offset` or any other parameter never share an entry.
+    """
+    query = urlencode(sorted((params or {}).items()))
+    return f'spotify:{cache_user}:{path}?{query}'
+
+
+def cache_timeout():
+    """
+        Returns how long a cache entry is kept: fresh for `SPOTIFY_CACHE_TTL`,
+        then stale but revalidatable for `SPOTIFY_CACHE_STALE_TTL`.
+    """
+    return settings.SPOTIFY_CACHE_TTL + settings.SPOTIFY_CACHE_STALE_TTL
+
+
+def is_fresh(entry):
+    return time.time() - entry['fetched_at'] < settings.SPOTIFY_CACHE_TTL
+
+
+def new_cache_entry(items, etag):
+    return {'items': items, 'etag': etag, 'fetched_at': time.time()}
+
+
+def wrap_source_requests(time_frame):
+    """
+        Returns the Spotify calls a wrap needs as `name: (path, params, cache)`.
+
+        Top tracks and artists only move slowly, so they are served from the
+        response cache; recently played and playlists are always fetched live.
+    """
+    return {
+        'top_tracks': ('/me/top/tracks', {'time_range': time_frame, 'limit': 50}, True),
+        'top_artists': ('/me/top/artists', {'time_range': time_frame, 'limit': 50}, True),
+        'recently_played': ('/me/player/recently-played', {'limit': 50}, False),
+        'playlists': ('/me/playlists', {'limit': 20}, False),
+    }
+
+
+def parse_page(response, path):
+    """
+        Returns the body of a paged Spotify response, or None if it is not a page.
+
+        Error statuses and bodies without an `items` list (e.g. an error object
+        sent with a 200) are logged and treated as a failed page.
+    """
+    if response.status_code != 200:
+        logger.warning("Spotify request to %s returned %s", path, response.status_code)
+        return None
+    try:
+        page = response.json()
+    except ValueError:
+        page = None
+    if not isinstance(page, dict) or not isinstance(page.get('items'), list):
+        logger.warning("Spotify request to %s returned a body that is not a page", path)
+        return None
+    return page
+
+
+def is_last_page(page, limit):
+    """
+        Returns whether no page follows `page`: it is short, or Spotify sent `next: null`.
+    """
+    return len(page['items']) < limit or ('next' in page and page['next'] is None)
+
+
+def page_offsets(first_page, limit):
+    """
+        Returns the offsets of the pages after `first_page`, or None if its `total` is unknown.
+
+        An empty list means the first page already held everything.
+    """
+    total = first_page.get('total')
+    if is_last_page(first_page, limit):
+        return []
+    if not isinstance(total, int):
+        return None
+    return list(range(limit, total, limit))
+
+
+def token_request_data(code, redirect_uri):
+    return {
+        'grant_type': 'authorization_code',
+        'code': code,
+        'redirect_uri': redirect_uri,
+        'client_id': settings.SPOTIFY_CLIENT_ID,
+        'client_secret': settings.SPOTIFY_CLIENT_SECRET,
+    }
+
+
+def refresh_request_data(refresh_token):
+    return {
+        'grant_type': 'refresh_token',
+        'refresh_token': refresh_token,
+        'client_id': settings.SPOTIFY_CLIENT_ID,
+        'client_secret': settings.SPOTIFY_CLIENT_SECRET,
+    }
+
+
+class SpotifyClient:
+    """
+    Thin wrapper around the Spotify Web API for a single access token.
+
+    When `cache_user` is given, `get_items(..., cache=True)` responses are
+    cached under that user's key; without it nothing is cached, since the
+    payloads are user specific.
+    """
+
+    def __init__(self, access_token, timeout=None, cache_user=None):
+        self.access_token = access_token
+        self.timeout = timeout
+        self.cache_user = cache_user
+
+    @property
+    def headers(self):
+        return {'Authorization': f'Bearer {self.access_token}'}
+
+    def get(self, path, params=None, extra_headers=None):
+        """
+            Calls `GET {SPOTIFY_API_BASE_URL}{path}`.
+
+            Args:
+                path (str): The API path, e.g. `/me/top/tracks`.
+                params (dict): Query string parameters.
+                extra_headers (dict): Headers to send on top of the bearer token.
+
+            Returns:
+                requests.Response: The response from Spotify.
+        """
+        url = f'{settings.SPOTIFY_API_BASE_URL}{path}'
+        headers = self.headers
+        if extra_headers:
+            headers.update(extra_headers)
+        return send('GET', url, path, timeout=self.timeout, headers=headers, params=params)
+
+    def get_items(self, path, params=None, cache=False):
+        """
+            Fetches a paged Spotify endpoint and returns its `items` list.
+
+            Any network error, non-200 response or body without an `items` list
+            yields an empty list so one failing endpoint does not take down the
+            whole wrap. With `cache`,
+            fresh cached items are returned without a request, stale ones are
+            revalidated with their ETag, and a failed refresh falls back to the
+            stale copy.
+
+            Args:
+                path (str): The API path, e.g. `/me/top/tracks`.
+                params (dict): Query string parameters.
+                cache (bool): Whether to use the per-user response cache.
+
+            Returns:
+                list: The `items` of the response, or an empty list on failure.
+        """
+        use_cache = cache and self.cache_user is not None
+        entry = None
+        extra_headers = None
+        if use_cache:
+            key = cache_key(self.cache_user, path, params)
+            entry = response_cache().get(key)
+            if entry is not None:
+                if is_fresh(entry):
+                    return entry['items']
+                if entry['etag']:
+                    extra_headers = {'If-None-Match': entry['etag']}
+
+        try:
+            response = self.get(path, params, extra_headers)
+        except requests.RequestException as exc:
+            logger.warning("Spotify request to %s failed: %s", path, exc)
+            return entry['items'] if entry is not None else []
+
+        if response.status_code == 304 and entry is not None:
+            entry['fetched_at'] = time.time()
+            response_cache().set(key, entry, cache_timeout())
+            return entry['items']
+
+        page = parse_page(response, path)
+        if page is None:
+            return entry['items'] if entry is not None else []
+
+        items = page['items']
+        if use_cache:
+            response_cache().set(key, new_cache_entry(items, response.headers.get('ETag')), cache_timeout())
+        return items
+
+    def get_page(self, path, params=None, offset=0, limit=50):
+        """
+            Fetches one page of a paged endpoint.
+
+            Args:
+                path (str): The API path.
+                params (dict): Query string parameters besides `offset` and `limit`.
+                offset (int): The page offset; None for cursor-paged endpoints.
+                limit (int): The page size.
+
+            Returns:
+                dict: The page body, or None if the request failed.
+        """
+        params = {**(params or {}), 'limit': limit}
+        if offset is not None:
+            params['offset'] = offset
+        try:
+            response = self.get(path, params)
+        except requests.RequestException as exc:
+            logger.warning("Spotify request to %s failed: %s", path, exc)
+            return None
+        return parse_page(response, path)
+
+    def _sequential_pages(self, path, params, offset, limit):
+        while True:
+            page = self.get_page(path, params, offset, limit)
+            yield page
+            if page is None or is_last_page(page, limit):
+                return
+            offset += limit
+
+    def _concurrent_pages(self, path, params, offsets, limit):
+        # Keep up to SPOTIFY_PAGES_IN_FLIGHT pages requested ahead of the consumer
+        offsets = iter(offsets)
+        futures = deque(_submit(self.get_page, path, params, offset, limit)
+                        for offset in islice(offsets, settings.SPOTIFY_PAGES_IN_FLIGHT))
+        try:
+            while futures:
+                page = futures.popleft().result()
+                for offset in islice(offsets, 1):
+                    futures.append(_submit(self.get_page, path, params, offset, limit))
+                yield page
+        finally:
+            # Stopped early (or the consumer did): skip the pages not started yet
+            for future in futures:
+                future.cancel()
+
+    def iter_items(self, path, params=None, limit=50):
+        """
+            Yields every item of a paged endpoint, in order.
+
+            The first page's `total` tells which offsets remain; those pages are
+            fetched concurrently on the shared pool, at most
+            `SPOTIFY_PAGES_IN_FLIGHT` at a time, and yielded in order as they
+            arrive, so a deep pull costs a few round trips instead of one per
+            page. Iteration stops at the first short, empty or failed page, or
+            one whose `next` is null. Endpoints that send no `total` are paged
+            one request at a time.
+
+            Not to be used from a task already running on the shared pool.
+
+            Args:
+                path (str): The API path, e.g. `/me/top/tracks`.
+                params (dict): Query string parameters besides `offset` and `limit`.
+                limit (int): The page size (Spotify allows up to 50).
+
+            Yields:
+                dict: The items of every page.
+        """
+        first_page = self.get_page(path, params, 0, limit)
+        if first_page is None:
+            return
+        yield from first_page['items']
+
+        offsets = page_offsets(first_page, limit)
+        if offsets is None:
+            pages = self._sequential_pages(path, params, limit, limit)
+        else:
+            pages = self._concurrent_pages(path, params, offsets, limit)
+
+        try:
+            for page in pages:
+                if page is None:
+                    return
+                yield from page['items']
+                if is_last_page(page, limit):
+                    return
+        finally:
+            pages.close()
+
+    def fetch_wrap_sources(self, time_frame):
+        """
+            Fetches every Spotify resource a wrap needs, concurrently.
+
+            The four calls are independent, so they are submitted to a shared thread
+            pool and the wall time approaches that of the slowest single call. Calls
+            that fail or miss the overall deadline come back as empty lists.
+
+            A call already running when the deadline passes cannot be cancelled:
+            it keeps its pool thread until it finishes (bounded by the per-call
+            `SPOTIFY_API_TIMEOUT` and its retries), and its result is dropped.
+
+            Args:
+                time_frame (str): The Spotify `time_range` for top tracks and artists.
+
+            Returns:
+                dict: Item lists keyed by `top_tracks`, `top_artists`,
+                `recently_played` and `playlists`.
+        """
+        started = time.perf_counter()
+        futures = {
+            name: _submit(self.get_items, path, params, cache)
+            for name, (path, params, cache) in wrap_source_requests(time_frame).items()
+        }
+
+        deadline = started + settings.SPOTIFY_FANOUT_DEADLINE
+        results = {}
+        for name, future in futures.items():
+            try:
+                results[name] = future.result(timeout=max(deadline - time.perf_counter(), 0))
+            except FuturesTimeoutError:
+                logger.warning("Spotify fetch for %s missed the %ss deadline", name, settings.SPOTIFY_FANOUT_DEADLINE)
+                # Only stops calls still queued; a running one holds its thread until it returns
+                future.cancel()
+                results[name] = []
+            except Exception:
+                logger.exception("Spotify fetch for %s failed", name)
+                results[name] = []
+
+        logger.debug("Spotify fan-out finished in %.3fs", time.perf_counter() - started)
+        return results
+
+
+def exchange_code(code, redirect_uri):
+    """
+        Exchanges an OAuth authorization code for Spotify tokens.
+
+        Args:
+            code (str): The code Spotify passed to the callback.
+            redirect_uri (str): The redirect URI used to obtain the code.
+
+        Returns:
+            dict: The token response, or None if the exchange failed.
+    """
+    url = f'{settings.SPOTIFY_ACCOUNTS_BASE_URL}/api/token'
+    try:
+        response = send('POST', url, '/api/token', data=token_request_data(code, redirect_uri))
+    except requests.RequestException as exc:
+        logger.warning("Spotify token exchange failed: %s", exc)
+        return None
+
+    if response.status_code != 200:
+        return None
+    return response.json()
+
+
+def refresh_access_token(refresh_token):
+    """
+        Trades a refresh token for a new access token.
+
+        Args:
+            refresh_token (str): The refresh token from an earlier token response.
+
+        Returns:
+            tuple: The HTTP status (None if Spotify could not be reached) and the
+            token response, or None if the refresh failed.
+    """
+    url = f'{settings.SPOTIFY_ACCOUNTS_BASE_URL}/api/token'
+    try:
+        response = send('POST', url, '/api/token', data=refresh_request_data(refresh_token))
+    except requests.RequestException as exc:
+        logger.warning("Spotify token refresh failed: %s", exc)
+        return None, None
+
+    if response.status_code != 200:
+        return response.status_code, None
+    return response.status_code, response.json()
@@ -0,0 +1,292 @@
+"""
+Replays recorded Spotify Web API responses without the network.
+
+`StubAdapter` is a `requests` transport adapter answering the calls a wrap makes
+from the recordings in `wrapped/testdata`. With `size`, the recorded items are
+cloned under new ids until each endpoint has that many, so views and analytics
+can be measured at several input sizes against the same data. Paging
+(`offset`/`limit`, and the `after` cursor of recently played) behaves like
+Spotify's.
+
+`stub_spotify` mounts the adapter on the shared Spotify session for the length
+of a `with` block. Used by the tests and `manage.py benchmark_views`.
+
+`FakeSpotifyServer` serves the same responses over HTTP, together with the
+accounts endpoints (`/authorize` and `/api/token`), with configurable latency,
+jitter and bursts of 429s, so the whole login-to-dashboard flow can be
+load-tested offline (`manage.py fake_spotify` and `manage.py load_test`).
+"""
+import json
+import random
+import secrets
+import threading
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlencode, urlsplit
+
+import requests
+from django.conf import settings
+from requests.adapters import BaseAdapter
+
+from . import history, spotify
+
+TESTDATA = Path(__file__).resolve().parent / 'testdata'
+
+# Recording served for each API path
+RECORDINGS = {
+    '/me/top/tracks': 'top_tracks',
+    '/me/top/artists': 'top_artists',
+    '/me/player/recently-played': 'recently_played_initial',
+    '/me/playlists': 'playlists',
+}
+
+
+@lru_cache(maxsize=None)
+def recording(name):
+    """
+        Returns a recorded response body from `testdata` (shared; do not modify it).
+    """
+    return json.loads((TESTDATA / f'{name}.json').read_text())
+
+
+def _clone(item, copy):
+    item = json.loads(json.dumps(item))
+    target = item.get('track') or item
+    if target.get('id'):
+        target['id'] = f"{target['id']}-{copy}"
+    if 'name' in target:
+        target['name'] = f"{target['name']} {copy}"
+    return item
+
+
+@lru_cache(maxsize=64)
+def scaled_items(name, size):
+    """
+        Returns the items of a recording, cloned under new ids up to `size`
+        (None: as recorded). Recently played items are re-timed to stay unique
+        and newest first, three minutes apart.
+    """
+    items = recording(name)['items']
+    if size is None:
+        return tuple(items)
+    count = len(items)
+    scaled = [items[index] if index < count else _clone(items[index % count], index // count) for index in range(size)]
+    if name.startswith('recently_played'):
+        newest = history.parse_played_at(items[0]['played_at'])
+        for index, item in enumerate(scaled):
+            item = scaled[index] = {**item}
+            played_at = newest - timedelta(minutes=3 * index)
+            item['played_at'] = played_at.isoformat(timespec='milliseconds').replace('+00:00', 'Z')
+    return tuple(scaled)
+
+
+def _millis(played_at):
+    return round(history.parse_played_at(played_at).timestamp() * 1000)
+
+
+def response_body(path, params, size=None):
+    """
+        Returns the body Spotify would send for `GET path?params`, or None for
+        an endpoint without a recording.
+    """
+    name = RECORDINGS.get(path)
+    if name is None:
+        return None
+    items = list(scaled_items(name, size))
+    limit = int(params.get('limit', 20))
+    body = {key: value for key, value in recording(name).items() if key != 'items'}
+
+    if 'after' in params:
+        # Cursor paging: the oldest `limit` plays after the cursor, returned newest first
+        after = int(params['after'])
+        items = [item for item in items if _millis(item['played_at']) > after][-limit:]
+    else:
+        offset = int(params.get('offset', 0))
+        more = offset + limit < len(items)
+        body.update(total=len(items), offset=offset,
+                    next=f'{settings.SPOTIFY_API_BASE_URL}{path}?offset={offset + limit}&limit={limit}' if more else None)
+        items = items[offset:offset + limit]
+    body.setdefault('next', None)
+    body.update(items=items, limit=limit)
+    if 'cursors' in body:
+        body['cursors'] = {
+            'after': str(_millis(items[0]['played_at'])),
+            'before': str(_millis(items[-1]['played_at'])),
+        } if items else None
+    return body
+
+
+class StubAdapter(BaseAdapter):
+    """
+    Answers Spotify Web API requests from the recordings.
+
+    Every request's path and parameters are kept in `requests`.
+    """
+
+    def __init__(self, size=None):
+        super().__init__()
+        self.size = size
+        self.requests = []
+
+    def send(self, request, **kwargs):
+        url = urlsplit(request.url)
+        base_path = urlsplit(settings.SPOTIFY_API_BASE_URL).path
+        path = url.path[len(base_path):] if url.path.startswith(base_path) else url.path
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+        self.requests.append((path, params))
+
+        body = response_body(path, params, self.size)
+        response = requests.Response()
+        response.status_code = 200 if body is not None else 404
+        if body is None:
+            body = {'error': {'status': 404, 'message': 'Service not found'}}
+        response._content = json.dumps(body).encode()
+        response.headers['Content-Type'] = 'application/json; charset=utf-8'
+        response.encoding = 'utf-8'
+        response.url = request.url
+        response.request = request
+        return response
+
+    def close(self):
+        pass
+
+
+@contextmanager
+def stub_spotify(size=None):
+    """
+        Serves Spotify Web API calls from the recordings inside the block.
+
+        Args:
+            size (int): Items per endpoint (None: as recorded).
+
+        Yields:
+            StubAdapter: The mounted adapter.
+    """
+    session = spotify.get_session()
+    prefix = settings.SPOTIFY_API_BASE_URL
+    previous = session.adapters.get(prefix)
+    adapter = StubAdapter(size)
+    session.mount(prefix, adapter)
+    try:
+        yield adapter
+    finally:
+        if previous is not None:
+            session.mount(prefix, previous)
+        else:
+            session.adapters.pop(prefix, None)
+
+
+class FakeSpotifyHandler(BaseHTTPRequestHandler):
+    """
+    Answers the Spotify accounts and Web API calls the app makes.
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def send_json(self, status, body, headers=None):
+        content = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(content)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(content)
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+        if url.path == '/authorize':
+            # Consent is granted at once; back to the app with a code
+            self.send_response(302)
+            self.send_header('Location', f"{params.get('redirect_uri', '/')}?{urlencode({'code': secrets.token_hex(8)})}")
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        server = self.server
+        server.wait()
+        if server.throttled():
+            self.send_json(429, {'error': {'status': 429, 'message': 'API rate limit exceeded'}},
+                           {'Retry-After': str(server.retry_after)})
+            return
+        path = url.path[len(server.api_prefix):] if url.path.startswith(server.api_prefix) else url.path
+        body = response_body(path, params, server.size)
+        if body is None:
+            self.send_json(404, {'error': {'status': 404, 'message': 'Service not found'}})
+        else:
+            self.send_json(200, body)
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        self.rfile.read(length)
+        if urlsplit(self.path).path != '/api/token':
+            self.send_json(404, {'error': 'not_found'})
+            return
+        self.server.wait()
+        self.send_json(200, {
+            'access_token': f'fake-{secrets.token_hex(16)}',
+            'token_type': 'Bearer',
+            'expires_in': 3600,
+            'refresh_token': f'fake-{secrets.token_hex(16)}',
+            'scope': 'user-top-read user-read-recently-played playlist-read-private',
+        })
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+class FakeSpotifyServer(ThreadingHTTPServer):
+    """
+    A local stand-in for Spotify, for load tests.
+
+    Point `SPOTIFY_ACCOUNTS_BASE_URL` at `http://host:port` and
+    `SPOTIFY_API_BASE_URL` at `http://host:port/v1`.
+
+    Args:
+        address (tuple): The `(host, port)` to listen on.
+        latency (float): Mean delay of every response, in milliseconds.
+        jitter (float): Each delay is drawn uniformly within this many
+            milliseconds of `latency`.
+        size (int): Items per Web API endpoint (None: as recorded).
+        burst_every (int): Out of every `burst_every` Web API calls, the last
+            `burst_length` are answered with 429 (0: never).
+        burst_length (int): Length of each 429 burst.
+        retry_after (int): The `Retry-After` sent with a 429, in seconds.
+        verbose (bool): Log every request.
+    """
+    daemon_threads = True
+    request_queue_size = 128
+    api_prefix = '/v1'
+
+    def __init__(self, address, latency=0.0, jitter=0.0, size=None, burst_every=0, burst_length=0,
+                 retry_after=1, verbose=False):
+        super().__init__(address, FakeSpotifyHandler)
+        self.latency = latency
+        self.jitter = jitter
+        self.size = size
+        self.burst_every = burst_every
+        self.burst_length = burst_length
+        self.retry_after = retry_after
+        self.verbose = verbose
+        self.api_calls = 0
+        self.throttled_calls = 0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        delay = self.latency + random.uniform(-self.jitter, self.jitter)
+        if delay > 0:
+            time.sleep(delay / 1000)
+
+    def throttled(self):
+        with self._lock:
+            position = self.api_calls
+            self.api_calls += 1
+            if not self.burst_every or position % self.burst_every < self.burst_every - self.burst_length:
+                return False
+            self.throttled_calls += 1
+            return True
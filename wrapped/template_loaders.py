@@ -0,0 +1,76 @@
+"""
+Template loader that keeps one compiled copy of each template per language.
+
+Every page has a single template whose text goes through `{% translate %}` and
+`{% blocktranslate %}`, which look each string up in the gettext catalog on
+every render. `TranslatedLoader` is Django's cached loader with the active
+language added to the cache key: when a template is first loaded in a
+language, the tags whose output cannot change (a constant string without
+variables, filters, plural, context or `as`) are rendered once and replaced by
+the translated text. Renders then only look up the strings that depend on the
+context.
+"""
+from django.template import Context
+from django.template.base import TextNode, TokenType, Variable
+from django.template.defaulttags import IfNode
+from django.template.loaders import cached
+from django.templatetags.i18n import BlockTranslateNode, TranslateNode
+from django.utils import translation
+
+
+def _is_constant(node):
+    if isinstance(node, TranslateNode):
+        expression = node.filter_expression
+        return (node.asvar is None and node.message_context is None and not expression.filters
+                and isinstance(expression.var, Variable) and expression.var.literal is not None)
+    if isinstance(node, BlockTranslateNode):
+        return (node.asvar is None and node.message_context is None and node.counter is None
+                and not node.extra_context and not node.plural
+                and all(token.token_type == TokenType.TEXT for token in node.singular))
+    return False
+
+
+def _nodelists(node):
+    if isinstance(node, IfNode):
+        # `IfNode.nodelist` is built on access; the branches hold the real lists
+        return [nodelist for _, nodelist in node.conditions_nodelists]
+    return [getattr(node, name) for name in node.child_nodelists if getattr(node, name, None) is not None]
+
+
+def translate_constants(nodelist, context):
+    """
+        Replaces the translation tags in `nodelist` (and the lists nested in
+        it) whose output is fixed in the active language with their text.
+
+        Args:
+            nodelist (NodeList): The nodes of a compiled template.
+            context (Context): An empty context bound to the template.
+    """
+    for index, node in enumerate(nodelist):
+        if _is_constant(node):
+            text = TextNode(node.render(context))
+            text.origin, text.token = node.origin, node.token
+            nodelist[index] = text
+            continue
+        for child in _nodelists(node):
+            translate_constants(child, context)
+
+
+class TranslatedLoader(cached.Loader):
+    """
+    Cached loader whose templates are compiled for the language active when
+    they are loaded (see the module docstring).
+    """
+
+    def cache_key(self, template_name, skip=None):
+        return f'{super().cache_key(template_name, skip)}:{translation.get_language()}'
+
+    def get_template(self, template_name, skip=None):
+        template = super().get_template(template_name, skip)
+        # Cached copies were translated when they were first loaded
+        if not getattr(template, 'constants_translated', False):
+            context = Context()
+            context.template = template
+            translate_constants(template.nodelist, context)
+            template.constants_translated = True
+        return template
@@ -1,3 +1,1723 @@
-from django.test import TestCase
+import asyncio
+import gc
+import io
+import json
+import re
+import tempfile
+import threading
+import time
+import unittest
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from unittest import mock
+from urllib.parse import parse_qs, urlsplit
 
-# Create your tests here.
+import httpx
+import requests
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.sessions.backends.cache import SessionStore
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import connection, connections, transaction
+from django.http import HttpResponse
+from django.template import Context, Engine, engines
+from django.test import Client, RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone, translation
+
+from . import (
+    analytics, async_spotify, async_views, catalog, cohorts, generation, history, jobs, moods, page_cache, payload, preferences, profiling, rollups,
+    snapshots, spotify, spotify_stub, timing, token_store,
+)
+from .management.commands import benchmark_moods, benchmark_templates
+from .models import ListeningRollup, PlayEvent, SpotifyToken, SpotifyWrap, Track, UserPreference, WrapJob
+from . import views
+from .views import create_wrap, wrap_listing
+
+CSRF_INPUT = re.compile(r'name="csrfmiddlewaretoken" value="([^"]+)"')
+
+
+class ShareTokenTests(TestCase):
+    """
+    Tests for share token generation and share-link lookups.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user('listener', password='password')
+
+    def test_tokens_are_generated_and_unique(self):
+        wraps = [SpotifyWrap.objects.create(user=self.user, time_frame='short_term', data={}) for _ in range(20)]
+        tokens = {wrap.share_token for wrap in wraps}
+        self.assertEqual(len(tokens), 20)
+        self.assertTrue(all(len(token) == 12 for token in tokens))
+
+    def test_generation_skips_taken_tokens(self):
+        SpotifyWrap.objects.create(user=self.user, time_frame='short_term', data={}, share_token='taken-token1')
+        with mock.patch('wrapped.models.secrets.token_urlsafe', side_effect=['taken-token1', 'fresh-token1']):
+            self.assertEqual(SpotifyWrap.generate_share_token(), 'fresh-token1')
+
+    def test_malformed_token_is_rejected_without_a_query(self):
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('share_wrap', args=['not a token!']))
+        self.assertEqual(response.status_code, 404)
+
+
+class PageCacheTests(TestCase):
+    """
+    Saved wrap pages served from the rendered-page cache.
+    """
+
+    def setUp(self):
+        caches['default'].clear()
+        owner = User.objects.create_user('owner')
+        self.wrap = SpotifyWrap.objects.create(user=owner, time_frame='short_term', data={
+            'wrap_name': 'Top Tracks', 'time_frame': 'short_term', 'top_tracks': [], 'top_artists': [],
+        })
+        self.url = reverse('share_wrap', args=[self.wrap.share_token])
+
+    def csrf_token(self, response):
+        return CSRF_INPUT.search(response.content.decode()).group(1)
+
+    def test_hits_are_served_without_rendering(self):
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+        with mock.patch('wrapped.views.render_wrap_detail') as render_wrap_detail:
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        render_wrap_detail.assert_not_called()
+        self.assertContains(response, 'Top Tracks')
+
+    def test_every_visitor_gets_their_own_csrf_token(self):
+        first = self.client.get(self.url)
+        other = self.client_class(enforce_csrf_checks=True)
+        second = other.get(self.url)
+
+        self.assertNotContains(second, page_cache.CSRF_PLACEHOLDER)
+        self.assertNotEqual(self.csrf_token(first), self.csrf_token(second))
+        # The token put back into the cached page is accepted for the visitor's cookie
+        response = other.post(reverse('settings'), {'csrfmiddlewaretoken': self.csrf_token(second)})
+        self.assertNotEqual(response.status_code, 403)
+
+    def test_revalidation_returns_304(self):
+        response = self.client.get(self.url)
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH='"stale"').status_code, 200)
+
+    def test_deleted_wraps_are_not_served(self):
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+        self.wrap.delete()
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+    def test_deleted_wraps_are_not_served_from_another_workers_cache(self):
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+        # Deleted by a worker whose invalidation only reached its own cache
+        with mock.patch('wrapped.signals.page_cache.invalidate_wrap_pages'):
+            self.wrap.delete()
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+
+def catalog_track(track_id, album_id, artist_id, image='https://i.scdn.co/album.jpg'):
+    return {
+        'id': track_id, 'name': f'Track {track_id}', 'duration_ms': 200000,
+        'artists': [{'id': artist_id, 'name': f'Artist {artist_id}'}],
+        'album': {'id': album_id, 'name': f'Album {album_id}', 'images': [{'url': image}]},
+    }
+
+
+def catalog_artist(artist_id, genres=('pop',), followers=100, image='https://i.scdn.co/artist.jpg'):
+    return {
+        'id': artist_id, 'name': f'Artist {artist_id}', 'genres': list(genres),
+        'followers': {'total': followers}, 'images': [{'url': image}],
+    }
+
+
+def visible_track(track):
+    # The fields the wrap templates read
+    return (track['name'], track['artists'][0]['name'], track['album']['name'], track['album']['images'][0]['url'])
+
+
+class CatalogTests(TestCase):
+    """
+    Saved wraps whose top tracks and artists live in the shared catalog.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user('listener')
+
+    def saved(self, tracks, artists):
+        wrap = create_wrap(self.user, {
+            'wrap_name': 'Top Tracks', 'time_frame': 'short_term', 'top_tracks': tracks, 'top_artists': artists,
+        })
+        self.assertFalse(SpotifyWrap.objects.get(pk=wrap.pk).data.get('top_tracks'))
+        return catalog.hydrate_wraps([SpotifyWrap.objects.get(pk=wrap.pk)])[0]
+
+    def test_hydrated_wrap_matches_what_was_saved(self):
+        with spotify_stub.stub_spotify(5):
+            sources = spotify.SpotifyClient('access-1').fetch_wrap_sources('medium_term')
+        _, data = generation.build_wrap_from_sources(sources, 'medium_term', 'dark', 'en')
+        with override_settings(WRAP_CATALOG_ENABLED=False):
+            plain = SpotifyWrap.objects.get(pk=create_wrap(self.user, data).pk)
+        hydrated = catalog.hydrate_wraps([SpotifyWrap.objects.get(pk=create_wrap(self.user, data).pk)])[0]
+
+        self.assertEqual([visible_track(track) for track in hydrated.data['top_tracks']],
+                         [visible_track(track) for track in plain.data['top_tracks']])
+        self.assertEqual(hydrated.data['top_artists'], plain.data['top_artists'])
+        self.assertEqual({key: value for key, value in hydrated.data.items() if key not in catalog.CATALOG_KEYS},
+                         {key: value for key, value in plain.data.items() if key not in catalog.CATALOG_KEYS})
+
+    def test_tracks_sharing_an_album_and_artist(self):
+        tracks = [catalog_track('t2', 'al1', 'ar1'), catalog_track('t1', 'al1', 'ar1')]
+        wrap = self.saved(tracks, [catalog_artist('ar1')])
+        self.assertEqual([track['id'] for track in wrap.data['top_tracks']], ['t2', 't1'])
+        self.assertEqual([visible_track(track) for track in wrap.data['top_tracks']],
+                         [visible_track(track) for track in tracks])
+        self.assertEqual(Track.objects.filter(album_id='al1', artist_id='ar1').count(), 2)
+
+    def test_later_saves_do_not_change_earlier_wraps(self):
+        first = self.saved([catalog_track('t1', 'al1', 'ar1')], [catalog_artist('ar1')])
+        self.saved([catalog_track('t1', 'al1', 'ar1', image='https://i.scdn.co/new-album.jpg')],
+                   [catalog_artist('ar1', genres=['rock'], followers=999, image='https://i.scdn.co/new-artist.jpg')])
+
+        again = catalog.hydrate_wraps([SpotifyWrap.objects.get(pk=first.pk)])[0]
+        self.assertEqual(again.data, first.data)
+        self.assertEqual(again.data['top_artists'], [catalog_artist('ar1')])
+        self.assertEqual(again.data['top_tracks'][0]['album']['images'], [{'url': 'https://i.scdn.co/album.jpg'}])
+
+    def test_upserts_go_in_primary_key_order(self):
+        tracks = [catalog_track(track_id, f'al-{track_id}', f'ar-{track_id}') for track_id in ('t3', 't1', 't2')]
+        with CaptureQueriesContext(connection) as captured:
+            self.saved(tracks, [catalog_artist(f'ar-{track_id}') for track_id in ('t2', 't3', 't1')])
+        upserts = [query['sql'] for query in captured if 'ON CONFLICT' in query['sql'] and 'wrapped_track' in query['sql']]
+        self.assertEqual(len(upserts), 1)
+        positions = [upserts[0].index(f"'{track_id}'") for track_id in ('t1', 't2', 't3')]
+        self.assertEqual(positions, sorted(positions))
+
+
+def spotify_response(status, headers=None, content=b'{}'):
+    response = requests.Response()
+    response.status_code = status
+    response.headers.update(headers or {})
+    response._content = content
+    return response
+
+
+# 200 bodies Spotify could send that are not a page of items
+NOT_PAGES = (b'not json', b'[]', b'{"error": "oops"}', b'{"items": null}')
+
+
+@override_settings(SPOTIFY_MAX_RETRIES=3, SPOTIFY_BACKOFF_BASE=0.5, SPOTIFY_MAX_BACKOFF=10)
+class SpotifySendTests(TestCase):
+    """
+    Retries and connection reuse of `spotify.send`.
+    """
+
+    def send(self, method, *responses):
+        with mock.patch.object(spotify.get_session(), 'request', side_effect=responses) as request, \
+                mock.patch.object(spotify.time, 'sleep') as sleep:
+            response = spotify.send(method, 'https://api.spotify.com/v1/me', '/me')
+        return response, request.call_count, [call.args[0] for call in sleep.call_args_list]
+
+    def test_server_errors_are_retried_with_backoff(self):
+        response, calls, sleeps = self.send('GET', spotify_response(503), spotify_response(502), spotify_response(200))
+        self.assertEqual((response.status_code, calls, sleeps), (200, 3, [0.5, 1.0]))
+
+    def test_retries_stop_after_the_limit(self):
+        response, calls, sleeps = self.send('GET', *[spotify_response(503)] * 5)
+        self.assertEqual((response.status_code, calls), (503, 4))
+
+    def test_retry_after_is_honoured(self):
+        for retry_after, expected in (('2', [2.0]), ('-5', [0.0]), ('soon', [0.5])):
+            with self.subTest(retry_after=retry_after):
+                _, _, sleeps = self.send('GET', spotify_response(429, {'Retry-After': retry_after}),
+                                         spotify_response(200))
+                self.assertEqual(sleeps, expected)
+
+    def test_too_long_a_retry_after_is_returned_to_the_caller(self):
+        with self.assertLogs('wrapped.spotify', 'WARNING'):
+            response, calls, sleeps = self.send('GET', spotify_response(429, {'Retry-After': '60'}))
+        self.assertEqual((response.status_code, calls, sleeps), (429, 1, []))
+
+    def test_posts_are_only_retried_on_429(self):
+        response, calls, _ = self.send('POST', spotify_response(503), spotify_response(200))
+        self.assertEqual((response.status_code, calls), (503, 1))
+        response, calls, _ = self.send('POST', spotify_response(429, {'Retry-After': '1'}), spotify_response(200))
+        self.assertEqual((response.status_code, calls), (200, 2))
+
+    def test_calls_share_one_pooled_session(self):
+        session = spotify.get_session()
+        self.assertIs(spotify.get_session(), session)
+        self.assertEqual(session.get_adapter('https://api.spotify.com')._pool_maxsize, settings.SPOTIFY_FETCH_WORKERS)
+        with mock.patch.object(session, 'request', return_value=spotify_response(200)) as request:
+            spotify.SpotifyClient('access-1').get('/me')
+            spotify.refresh_access_token('refresh-1')
+        self.assertEqual(request.call_count, 2)
+
+
+class SpotifyCacheTests(TestCase):
+    """
+    Keys of the per-user Spotify response cache.
+    """
+
+    def setUp(self):
+        caches['spotify'].clear()
+
+    def test_key_covers_every_param_in_any_order(self):
+        key = spotify.cache_key(1, '/me/top/tracks', {'time_range': 'short_term', 'limit': 20})
+        self.assertEqual(key, spotify.cache_key(1, '/me/top/tracks', {'limit': 20, 'time_range': 'short_term'}))
+        for params in ({'time_range': 'short_term', 'limit': 50}, {'time_range': 'short_term', 'limit': 20, 'offset': 20},
+                       {'time_range': 'long_term', 'limit': 20}):
+            with self.subTest(params=params):
+                self.assertNotEqual(key, spotify.cache_key(1, '/me/top/tracks', params))
+        self.assertNotEqual(key, spotify.cache_key(2, '/me/top/tracks', {'time_range': 'short_term', 'limit': 20}))
+
+    def test_calls_differing_only_in_limit_are_cached_apart(self):
+        client = spotify.SpotifyClient('access-1', cache_user=1)
+
+        def get(path, params=None, extra_headers=None):
+            response = spotify_response(200)
+            response._content = json.dumps({'items': list(range(params['limit']))}).encode()
+            return response
+
+        with mock.patch.object(client, 'get', side_effect=get) as request:
+            for _ in range(2):
+                self.assertEqual(len(client.get_items('/me/top/tracks', {'limit': 5}, cache=True)), 5)
+                self.assertEqual(len(client.get_items('/me/top/tracks', {'limit': 10}, cache=True)), 10)
+        self.assertEqual(request.call_count, 2)
+
+    def test_bodies_that_are_not_pages_fall_back_to_the_cache(self):
+        key = spotify.cache_key(1, '/me/top/tracks', {'limit': 5})
+        client = spotify.SpotifyClient('access-1', cache_user=1)
+        for content in NOT_PAGES:
+            with self.subTest(content=content), \
+                    mock.patch.object(client, 'get', return_value=spotify_response(200, content=content)), \
+                    self.assertLogs('wrapped.spotify', 'WARNING'):
+                caches['spotify'].delete(key)
+                self.assertEqual(client.get_items('/me/top/tracks', {'limit': 5}, cache=True), [])
+                caches['spotify'].set(key, {'items': ['cached'], 'etag': None, 'fetched_at': 0})
+                self.assertEqual(client.get_items('/me/top/tracks', {'limit': 5}, cache=True), ['cached'])
+
+    def test_async_bodies_that_are_not_pages_fall_back_to_the_cache(self):
+        key = spotify.cache_key(1, '/me/top/tracks', {'limit': 5})
+        client = async_spotify.AsyncSpotifyClient('access-1', cache_user=1)
+        get_items = async_to_sync(client.get_items)
+        for content in NOT_PAGES:
+            with self.subTest(content=content), \
+                    mock.patch.object(client, 'get', return_value=httpx.Response(200, content=content)), \
+                    self.assertLogs('wrapped.spotify', 'WARNING'):
+                caches['spotify'].delete(key)
+                self.assertEqual(get_items('/me/top/tracks', {'limit': 5}, cache=True), [])
+                caches['spotify'].set(key, {'items': ['cached'], 'etag': None, 'fetched_at': 0})
+                self.assertEqual(get_items('/me/top/tracks', {'limit': 5}, cache=True), ['cached'])
+
+    def test_top_tracks_of_a_body_that_is_not_a_page_are_none(self):
+        for content in NOT_PAGES:
+            with self.subTest(content=content), self.assertLogs('wrapped.spotify', 'WARNING'):
+                with mock.patch.object(spotify.SpotifyClient, 'get', return_value=spotify_response(200, content=content)):
+                    self.assertIsNone(views.get_user_top_tracks('access-1'))
+                with mock.patch.object(async_spotify.AsyncSpotifyClient, 'get',
+                                       return_value=httpx.Response(200, content=content)):
+                    self.assertIsNone(async_to_sync(async_views.get_user_top_tracks)('access-1'))
+
+
+class FakePages:
+    """
+    Serves `SpotifyClient.get_page` from `total` numbered items, recording the
+    offsets asked for and the most pages in flight at once.
+    """
+
+    def __init__(self, total, send_total=True, last_offset=None, empty_offset=None, delay=0):
+        self.total, self.send_total, self.delay = total, send_total, delay
+        self.last_offset, self.empty_offset = last_offset, empty_offset
+        self.offsets, self.in_flight, self.max_in_flight = [], 0, 0
+        self.lock = threading.Lock()
+
+    def __call__(self, path, params=None, offset=0, limit=50):
+        with self.lock:
+            self.offsets.append(offset)
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        time.sleep(self.delay)
+        with self.lock:
+            self.in_flight -= 1
+        items = [] if offset == self.empty_offset else list(range(offset, min(offset + limit, self.total)))
+        more = offset + limit < self.total and offset != self.last_offset
+        page = {'items': items, 'next': f'?offset={offset + limit}' if more else None}
+        if self.send_total:
+            page['total'] = self.total
+        return page
+
+    def items(self, **kwargs):
+        client = spotify.SpotifyClient('access-1')
+        client.get_page = self
+        return client.iter_items('/me/top/tracks', **kwargs)
+
+
+class IterItemsTests(TestCase):
+    """
+    Paging through `SpotifyClient.iter_items`.
+    """
+
+    def test_stops_at_the_total(self):
+        pages = FakePages(120)
+        self.assertEqual(list(pages.items()), list(range(120)))
+        self.assertEqual(sorted(pages.offsets), [0, 50, 100])
+
+    def test_stops_at_a_null_next(self):
+        pages = FakePages(500, last_offset=50)
+        self.assertEqual(list(pages.items()), list(range(100)))
+        pages = FakePages(500, send_total=False, last_offset=50)
+        self.assertEqual(list(pages.items()), list(range(100)))
+        self.assertEqual(pages.offsets, [0, 50])
+
+    def test_stops_at_an_empty_page(self):
+        for send_total in (True, False):
+            with self.subTest(send_total=send_total):
+                pages = FakePages(200, send_total=send_total, empty_offset=50)
+                self.assertEqual(list(pages.items()), list(range(50)))
+
+    def test_caps_the_pages_in_flight(self):
+        pages = FakePages(50 * 20, delay=0.01)
+        with override_settings(SPOTIFY_PAGES_IN_FLIGHT=3):
+            self.assertEqual(list(pages.items()), list(range(50 * 20)))
+        self.assertLessEqual(pages.max_in_flight, 3)
+
+    def test_closing_early_skips_the_remaining_pages(self):
+        pages = FakePages(50 * 20, delay=0.01)
+        with override_settings(SPOTIFY_PAGES_IN_FLIGHT=3):
+            items = pages.items()
+            self.assertEqual([next(items) for _ in range(60)], list(range(60)))
+            items.close()
+        time.sleep(0.05)
+        # The first page, the one being read and at most three ahead of it
+        self.assertLessEqual(len(pages.offsets), 5)
+
+
+class FanOutTests(TestCase):
+    """
+    `SpotifyClient.fetch_wrap_sources` against a stub where every endpoint
+    takes `delays[path]` seconds, `failing` paths raise a connection error and
+    `late` paths only answer once the test is over.
+    """
+
+    def setUp(self):
+        self.released = threading.Event()
+        self.addCleanup(self.released.set)
+
+    def fetch(self, delays=None, failing=(), late=()):
+        def get(path, params=None, extra_headers=None):
+            if path in failing:
+                raise requests.ConnectionError('connection reset')
+            if path in late:
+                self.released.wait(5)
+            time.sleep((delays or {}).get(path, 0))
+            response = spotify_response(200)
+            response._content = json.dumps(spotify_stub.response_body(path, params)).encode()
+            return response
+
+        client = spotify.SpotifyClient('access-1')
+        with mock.patch.object(client, 'get', side_effect=get):
+            started = time.perf_counter()
+            sources = client.fetch_wrap_sources('medium_term')
+        return sources, time.perf_counter() - started
+
+    def expected(self, name):
+        path, params, _ = spotify.wrap_source_requests('medium_term')[name]
+        return spotify_stub.response_body(path, params)['items']
+
+    def test_calls_run_concurrently_and_a_failure_degrades_to_empty(self):
+        delays = {'/me/top/tracks': 0.3, '/me/top/artists': 0.2, '/me/playlists': 0.2}
+        with self.assertLogs('wrapped.spotify', 'WARNING'):
+            sources, elapsed = self.fetch(delays, failing={'/me/player/recently-played'})
+        # Close to the slowest call (0.3s), well under the 0.7s they add up to
+        self.assertLess(elapsed, 0.5)
+        self.assertEqual(sources['recently_played'], [])
+        for name in ('top_tracks', 'top_artists', 'playlists'):
+            self.assertEqual(sources[name], self.expected(name))
+            self.assertTrue(sources[name])
+
+    @override_settings(SPOTIFY_FANOUT_DEADLINE=0.3)
+    def test_a_call_missing_the_deadline_degrades_to_empty(self):
+        delays = {'/me/top/tracks': 0.1, '/me/top/artists': 0.1}
+        with self.assertLogs('wrapped.spotify', 'WARNING') as logs:
+            sources, elapsed = self.fetch(delays, late={'/me/playlists'})
+        self.assertLess(elapsed, 0.5)
+        self.assertIn('missed the 0.3s deadline', logs.output[0])
+        self.assertEqual(sources['playlists'], [])
+        for name in ('top_tracks', 'top_artists', 'recently_played'):
+            self.assertEqual(sources[name], self.expected(name))
+
+
+class MoodTests(unittest.TestCase):
+    """
+    The batched mood classifier against the per-keyword scan it replaced.
+    """
+
+    EDGE_CASES = [
+        {'name': 'İstanbul Nights', 'artists': [{'name': 'DJ Energie'}]},  # lower() lengthens "İ"
+        {'name': 'Pum', 'artists': [{'name': 'p Crew'}]},  # "pump" only across the name boundary
+        {'name': 'HEARTBEATS', 'artists': [{'name': 'Someone'}]},
+        {'name': 'Canción de Calma', 'artists': [{'name': 'Los Fuertes'}]},
+        {'name': 'Klavier im Schlaf', 'artists': [{'name': 'Estudio Concentración'}]},
+        {'name': 'Nothing here', 'artists': [{'name': 'Nobody'}]},
+        {'artists': [{}]},
+    ]
+
+    def test_batches_match_the_keyword_scan(self):
+        tracks = benchmark_moods.sample_tracks(2000, seed=7) + self.EDGE_CASES
+        for language in ('en', 'de', 'es'):
+            with self.subTest(language=language):
+                expected = benchmark_moods.keyword_scan(tracks, language)
+                self.assertEqual(moods.classify_many(tracks, language), expected)
+                self.assertEqual([moods.classify(track, language) for track in self.EDGE_CASES], expected[-7:])
+                self.assertGreater(len(set(expected)), 3)
+
+
+def listened_track(track_id, art='1'):
+    return {'id': track_id, 'name': f'Track {track_id}', 'duration_ms': 180000, 'album': {
+        'name': f'Album {track_id}', 'artists': [{'name': 'Artist'}],
+        'images': [{'url': f'https://img/{track_id}{art}-640'}, {'url': f'https://img/{track_id}{art}-300'}],
+    }}
+
+
+def listened_play(track_id, played_at, art='1'):
+    return {'track': listened_track(track_id, art), 'played_at': played_at}
+
+
+class AnalyticsTests(unittest.TestCase):
+    """
+    `analytics.compute_wrap_metrics` on a fixture, pinned to the values the
+    helpers nested in `generate_wrap` computed before it replaced them.
+    """
+
+    ARTISTS = [
+        {'genres': ['pop', 'dance pop']},
+        {'genres': ['rock', 'pop']},
+        {'genres': []},
+        {'name': 'No genres'},
+        {'genres': ['indie', 'rock', 'jazz', 'folk']},
+        {'genres': ['soul', 'pop']},
+    ]
+    # Most recent first; streaks of a (2, then 1 more later), c (3) and b (1, then 2),
+    # with a later play of a track carrying different artwork than its first one
+    PLAYS = [
+        listened_play('a', '2024-11-26T22:00:00.000Z'),
+        listened_play('a', '2024-11-26T21:59:59.999Z', art='2'),
+        listened_play('b', '2024-11-26T17:00:00.000Z'),
+        listened_play('a', '2024-11-26T16:59:59.500Z', art='3'),
+        listened_play('c', '2024-11-26T12:00:00.000Z'),
+        listened_play('c', '2024-11-26T11:59:00.000Z'),
+        listened_play('c', '2024-11-26T05:00:00.000Z'),
+        listened_play('d', '2024-11-26T04:59:59.000Z'),
+        listened_play('b', '2024-11-26T00:00:00.000Z', art='2'),
+        listened_play('b', '2024-11-25T23:59:00.000Z'),
+        listened_play('e', '2024-11-25T09:30:00.000Z'),
+    ]
+    TRACKS = [listened_track(track_id) for track_id in 'abcde']
+
+    def metrics(self, **kwargs):
+        return analytics.compute_wrap_metrics(self.TRACKS, self.ARTISTS, self.PLAYS, **kwargs)
+
+    def test_genres(self):
+        metrics = self.metrics()
+        # Ties keep the order genres were first seen in
+        self.assertEqual(metrics['favorite_genres'], ['pop', 'rock', 'dance pop', 'indie', 'jazz'])
+        self.assertEqual(list(metrics['genre_breakdown'].items()),
+                         [('pop', 3), ('rock', 2), ('dance pop', 1), ('indie', 1), ('jazz', 1)])
+        self.assertEqual(metrics['total_genres_played'], 10)
+
+    def test_time_of_day_buckets(self):
+        self.assertEqual(self.metrics()['listening_patterns'], {
+            'time_of_day': {'morning': 27.27, 'afternoon': 18.18, 'evening': 18.18, 'night': 36.36},
+        })
+        self.assertEqual(analytics.compute_wrap_metrics([], [], [])['listening_patterns'], {
+            'time_of_day': {'morning': 0, 'afternoon': 0, 'evening': 0, 'night': 0},
+        })
+
+    def test_longest_streaks_keep_the_first_play_of_each_track(self):
+        self.assertEqual(self.metrics()['longest_streaks'], [
+            {'name': 'Track c', 'streak': 3, 'album_art_url': 'https://img/c1-300'},
+            {'name': 'Track a', 'streak': 2, 'album_art_url': 'https://img/a1-300'},
+            {'name': 'Track b', 'streak': 2, 'album_art_url': 'https://img/b1-300'},
+        ])
+        self.assertEqual(analytics.compute_wrap_metrics([], [], [])['longest_streaks'], [])
+
+    def test_track_totals_and_albums(self):
+        metrics = self.metrics()
+        self.assertEqual((metrics['total_songs_played'], metrics['total_duration_minutes']), (5, 15.0))
+        self.assertEqual(metrics['top_albums'], [
+            {'name': f'Album {track_id}', 'artist': 'Artist', 'image_url': f'https://img/{track_id}1-640'}
+            for track_id in 'abc'
+        ])
+
+    def test_streamed_inputs_give_the_same_metrics(self):
+        streamed = analytics.compute_wrap_metrics(iter(self.TRACKS), iter(self.ARTISTS), iter(self.PLAYS))
+        self.assertEqual(streamed, self.metrics())
+
+
+class SnapshotTests(TestCase):
+    """
+    Wraps staged when they are rendered and taken back when they are saved.
+    """
+
+    def setUp(self):
+        caches['default'].clear()
+        caches['spotify'].clear()
+
+    def test_take_returns_the_staged_wrap_once(self):
+        snapshot_id = snapshots.stage_wrap(1, {'time_frame': 'short_term'})
+        self.assertIsNone(snapshots.take_wrap(2, snapshot_id))
+        self.assertEqual(snapshots.take_wrap(1, snapshot_id), {'time_frame': 'short_term'})
+        self.assertIsNone(snapshots.take_wrap(1, snapshot_id))
+        self.assertIsNone(snapshots.take_wrap(1, ''))
+
+    def test_expired_snapshots_are_gone(self):
+        snapshot_id = snapshots.stage_wrap(1, {'time_frame': 'short_term'})
+        with mock.patch('time.time', return_value=time.time() + settings.WRAP_SNAPSHOT_TTL + 1):
+            self.assertIsNone(snapshots.take_wrap(1, snapshot_id))
+
+    def test_a_take_that_loses_the_delete_gets_nothing(self):
+        snapshot_id = snapshots.stage_wrap(1, {'time_frame': 'short_term'})
+        # Another request deleted the entry between this one's get and delete
+        with mock.patch.object(snapshots.cache, 'delete', return_value=False):
+            self.assertIsNone(snapshots.take_wrap(1, snapshot_id))
+
+    def test_save_uses_the_snapshot_or_recomputes_the_wrap(self):
+        user = User.objects.create_user('listener')
+        token_store.save_tokens(user, {'access_token': 'access-1', 'refresh_token': 'refresh-1', 'expires_in': 3600})
+        self.client.force_login(user)
+        with spotify_stub.stub_spotify(5):
+            response = self.client.post(reverse('generate-wrap'), {'time_frame': 'medium_term'})
+        snapshot_id = response.context['snapshot_id']
+
+        with spotify_stub.stub_spotify(5) as stub:
+            self.client.post(reverse('generate-wrap'), {'save_wrap': '1', 'snapshot_id': snapshot_id})
+        self.assertEqual(len(stub.requests), 0)
+
+        caches['spotify'].clear()
+        with spotify_stub.stub_spotify(5) as stub:
+            response = self.client.post(reverse('generate-wrap'),
+                                        {'time_frame': 'medium_term', 'save_wrap': '1', 'snapshot_id': snapshot_id})
+        self.assertRedirects(response, reverse('dashboard'), fetch_redirect_response=False)
+        self.assertEqual(len(stub.requests), 4)
+        self.assertEqual(SpotifyWrap.objects.filter(user=user).count(), 2)
+
+
+class PreferenceTests(TestCase):
+    """
+    View mode and language, from the signed cookie or the user's record.
+    """
+
+    def setUp(self):
+        caches['default'].clear()
+        self.user = User.objects.create_user('listener')
+
+    def page_preferences(self, client=None):
+        response = (client or self.client).get(reverse('settings'))
+        return re.search(r'<html lang="(\w+)" class="(\w+)">', response.content.decode()).group(2, 1)
+
+    def test_a_tampered_cookie_falls_back_to_the_defaults(self):
+        self.client.post(reverse('settings'), {'view_mode': 'light', 'language': 'de'})
+        self.assertEqual(self.page_preferences(), ('light', 'de'))
+
+        signed = self.client.cookies[preferences.COOKIE_NAME].value
+        self.client.cookies[preferences.COOKIE_NAME] = signed.replace('light:de', 'high_contrast:es')
+        self.assertEqual(self.page_preferences(), ('dark', 'en'))
+        self.client.cookies[preferences.COOKIE_NAME] = 'light:de'
+        self.assertEqual(self.page_preferences(), ('dark', 'en'))
+
+    def test_update_persists_for_the_user(self):
+        self.client.force_login(self.user)
+        self.client.post(reverse('settings'), {'view_mode': 'light', 'language': 'es'})
+        record = UserPreference.objects.get(user=self.user)
+        self.assertEqual((record.view_mode, record.language), ('light', 'es'))
+
+        # A new browser has no cookie yet and gets the user's record
+        browser = Client()
+        browser.force_login(self.user)
+        self.assertEqual(self.page_preferences(browser), ('light', 'es'))
+        self.assertIn(preferences.COOKIE_NAME, browser.cookies)
+
+    def test_update_replaces_the_cached_record(self):
+        self.assertIsNone(preferences.stored_preferences(self.user))
+        with self.assertNumQueries(0):
+            self.assertIsNone(preferences.stored_preferences(self.user))
+
+        self.client.force_login(self.user)
+        self.client.post(reverse('settings'), {'view_mode': 'high_contrast', 'language': 'de'})
+        with self.assertNumQueries(0):
+            self.assertEqual(preferences.stored_preferences(self.user), ('high_contrast', 'de'))
+
+
+class TranslatedTemplateTests(TestCase):
+    """
+    Pages rendered in the user's language, with fixed strings translated when
+    the template is loaded.
+    """
+
+    def test_pretranslated_pages_match_plain_rendering(self):
+        request = RequestFactory().get('/')
+        request.user = User(username='listener')
+        contexts = benchmark_templates.Command().page_contexts(request)
+        engine = engines['django'].engine
+        plain = Engine(dirs=engine.dirs, libraries=engine.libraries, loaders=[
+            ('django.template.loaders.cached.Loader', ['django.template.loaders.filesystem.Loader']),
+        ])
+        pages = list(benchmark_templates.PAGES) + ['error', 'delete_account', 'wrap_pending']
+        contexts.update(error={'message': 'Spotify login failed.'}, delete_account={},
+                        wrap_pending={'job': WrapJob(id=1), 'view_mode': 'dark'})
+
+        for language in ('en', 'de', 'es'):
+            with translation.override(language):
+                for page in pages:
+                    with self.subTest(language=language, page=page):
+                        expected = plain.get_template(f'{page}.html').render(Context(contexts[page]))
+                        self.assertEqual(engine.get_template(f'{page}.html').render(Context(contexts[page])),
+                                         expected)
+
+    def test_templates_are_compiled_per_language(self):
+        engine = engines['django'].engine
+        with translation.override('de'):
+            german = engine.get_template('error.html')
+        with translation.override('es'):
+            spanish = engine.get_template('error.html')
+        self.assertIsNot(german, spanish)
+        self.assertIn('Hoppla!', german.render(Context({})))
+        self.assertIn('¡Ups!', spanish.render(Context({})))
+
+    def test_error_and_delete_account_pages_are_localized(self):
+        self.client.force_login(User.objects.create_user('listener'))
+        self.client.post(reverse('settings'), {'language': 'de'})
+
+        self.assertContains(self.client.get(reverse('delete_account')), 'Lösche Dein Konto')
+        with mock.patch.object(spotify, 'exchange_code', return_value=None):
+            response = self.client.get(reverse('callback'), {'code': 'expired'})
+        self.assertContains(response, 'Die Spotify-Anmeldung ist fehlgeschlagen.')
+        self.assertContains(response, '<html lang="de">')
+
+
+class PayloadTests(TestCase):
+    """
+    Saved wrap data: projected, optionally compressed, and decoded on load.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user('listener')
+        with spotify_stub.stub_spotify(5):
+            sources = spotify.SpotifyClient('access-1').fetch_wrap_sources('medium_term')
+        # Full Spotify objects, as wraps were stored before they were projected
+        self.legacy = generation.build_wrap_from_sources(sources, 'medium_term', 'dark', 'en')[1]
+
+    def legacy_wrap(self):
+        with override_settings(WRAP_CATALOG_ENABLED=False):
+            wrap = create_wrap(self.user, {'time_frame': 'medium_term'})
+        SpotifyWrap.objects.filter(pk=wrap.pk).update(data=self.legacy, packed=None)
+        return wrap.pk
+
+    def stored(self, wrap_id):
+        return SpotifyWrap.objects.filter(pk=wrap_id).values_list('data', 'packed').get()
+
+    @override_settings(WRAP_CATALOG_ENABLED=False, WRAP_PAYLOAD_COMPRESSION=True)
+    def test_legacy_data_round_trip(self):
+        wrap_id = self.legacy_wrap()
+        wrap = SpotifyWrap.objects.get(pk=wrap_id)
+        self.assertEqual(wrap.data, self.legacy)
+
+        wrap.save()
+        data, packed = self.stored(wrap_id)
+        self.assertTrue(packed)
+        self.assertFalse(set(payload.PACKED_KEYS) & set(data))
+
+        projected = payload.project_wrap_data(self.legacy)
+        self.assertEqual(SpotifyWrap.objects.get(pk=wrap_id).data, projected)
+        self.assertNotIn('available_markets', json.dumps(projected))
+        self.assertEqual(projected['top_tracks'][0]['album']['images'],
+                         self.legacy['top_tracks'][0]['album']['images'][:1])
+
+    def test_repack_wraps_is_idempotent(self):
+        for options in (['--compress', '--no-catalog'], ['--no-compress', '--catalog'], ['--compress', '--catalog']):
+            with self.subTest(options=options):
+                wrap_id = self.legacy_wrap()
+                call_command('repack_wraps', *options, stdout=io.StringIO())
+                first = self.stored(wrap_id)
+                data = catalog.hydrate_wraps([SpotifyWrap.objects.get(pk=wrap_id)])[0].data
+
+                out = io.StringIO()
+                call_command('repack_wraps', *options, stdout=out)
+                self.assertIn('across 0 of', out.getvalue())
+                self.assertEqual(self.stored(wrap_id), first)
+                self.assertEqual(catalog.hydrate_wraps([SpotifyWrap.objects.get(pk=wrap_id)])[0].data, data)
+                SpotifyWrap.objects.all().delete()
+
+
+@override_settings(WRAP_JOBS_ENABLED=True)
+class WrapJobTests(TestCase):
+    """
+    Wraps generated by `run_wrap_worker` from the `WrapJob` queue.
+    """
+
+    def setUp(self):
+        caches['spotify'].clear()
+        self.user = User.objects.create_user('listener')
+        token_store.save_tokens(self.user, {'access_token': 'access-1', 'refresh_token': 'refresh-1', 'expires_in': 3600})
+        self.client.force_login(self.user)
+
+    def run_worker(self, *args):
+        # The test's transaction has to outlive the worker's per-job connection cleanup
+        with spotify_stub.stub_spotify(5), \
+                mock.patch('wrapped.management.commands.run_wrap_worker.close_old_connections'):
+            call_command('run_wrap_worker', '--burst', *args, stdout=io.StringIO())
+
+    def test_generate_wrap_queues_a_job(self):
+        response = self.client.post(reverse('generate-wrap'), {'time_frame': 'medium_term'})
+
+        self.assertTemplateUsed(response, 'wrap_pending.html')
+        job = WrapJob.objects.get()
+        self.assertEqual((job.status, job.time_frame, job.save_on_completion), ('pending', 'medium_term', False))
+        self.assertNotIn('access-1', job.access_token)
+        self.assertEqual(token_store.decrypt(job.access_token), 'access-1')
+
+    def test_pending_page_is_localized(self):
+        self.client.post(reverse('settings'), {'language': 'de'})
+        response = self.client.post(reverse('generate-wrap'), {'time_frame': 'medium_term'})
+        self.assertContains(response, 'Dein Spotify Wrapped wird erstellt...')
+        self.assertContains(response, '<html lang="de">')
+
+    def test_jobs_are_claimed_once_in_order(self):
+        first = jobs.enqueue_wrap_job(self.user, 'access-1', 'short_term', 'dark', 'en')
+        second = jobs.enqueue_wrap_job(self.user, 'access-1', 'long_term', 'dark', 'en')
+
+        self.assertEqual(jobs.claim_next_job().id, first.id)
+        self.assertEqual(jobs.claim_next_job().id, second.id)
+        self.assertIsNone(jobs.claim_next_job())
+        self.assertEqual(set(WrapJob.objects.values_list('status', flat=True)), {'running'})
+
+    def test_run_job_reports_progress(self):
+        job = jobs.enqueue_wrap_job(self.user, 'access-1', 'medium_term', 'dark', 'en')
+        seen = []
+        build_wrap = generation.build_wrap
+
+        def recording_build_wrap(*args, progress, **kwargs):
+            def report(value):
+                progress(value)
+                seen.append(WrapJob.objects.get(id=job.id).progress)
+            return build_wrap(*args, progress=report, **kwargs)
+
+        with spotify_stub.stub_spotify(5), mock.patch.object(jobs.generation, 'build_wrap', recording_build_wrap):
+            job = jobs.run_job(jobs.claim_next_job())
+
+        self.assertTrue(seen)
+        self.assertEqual(seen, sorted(seen))
+        self.assertEqual((job.status, job.progress, job.access_token), ('done', 100, ''))
+        self.assertEqual(job.result['data']['time_frame'], 'medium_term')
+
+    def test_job_without_a_token_fails(self):
+        job = jobs.enqueue_wrap_job(self.user, '', 'medium_term', 'dark', 'en')
+        with self.assertLogs('wrapped.jobs', 'ERROR'):
+            job = jobs.run_job(jobs.claim_next_job())
+        self.assertEqual((job.status, job.error), ('failed', 'Spotify access token is missing.'))
+
+    def test_status_polling(self):
+        self.client.post(reverse('generate-wrap'), {'time_frame': 'medium_term'})
+        job = WrapJob.objects.get()
+        status_url = reverse('wrap-job-status', args=[job.id])
+
+        self.assertEqual(self.client.get(status_url).json(),
+                         {'job_id': job.id, 'status': 'pending', 'progress': 0, 'error': None})
+        self.run_worker()
+        payload = self.client.get(status_url).json()
+        self.assertEqual((payload['status'], payload['progress']), ('done', 100))
+        self.assertEqual(payload['result_url'], reverse('wrap-job-result', args=[job.id]))
+        self.assertContains(self.client.get(payload['result_url']), 'snapshot_id')
+
+        self.client.force_login(User.objects.create_user('someone-else'))
+        self.assertEqual(self.client.get(status_url).status_code, 404)
+
+    def test_save_with_an_expired_snapshot_saves_on_completion(self):
+        self.client.post(reverse('generate-wrap'),
+                         {'time_frame': 'medium_term', 'save_wrap': '1', 'snapshot_id': 'expired'})
+        job = WrapJob.objects.get()
+        self.assertTrue(job.save_on_completion)
+        self.assertFalse(SpotifyWrap.objects.exists())
+
+        self.run_worker()
+        wrap = SpotifyWrap.objects.get(user=self.user)
+        self.assertEqual(wrap.time_frame, 'medium_term')
+        payload = self.client.get(reverse('wrap-job-status', args=[job.id])).json()
+        self.assertEqual(payload['result_url'], reverse('dashboard'))
+
+    def test_a_requeued_run_does_not_overwrite_the_newer_one(self):
+        job = jobs.enqueue_wrap_job(self.user, 'access-1', 'medium_term', 'dark', 'en', save=True)
+        build_wrap = generation.build_wrap
+
+        def slow_build_wrap(*args, **kwargs):
+            # Requeued as stale, then claimed by another worker, while this run is still going
+            jobs.requeue_stale_jobs(timedelta(0))
+            WrapJob.objects.filter(id=job.id).update(status='running', started_at=timezone.now() + timedelta(seconds=1))
+            return build_wrap(*args, **kwargs)
+
+        with spotify_stub.stub_spotify(5), mock.patch.object(jobs.generation, 'build_wrap', slow_build_wrap), \
+                self.assertLogs('wrapped.jobs', 'WARNING'):
+            stale_run = jobs.run_job(jobs.claim_next_job())
+
+        self.assertEqual((stale_run.status, stale_run.result), ('running', None))
+        self.assertEqual(token_store.decrypt(stale_run.access_token), 'access-1')
+        self.assertFalse(SpotifyWrap.objects.exists())
+
+        with spotify_stub.stub_spotify(5):
+            newer_run = jobs.run_job(WrapJob.objects.select_related('user').get(id=job.id))
+        self.assertEqual(newer_run.status, 'done')
+        self.assertEqual(SpotifyWrap.objects.filter(user=self.user).count(), 1)
+
+    def test_worker_requeues_stale_jobs_while_running(self):
+        stale = jobs.enqueue_wrap_job(self.user, 'access-1', 'medium_term', 'dark', 'en')
+        WrapJob.objects.filter(id=stale.id).update(status='running', started_at=timezone.now() - timedelta(hours=1))
+        jobs.enqueue_wrap_job(self.user, 'access-1', 'short_term', 'dark', 'en')
+
+        with mock.patch.object(jobs, 'requeue_stale_jobs', wraps=jobs.requeue_stale_jobs) as requeue:
+            self.run_worker('--requeue-interval', '0')
+
+        # Before each of the two jobs and before finding the queue empty
+        self.assertEqual(requeue.call_count, 3)
+        self.assertEqual(set(WrapJob.objects.values_list('status', flat=True)), {'done'})
+
+
+class CohortReportTests(TestCase):
+    """
+    Cohort aggregates of `cohorts.build_cohort_report` on a handful of wraps.
+    """
+
+    EXPECTED = [
+        {'cohort': '2024-01', 'time_frame': 'long_term', 'wraps': 1, 'total_duration_minutes': 30.0,
+         'mean_duration_minutes': 30.0, 'time_of_day': {'morning': 0.0, 'afternoon': 0.0, 'evening': 0.0, 'night': 100.0},
+         'top_genres': {}},
+        {'cohort': '2024-01', 'time_frame': 'short_term', 'wraps': 2, 'total_duration_minutes': 150.5,
+         'mean_duration_minutes': 75.25, 'time_of_day': {'morning': 50.0, 'afternoon': 50.0, 'evening': 0.0, 'night': 0.0},
+         'top_genres': {'rock': 4, 'pop': 3}},
+        {'cohort': '2024-02', 'time_frame': 'short_term', 'wraps': 2, 'total_duration_minutes': 40.0,
+         'mean_duration_minutes': 20.0, 'time_of_day': {'morning': 0.0, 'afternoon': 10.0, 'evening': 40.0, 'night': 50.0},
+         'top_genres': {'pop': 2}},
+    ]
+
+    def setUp(self):
+        january = User.objects.create(username='january', date_joined=timezone.make_aware(datetime(2024, 1, 15, 12)))
+        late_january = User.objects.create(username='late-january',
+                                           date_joined=timezone.make_aware(datetime(2024, 1, 20, 12)))
+        february = User.objects.create(username='february', date_joined=timezone.make_aware(datetime(2024, 2, 14, 12)))
+        wraps = [
+            (january, 'short_term', 100.5, {'morning': 50, 'afternoon': 50}, {'pop': 3, 'rock': 1}),
+            # Wraps without listening patterns do not count towards the time-of-day means
+            (late_january, 'short_term', 50, None, {'rock': 3, 'jazz': 1}),
+            (january, 'long_term', 30, {'night': 100}, {}),
+            (february, 'short_term', 20, {'evening': 40, 'night': 60}, {'pop': 1}),
+            (february, 'short_term', 20, {'afternoon': 20, 'evening': 40, 'night': 40}, {'pop': 1}),
+        ]
+        for user, time_frame, duration, time_of_day, genres in wraps:
+            data = {'total_duration_minutes': duration, 'genre_breakdown': genres}
+            if time_of_day is not None:
+                data['listening_patterns'] = {'time_of_day': time_of_day}
+            SpotifyWrap.objects.create(user=user, time_frame=time_frame, data=data)
+
+    def test_groups_by_signup_month_and_time_frame(self):
+        report, _ = cohorts.build_cohort_report()
+        self.assertEqual(report.rows, 5)
+        self.assertEqual(report.summary(top_genres=2), self.EXPECTED)
+
+    def test_chunk_size_does_not_change_the_report(self):
+        report, _ = cohorts.build_cohort_report(chunk_size=1)
+        self.assertEqual(report.summary(top_genres=2), self.EXPECTED)
+
+    def test_command_filters_by_time_frame(self):
+        out = io.StringIO()
+        call_command('cohort_report', '--time-frame', 'short_term', '--top-genres', '2', '--json', stdout=out)
+        result = json.loads(out.getvalue())
+        self.assertEqual(result['rows'], 4)
+        self.assertEqual(result['groups'], [group for group in self.EXPECTED if group['time_frame'] == 'short_term'])
+
+
+class DashboardPagingTests(TestCase):
+    """
+    Keyset pagination of the dashboard (`views.paginate_wraps`), with wraps
+    sharing a `created_at` on both sides of page boundaries.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user('listener')
+        other = User.objects.create_user('other')
+        base = timezone.now().replace(microsecond=0)
+        # Three timestamps, most of them shared by several wraps
+        for created_at in [base] * 3 + [base - timedelta(minutes=1)] * 4 + [base - timedelta(hours=1)]:
+            for owner in (self.user, other):
+                wrap = SpotifyWrap.objects.create(user=owner, time_frame='short_term', data={})
+                SpotifyWrap.objects.filter(pk=wrap.pk).update(created_at=created_at)
+        self.expected = list(SpotifyWrap.objects.filter(user=self.user).order_by('-created_at', '-id')
+                             .values_list('id', flat=True))
+
+    def walk(self, cursor=None):
+        ids, pages = [], 0
+        while True:
+            page, cursor = views.paginate_wraps(self.user, cursor)
+            ids.extend(wrap.id for wrap in page)
+            pages += 1
+            if cursor is None:
+                return ids, pages
+
+    def test_pages_cover_every_wrap_once_in_order(self):
+        for page_size in (1, 2, 3, 4, 7, 8, 20):
+            with self.subTest(page_size=page_size), override_settings(DASHBOARD_PAGE_SIZE=page_size):
+                ids, pages = self.walk()
+                self.assertEqual(ids, self.expected)
+                self.assertEqual(pages, max(1, -(-len(self.expected) // page_size)))
+
+    @override_settings(DASHBOARD_PAGE_SIZE=3)
+    def test_new_wraps_do_not_shift_later_pages(self):
+        first, cursor = views.paginate_wraps(self.user)
+        SpotifyWrap.objects.create(user=self.user, time_frame='short_term', data={})
+        ids, _ = self.walk(cursor)
+        self.assertEqual([wrap.id for wrap in first] + ids, self.expected)
+
+    def test_malformed_cursor_starts_over(self):
+        for cursor in ('garbage', 'not-a-date_3', '2024-01-01T00:00:00_x'):
+            with self.subTest(cursor=cursor):
+                page, _ = views.paginate_wraps(self.user, cursor)
+                self.assertEqual(page[0].id, self.expected[0])
+
+    @override_settings(DASHBOARD_PAGE_SIZE=3)
+    def test_dashboard_links_follow_the_cursor(self):
+        self.client.force_login(self.user)
+        url, ids = reverse('dashboard'), []
+        while True:
+            response = self.client.get(url)
+            ids.extend(wrap.id for wrap in response.context['wraps'])
+            link = re.search(r'href="(\?before=[^"]+)"', response.content.decode())
+            if link is None:
+                break
+            url = reverse('dashboard') + link.group(1)
+        self.assertEqual(ids, self.expected)
+
+
+@unittest.skipUnless(connection.vendor == 'sqlite', "Query plans are checked against SQLite")
+class QueryPlanTests(TestCase):
+    """
+    Checks that share-link and per-user listing lookups are served by an index
+    rather than a table scan, however many wraps there are.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        users = [User.objects.create_user(f'user{i}') for i in range(20)]
+        SpotifyWrap.objects.bulk_create([
+            SpotifyWrap(user=users[i % 20], time_frame='short_term', data={}, share_token=f'token{i:07d}')
+            for i in range(2000)
+        ])
+        cls.user = users[0]
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def assertUsesIndex(self, queryset, index_name):
+        plan = queryset.explain()
+        self.assertIn(index_name, plan)
+        self.assertNotIn('SCAN wrapped_spotifywrap', plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_share_token_lookup_uses_unique_index(self):
+        self.assertUsesIndex(SpotifyWrap.objects.filter(share_token='token0000042'), 'share_token')
+
+    def test_dashboard_listing_uses_user_created_index(self):
+        self.assertUsesIndex(wrap_listing(self.user)[:13], 'spotifywrap_user_created_idx')
+
+
+class FakeTokenEndpoint(BaseHTTPRequestHandler):
+    """
+    Stand-in for Spotify's `/api/token`, answering with the server's configured
+    status and body after an optional delay.
+    """
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        form = {key: values[0] for key, values in parse_qs(self.rfile.read(length).decode()).items()}
+        server = self.server
+        with server.lock:
+            server.requests.append(form)
+        time.sleep(server.delay)
+        body = json.dumps(server.body).encode()
+        self.send_response(server.status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TokenEndpointMixin:
+    """
+    Runs a `FakeTokenEndpoint` for the test class and points the Spotify
+    accounts URL at it.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), FakeTokenEndpoint)
+        cls.server.lock = threading.Lock()
+        cls.server_thread = threading.Thread(target=cls.server.serve_forever, daemon=True)
+        cls.server_thread.start()
+        cls.accounts_url = override_settings(
+            SPOTIFY_ACCOUNTS_BASE_URL=f'http://127.0.0.1:{cls.server.server_port}',
+        )
+        cls.accounts_url.enable()
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        cls.accounts_url.disable()
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        super().setUp()
+        self.server.requests = []
+        self.server.status = 200
+        self.server.body = {'access_token': 'access-2', 'token_type': 'Bearer', 'expires_in': 3600}
+        self.server.delay = 0
+        self.user = User.objects.create_user('listener', password='password')
+
+    def store(self, expires_in):
+        return token_store.save_tokens(self.user, {
+            'access_token': 'access-1', 'refresh_token': 'refresh-1', 'expires_in': expires_in,
+        })
+
+
+class TokenStoreTests(TokenEndpointMixin, TestCase):
+    """
+    Tests for the encrypted Spotify token store and its proactive refresh.
+    """
+
+    def test_callback_stores_encrypted_tokens(self):
+        self.server.body = {'access_token': 'access-1', 'refresh_token': 'refresh-1', 'expires_in': 3600}
+        self.client.force_login(self.user)
+
+        response = self.client.get(reverse('callback'), {'code': 'auth-code'})
+
+        self.assertRedirects(response, reverse('generate-wrap'), fetch_redirect_response=False)
+        self.assertEqual(self.server.requests[0]['grant_type'], 'authorization_code')
+        record = SpotifyToken.objects.get(user=self.user)
+        self.assertNotIn('access-1', record.access_token)
+        self.assertNotIn('refresh-1', record.refresh_token)
+        self.assertEqual(token_store.get_access_token(self.user), 'access-1')
+        self.assertNotIn('spotify_access_token', self.client.session)
+
+    def test_fresh_token_is_used_without_a_refresh(self):
+        self.store(expires_in=3600)
+        self.assertEqual(token_store.get_access_token(self.user), 'access-1')
+        self.assertEqual(self.server.requests, [])
+
+    def test_expiring_token_is_refreshed_before_it_expires(self):
+        self.store(expires_in=30)
+
+        self.assertEqual(token_store.get_access_token(self.user), 'access-2')
+        self.assertEqual(self.server.requests[0]['grant_type'], 'refresh_token')
+        self.assertEqual(self.server.requests[0]['refresh_token'], 'refresh-1')
+        record = SpotifyToken.objects.get(user=self.user)
+        self.assertGreater(record.expires_at, timezone.now() + timedelta(minutes=59))
+        # Spotify did not rotate the refresh token, so the old one is kept
+        self.assertEqual(token_store.decrypt(record.refresh_token), 'refresh-1')
+
+    def test_revoked_refresh_token_forgets_the_tokens(self):
+        self.store(expires_in=0)
+        self.server.status, self.server.body = 400, {'error': 'invalid_grant'}
+
+        self.assertIsNone(token_store.get_access_token(self.user))
+        self.assertFalse(SpotifyToken.objects.filter(user=self.user).exists())
+
+    def test_unreachable_endpoint_keeps_the_unexpired_token(self):
+        self.store(expires_in=30)
+        with override_settings(SPOTIFY_ACCOUNTS_BASE_URL='http://127.0.0.1:1'), self.assertLogs('wrapped.spotify'):
+            self.assertEqual(token_store.get_access_token(self.user), 'access-1')
+
+    def test_generate_wrap_uses_the_stored_token(self):
+        self.store(expires_in=30)
+        self.client.force_login(self.user)
+        with mock.patch('wrapped.generation.build_wrap', return_value=({'language': 'en'}, {})) as build_wrap:
+            self.client.post(reverse('generate-wrap'), {'time_frame': 'short_term'})
+        self.assertEqual(build_wrap.call_args.args[0].access_token, 'access-2')
+
+
+class ConcurrentRefreshTests(TokenEndpointMixin, TransactionTestCase):
+    """
+    Requests that notice an expiring token at the same time share one refresh.
+    """
+
+    def test_concurrent_refreshes_call_spotify_once(self):
+        self.store(expires_in=30)
+        self.server.delay = 0.2
+        results = []
+
+        def fetch():
+            try:
+                results.append(token_store.get_access_token(self.user))
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=fetch) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(results, ['access-2'] * 5)
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_spotify_is_called_outside_a_transaction(self):
+        self.store(expires_in=30)
+        refresh_access_token = spotify.refresh_access_token
+        in_transaction = []
+
+        def refresh(refresh_token):
+            in_transaction.append(connection.in_atomic_block)
+            return refresh_access_token(refresh_token)
+
+        with mock.patch.object(token_store.spotify, 'refresh_access_token', refresh):
+            self.assertEqual(token_store.get_access_token(self.user), 'access-2')
+        self.assertEqual(in_transaction, [False])
+
+    def test_a_token_stored_by_another_process_meanwhile_wins(self):
+        self.store(expires_in=30)
+        refresh_access_token = spotify.refresh_access_token
+
+        def refresh(refresh_token):
+            # Another process refreshes and stores its token while this call is in flight
+            token_store.save_tokens(self.user, {'access_token': 'access-3', 'expires_in': 3600})
+            return refresh_access_token(refresh_token)
+
+        with mock.patch.object(token_store.spotify, 'refresh_access_token', refresh):
+            self.assertEqual(token_store.get_access_token(self.user), 'access-3')
+        self.assertEqual(token_store.decrypt(SpotifyToken.objects.get(user=self.user).access_token), 'access-3')
+
+    def test_refresh_locks_are_bounded(self):
+        locks = {token_store._refresh_lock(user_id) for user_id in range(10000)}
+        self.assertLessEqual(len(locks), len(token_store._refresh_locks))
+        self.assertIs(token_store._refresh_lock(42), token_store._refresh_lock(42))
+
+
+class ConcurrentSaveTests(TransactionTestCase):
+
+    def test_benchmark_saves_from_threads_and_cleans_up(self):
+        out = io.StringIO()
+        call_command('benchmark_saves', '--threads', '3', '--saves', '4', '--json', stdout=out)
+        results = json.loads(out.getvalue())
+        self.assertEqual((results['saves'], results['errors']), (12, 0))
+        self.assertEqual(results['database']['vendor'], connection.vendor)
+        self.assertFalse(User.objects.exists())
+        self.assertFalse(SpotifyWrap.objects.exists())
+        self.assertFalse(Track.objects.exists())
+
+
+TESTDATA = Path(__file__).resolve().parent / 'testdata'
+
+
+def recorded_response(name):
+    """
+    Returns a recorded Spotify response from `testdata` as a `requests.Response`.
+    """
+    response = requests.Response()
+    response.status_code = 200
+    response._content = (TESTDATA / f'{name}.json').read_bytes()
+    return response
+
+
+class PlayHistoryTests(TestCase):
+    """
+    Tests for the incremental listening-history sync, against recorded
+    `recently-played` responses.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user('listener', password='password')
+        self.spotify_client = spotify.SpotifyClient('access-token')
+
+    def sync(self, recording):
+        with mock.patch.object(spotify.SpotifyClient, 'get', return_value=recorded_response(recording)) as get:
+            added = history.sync_user(self.user, self.spotify_client)
+        return added, get.call_args.args[1]
+
+    def test_first_sync_stores_plays_without_a_cursor(self):
+        added, params = self.sync('recently_played_initial')
+
+        self.assertNotIn('after', params)
+        # The local file has no Spotify id and is skipped
+        self.assertEqual(added, 5)
+        self.assertEqual(PlayEvent.objects.filter(user=self.user).count(), 5)
+        self.assertEqual(history.cursor(self.user), 1732664412481)
+
+    def test_sync_is_incremental_and_idempotent(self):
+        self.sync('recently_played_initial')
+
+        added, params = self.sync('recently_played_update')
+        self.assertEqual(params['after'], 1732664412481)
+        # The update repeats the newest stored play; only the three newer ones are added
+        self.assertEqual(added, 3)
+
+        added, _ = self.sync('recently_played_update')
+        self.assertEqual(added, 0)
+        self.assertEqual(PlayEvent.objects.filter(user=self.user).count(), 8)
+
+    def test_patterns_and_streaks_come_from_the_whole_history(self):
+        self.sync('recently_played_initial')
+        self.sync('recently_played_update')
+
+        metrics = analytics.compute_wrap_metrics([], [], history.recent_plays(self.user))
+
+        self.assertEqual(metrics['listening_patterns']['time_of_day'], {
+            'morning': 25.0, 'afternoon': 12.5, 'evening': 0.0, 'night': 62.5,
+        })
+        self.assertEqual([(streak['name'], streak['streak']) for streak in metrics['longest_streaks'][:2]], [
+            ('Night Drive', 3), ('Late Show', 2),
+        ])
+        self.assertEqual(metrics['longest_streaks'][0]['album_art_url'], 'https://i.scdn.co/image/al1-640')
+
+    def test_rollups_match_the_history_after_incremental_syncs(self):
+        self.sync('recently_played_initial')
+        self.sync('recently_played_update')
+
+        metrics = analytics.compute_wrap_metrics([], [], history.recent_plays(self.user))
+        self.assertEqual(rollups.listening_patterns(self.user), metrics['listening_patterns'])
+        self.assertEqual(
+            [(streak['name'], streak['streak']) for streak in rollups.longest_streaks(self.user)[:2]],
+            [('Night Drive', 3), ('Late Show', 2)],
+        )
+        self.assertEqual(rollups.check(self.user), [])
+
+        ListeningRollup.objects.filter(user=self.user).delete()
+        self.assertNotEqual(rollups.check(self.user), [])
+        call_command('rebuild_listening_rollups', stdout=io.StringIO())
+        self.assertEqual(rollups.check(self.user), [])
+
+    def fetched(self, recording):
+        return json.loads((TESTDATA / f'{recording}.json').read_text())['items']
+
+    def test_wrap_metrics_count_unsaved_plays_without_writing(self):
+        self.sync('recently_played_initial')
+        night_drive = self.fetched('recently_played_initial')[0]['track']
+        extending = [{'track': night_drive, 'played_at': '2024-11-26T23:59:00.000Z'},
+                     {'track': night_drive, 'played_at': '2024-11-26T23:45:00.000Z'}]
+        for name, plays in (('update', self.fetched('recently_played_update')), ('extending', extending)):
+            with self.subTest(plays=name):
+                with CaptureQueriesContext(connection) as captured:
+                    merged = history.wrap_metrics(self.user, plays, 'long_term')
+                self.assertEqual([query['sql'] for query in captured if not query['sql'].startswith('SELECT')], [])
+                self.assertEqual(PlayEvent.objects.filter(user=self.user).count(), 5)
+
+                # The same as once the plays are stored
+                savepoint = transaction.savepoint()
+                history.record_plays(self.user, plays)
+                stored = history.wrap_metrics(self.user, [], 'long_term')
+                transaction.savepoint_rollback(savepoint)
+                self.assertEqual(merged, stored)
+        self.assertEqual(merged['longest_streaks'][0]['streak'], 5)
+
+    def test_only_saving_a_wrap_stores_its_plays(self):
+        token_store.save_tokens(self.user, {'access_token': 'access-1', 'refresh_token': 'refresh-1', 'expires_in': 3600})
+        self.client.force_login(self.user)
+        with spotify_stub.stub_spotify(5):
+            self.client.post(reverse('generate-wrap'), {'time_frame': 'long_term'})
+            self.assertFalse(PlayEvent.objects.filter(user=self.user).exists())
+            self.assertFalse(ListeningRollup.objects.filter(user=self.user).exists())
+            self.client.post(reverse('generate-wrap'), {'time_frame': 'long_term', 'save_wrap': '1'})
+        self.assertTrue(PlayEvent.objects.filter(user=self.user).exists())
+        self.assertEqual(rollups.check(self.user), [])
+
+    def test_command_syncs_users_with_a_stored_token(self):
+        token_store.save_tokens(self.user, {'access_token': 'access-1', 'refresh_token': 'refresh-1'})
+        User.objects.create_user('no-token')
+        out = io.StringIO()
+
+        with mock.patch.object(spotify.SpotifyClient, 'get', return_value=recorded_response('recently_played_initial')):
+            call_command('sync_play_history', stdout=out)
+
+        self.assertIn('listener: 5 new play(s)', out.getvalue())
+        self.assertIn('Synced 1 user(s), 5 new play(s)', out.getvalue())
+
+
+class QueryBudgetTests(TestCase):
+    """
+    Upper bounds on the queries each page makes, with Spotify replayed from the
+    recordings by `spotify_stub`. The bounds must hold whatever the data size.
+
+    Three of each budget are the session, the user and, until the preference
+    cookie is set, the user's preferences.
+    """
+
+    def setUp(self):
+        caches['default'].clear()
+        caches['spotify'].clear()
+
+    def log_in(self, username):
+        user = User.objects.create_user(username)
+        token_store.save_tokens(user, {'access_token': 'access-1', 'refresh_token': 'refresh-1', 'expires_in': 3600})
+        self.client.force_login(user)
+        return user
+
+    def saved_wrap(self, user, size=5):
+        with spotify_stub.stub_spotify(size):
+            sources = spotify.SpotifyClient('access-1').fetch_wrap_sources('medium_term')
+        return create_wrap(user, generation.build_wrap_from_sources(sources, 'medium_term', 'dark', 'en')[1])
+
+    @contextmanager
+    def assertMaxQueries(self, limit):
+        with CaptureQueriesContext(connection) as captured:
+            yield captured
+        self.assertLessEqual(len(captured), limit, '\n'.join(query['sql'] for query in captured))
+
+    def test_generate_wrap(self):
+        for size in (5, 50):
+            with self.subTest(size=size):
+                self.log_in(f'listener{size}')
+                with spotify_stub.stub_spotify(size) as stub, self.assertMaxQueries(19):
+                    response = self.client.post(reverse('generate-wrap'), {'time_frame': 'medium_term'})
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(len(stub.requests), 4)
+
+    def test_dashboard(self):
+        for wraps in (1, 30):
+            with self.subTest(wraps=wraps):
+                user = self.log_in(f'listener{wraps}')
+                for _ in range(wraps):
+                    self.saved_wrap(user)
+                with self.assertMaxQueries(4):
+                    response = self.client.get(reverse('dashboard'))
+                self.assertEqual(response.status_code, 200)
+
+    def test_wrap_detail(self):
+        for size in (5, 50):
+            with self.subTest(size=size):
+                wrap = self.saved_wrap(self.log_in(f'listener{size}'), size)
+                url = reverse('wrap_detail', args=[wrap.id])
+                with self.assertMaxQueries(6):
+                    self.assertEqual(self.client.get(url).status_code, 200)
+                # Served from the page cache: the session, the user and the check that the wrap still exists
+                with self.assertMaxQueries(3):
+                    self.assertEqual(self.client.get(url).status_code, 200)
+
+    def test_benchmark_output_is_json(self):
+        out = io.StringIO()
+        call_command('benchmark_views', '--sizes', '3', '--analytics-sizes', '10', '--iterations', '1', '--json',
+                     stdout=out)
+        results = json.loads(out.getvalue())
+        self.assertEqual({row['view'] for row in results['views']},
+                         {'generate_wrap', 'dashboard', 'wrap_detail', 'wrap_detail_cached'})
+        self.assertEqual({row['helper'] for row in results['analytics']},
+                         {'compute_wrap_metrics', 'classify_moods', 'encode_payload'})
+        self.assertTrue(all(row['queries'] >= 0 and row['mean_ms'] >= 0 for row in results['views']))
+        self.assertFalse(User.objects.filter(username__startswith='bench-').exists())
+
+
+class AsyncGenerateWrapTests(TestCase):
+    """
+    `async_views.generate_wrap` against `views.generate_wrap`: both clients are
+    answered from the same recordings, so every outcome must match.
+    """
+
+    def setUp(self):
+        caches['default'].clear()
+        caches['spotify'].clear()
+
+    @contextmanager
+    def recorded_spotify(self):
+        base_path = urlsplit(settings.SPOTIFY_API_BASE_URL).path
+
+        def answer(request):
+            body = spotify_stub.response_body(request.url.path[len(base_path):], dict(request.url.params), 5)
+            if body is None:
+                return httpx.Response(404, json={'error': {'status': 404, 'message': 'Service not found'}})
+            return httpx.Response(200, json=body)
+
+        client = httpx.AsyncClient(transport=httpx.MockTransport(answer))
+        with spotify_stub.stub_spotify(5), mock.patch.object(async_spotify, 'get_async_client', return_value=client):
+            yield
+
+    def listener(self, username, token=True):
+        user = User.objects.create_user(username)
+        if token:
+            token_store.save_tokens(user, {'access_token': 'access-1', 'refresh_token': 'refresh-1', 'expires_in': 3600})
+        return user
+
+    def generate(self, view, user, data):
+        """
+            Calls one of the two views with a POST from `user`, returning the
+            response and the context of the wrap it rendered (if any).
+        """
+        request = RequestFactory().post(reverse('generate-wrap'), data)
+        request.user, request.session, request.preferences = user, SessionStore(), ('dark', 'en')
+
+        async def auser():
+            return user
+        request.auser = auser
+
+        rendered = mock.Mock(return_value=HttpResponse())
+        if view == 'async':
+            with mock.patch.object(async_views, 'render_wrap', rendered):
+                response = async_to_sync(async_views.generate_wrap)(request)
+        else:
+            with mock.patch.object(views, 'render_wrap', rendered):
+                response = views.generate_wrap(request)
+        return response, rendered.call_args.args[1] if rendered.called else None
+
+    def test_rendered_wraps_match(self):
+        contexts, staged = {}, {}
+        with self.recorded_spotify():
+            for view in ('sync', 'async'):
+                user = self.listener(f'{view}-listener')
+                response, context = self.generate(view, user, {'time_frame': 'medium_term'})
+                self.assertEqual(response.status_code, 200)
+                staged[view] = snapshots.take_wrap(user.pk, context.pop('snapshot_id'))
+                contexts[view] = context
+        self.assertTrue(contexts['sync']['top_tracks'])
+        self.assertTrue(contexts['sync']['total_songs_played'])
+        self.assertEqual(contexts['async'], contexts['sync'])
+        self.assertIsNotNone(staged['sync'])
+        self.assertEqual(staged['async'], staged['sync'])
+
+    def test_saved_wraps_match(self):
+        saved = {}
+        with self.recorded_spotify():
+            for view in ('sync', 'async'):
+                user = self.listener(f'{view}-listener')
+                response, _ = self.generate(view, user, {'time_frame': 'long_term', 'save_wrap': '1'})
+                self.assertEqual((response.status_code, response.url), (302, reverse('dashboard')))
+                saved[view] = SpotifyWrap.objects.values(
+                    'name', 'time_frame', 'thumbnail_url', 'total_songs_played', 'total_genres_played',
+                    'total_duration_minutes', 'data',
+                ).get(user=user)
+        self.assertEqual(saved['async'], saved['sync'])
+
+    def test_saving_a_staged_wrap_skips_spotify(self):
+        for view in ('sync', 'async'):
+            with self.subTest(view=view):
+                user = self.listener(f'{view}-listener')
+                snapshot_id = snapshots.stage_wrap(user.pk, {'time_frame': 'short_term'})
+                with self.recorded_spotify(), mock.patch.object(spotify.SpotifyClient, 'get') as get, \
+                        mock.patch.object(async_spotify.AsyncSpotifyClient, 'get') as async_get:
+                    response, _ = self.generate(view, user, {'save_wrap': '1', 'snapshot_id': snapshot_id})
+                self.assertEqual(response.url, reverse('dashboard'))
+                self.assertFalse(get.called or async_get.called)
+                self.assertEqual(SpotifyWrap.objects.get(user=user).data, {'time_frame': 'short_term'})
+
+    def test_without_a_token_both_send_the_user_to_spotify_login(self):
+        for view in ('sync', 'async'):
+            with self.subTest(view=view):
+                response, _ = self.generate(view, self.listener(f'{view}-listener', token=False), {})
+                self.assertEqual(response.url, reverse('spotify-login'))
+
+    @override_settings(WRAP_JOBS_ENABLED=True)
+    def test_queued_jobs_match(self):
+        queued = {}
+        for view in ('sync', 'async'):
+            user = self.listener(f'{view}-listener')
+            with mock.patch.object(views, 'render_localized', return_value=HttpResponse()), \
+                    mock.patch.object(async_views, 'render_localized', return_value=HttpResponse()):
+                self.generate(view, user, {'time_frame': 'long_term', 'save_wrap': '1'})
+            job = WrapJob.objects.get(user=user)
+            queued[view] = (job.time_frame, job.view_mode, job.language, job.save_on_completion,
+                            token_store.decrypt(job.access_token))
+        self.assertEqual(queued['async'], queued['sync'])
+        self.assertEqual(queued['sync'], ('long_term', 'dark', 'en', True, 'access-1'))
+
+
+class AsyncClientLifetimeTests(unittest.TestCase):
+    """
+    The per-loop `httpx.AsyncClient` of `async_spotify.get_async_client`.
+    """
+
+    async def client(self):
+        client = async_spotify.get_async_client()
+        self.assertIs(async_spotify.get_async_client(), client)
+        return client
+
+    def live_clients(self):
+        return [client for client, _ in async_spotify._clients.values()]
+
+    def test_clients_of_finished_loops_are_closed_and_forgotten(self):
+        clients = [async_to_sync(self.client)() for _ in range(3)] + [asyncio.run(self.client())]
+        self.assertEqual(len({id(client) for client in clients}), 4)
+        self.assertTrue(all(client.is_closed for client in clients))
+        self.assertFalse(set(map(id, clients)) & set(map(id, self.live_clients())))
+
+    def test_loops_closed_without_shutting_down_are_forgotten(self):
+        loop = asyncio.new_event_loop()
+        abandoned = loop.run_until_complete(self.client())
+        loop.close()
+        with self.assertLogs('asyncio', 'ERROR'):
+            async_to_sync(self.client)()
+            # The abandoned loop's closing task goes with it
+            gc.collect()
+        self.assertNotIn(loop, async_spotify._clients)
+        self.assertNotIn(abandoned, self.live_clients())
+
+
+class FakeSpotifyServerTests(TestCase):
+    """
+    The Spotify clients against `spotify_stub.FakeSpotifyServer`, the stand-in
+    served by `manage.py fake_spotify` for load tests.
+    """
+
+    def setUp(self):
+        caches['spotify'].clear()
+
+    @contextmanager
+    def fake_spotify(self, **options):
+        server = spotify_stub.FakeSpotifyServer(('127.0.0.1', 0), **options)
+        thread = threading.Thread(target=server.serve_forever, kwargs={'poll_interval': 0.05}, daemon=True)
+        thread.start()
+        base_url = f'http://127.0.0.1:{server.server_port}'
+        try:
+            with override_settings(SPOTIFY_ACCOUNTS_BASE_URL=base_url,
+                                   SPOTIFY_API_BASE_URL=f'{base_url}{server.api_prefix}'):
+                yield server
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def expected_sources(self, time_frame, size):
+        return {
+            name: spotify_stub.response_body(path, params, size)['items']
+            for name, (path, params, _) in spotify.wrap_source_requests(time_frame).items()
+        }
+
+    def test_serves_the_wrap_sources(self):
+        with self.fake_spotify(size=30) as server:
+            sources = spotify.SpotifyClient('access-1').fetch_wrap_sources('medium_term')
+        self.assertEqual(sources, self.expected_sources('medium_term', 30))
+        self.assertTrue(all(sources.values()))
+        self.assertEqual(server.api_calls, 4)
+
+    def test_serves_the_async_client(self):
+        with self.fake_spotify(size=30):
+            sources = async_to_sync(async_spotify.AsyncSpotifyClient('access-1').fetch_wrap_sources)('medium_term')
+        self.assertEqual(sources, self.expected_sources('medium_term', 30))
+
+    def test_pages_follow_next_to_the_end(self):
+        with self.fake_spotify(size=120):
+            items = list(spotify.SpotifyClient('access-1').iter_items('/me/top/tracks', {'time_range': 'long_term'}))
+        self.assertEqual([item['id'] for item in items],
+                         [item['id'] for item in spotify_stub.scaled_items('top_tracks', 120)])
+
+    def test_recently_played_syncs_like_the_recordings(self):
+        served, replayed = User.objects.create_user('served'), User.objects.create_user('replayed')
+        with self.fake_spotify(size=70):
+            added = history.sync_user(served, spotify.SpotifyClient('access-1'))
+            self.assertEqual(history.sync_user(served, spotify.SpotifyClient('access-1')), 0)
+        with spotify_stub.stub_spotify(70):
+            self.assertEqual(history.sync_user(replayed, spotify.SpotifyClient('access-1')), added)
+        self.assertGreater(added, 0)
+        self.assertEqual(
+            list(PlayEvent.objects.filter(user=served).order_by('played_at').values_list('played_at', flat=True)),
+            list(PlayEvent.objects.filter(user=replayed).order_by('played_at').values_list('played_at', flat=True)),
+        )
+
+    def test_login_and_token_endpoints(self):
+        with self.fake_spotify():
+            response = self.client.get(reverse('spotify-login'))
+            authorize = requests.get(response.url, allow_redirects=False, timeout=5)
+            code = parse_qs(urlsplit(authorize.headers['Location']).query)['code'][0]
+            tokens = spotify.exchange_code(code, views.SPOTIFY_REDIRECT_URI)
+            status, refreshed = spotify.refresh_access_token(tokens['refresh_token'])
+        self.assertEqual(authorize.status_code, 302)
+        self.assertTrue(authorize.headers['Location'].startswith(views.SPOTIFY_REDIRECT_URI))
+        self.assertEqual(tokens['expires_in'], 3600)
+        self.assertTrue(tokens['access_token'] and tokens['refresh_token'])
+        self.assertEqual(status, 200)
+        self.assertNotEqual(refreshed['access_token'], tokens['access_token'])
+
+    def test_unknown_endpoints_are_not_found(self):
+        with self.fake_spotify():
+            self.assertEqual(spotify.SpotifyClient('access-1').get('/me/albums').status_code, 404)
+
+    @override_settings(SPOTIFY_MAX_RETRIES=3)
+    def test_throttled_calls_are_retried(self):
+        with self.fake_spotify(burst_every=2, burst_length=1, retry_after=0) as server:
+            client = spotify.SpotifyClient('access-1')
+            responses = [client.get('/me/top/tracks', {'limit': 5}) for _ in range(3)]
+        self.assertEqual([response.status_code for response in responses], [200] * 3)
+        self.assertEqual((server.api_calls, server.throttled_calls), (5, 2))
+
+
+class RequestTimingTests(TestCase):
+
+    def setUp(self):
+        caches['default'].clear()
+        caches['spotify'].clear()
+        for histogram in timing.REGISTRY:
+            histogram.reset()
+
+    def test_server_timing_breaks_down_generate_wrap(self):
+        user = User.objects.create_user('listener')
+        token_store.save_tokens(user, {'access_token': 'access-1', 'refresh_token': 'refresh-1', 'expires_in': 3600})
+        self.client.force_login(user)
+        with spotify_stub.stub_spotify(5), CaptureQueriesContext(connection) as captured:
+            response = self.client.post(reverse('generate-wrap'), {'time_frame': 'medium_term'})
+
+        entries = {entry.split(';')[0]: entry for entry in response['Server-Timing'].split(', ')}
+        self.assertLessEqual({'total', 'db', 'spotify', 'compute', 'render', 'spotify-me-top-tracks'}, set(entries))
+        self.assertIn(f'desc="{len(captured)} queries"', entries['db'])
+        self.assertIn('desc="4 calls"', entries['spotify'])
+
+        metrics = timing.render_metrics()
+        self.assertIn('wrapped_request_duration_seconds_count{view="generate-wrap",method="POST"} 1', metrics)
+        self.assertIn('wrapped_request_phase_seconds_bucket{view="generate-wrap",phase="compute",le="+Inf"} 1', metrics)
+        self.assertIn('wrapped_spotify_request_duration_seconds_count{endpoint="/me/playlists",outcome="ok"} 1',
+                      metrics)
+
+    def test_metrics_are_for_staff_or_the_token(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 404)
+        with override_settings(METRICS_TOKEN='scrape'):
+            self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer wrong').status_code, 404)
+            response = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer scrape')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('# TYPE wrapped_request_duration_seconds histogram', response.content.decode())
+
+        self.client.force_login(User.objects.create_user('admin', is_staff=True))
+        self.assertEqual(self.client.get('/metrics').status_code, 200)
+
+
+class RequestProfilingTests(TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings = override_settings(REQUEST_PROFILING_ENABLED=True, REQUEST_PROFILING_DIR=directory.name)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.staff = User.objects.create_user('admin', is_staff=True)
+
+    def test_signed_header_profiles_the_request(self):
+        self.client.force_login(self.staff)
+        self.assertNotIn('X-Profile-Id', self.client.get(reverse('dashboard'), HTTP_X_PROFILE_REQUEST='forged'))
+
+        response = self.client.get(reverse('dashboard'), HTTP_X_PROFILE_REQUEST=profiling.trigger_header_value())
+        profile_id = response['X-Profile-Id']
+        self.assertEqual([profile['id'] for profile in profiling.list_profiles()], [profile_id])
+
+        page = self.client.get(reverse('profiles'))
+        self.assertContains(page, reverse('profile-detail', args=[profile_id]))
+        detail = self.client.get(reverse('profile-detail', args=[profile_id]))
+        self.assertEqual(detail.context['profile']['view'], 'dashboard')
+        self.assertEqual(detail.context['profile']['user'], 'admin')
+        self.assertTrue(detail.context['entries'])
+        self.assertEqual(self.client.get(reverse('profile-detail', args=['..settings'])).status_code, 404)
+
+    def test_sampling_is_bounded(self):
+        with override_settings(REQUEST_PROFILING_SAMPLE_RATE=1.0, REQUEST_PROFILING_MAX_PER_MINUTE=2):
+            client = self.client_class()
+            responses = [client.get(reverse('landing')) for _ in range(5)]
+        self.assertEqual(sum('X-Profile-Id' in response for response in responses), 2)
+        self.assertEqual({profile['trigger'] for profile in profiling.list_profiles()}, {'sample'})
+
+    def test_profiles_page_is_staff_only(self):
+        self.client.force_login(User.objects.create_user('listener'))
+        self.assertEqual(self.client.get(reverse('profiles')).status_code, 302)
@@ -0,0 +1,284 @@
+"""
+Per-request timing breakdown and process-wide latency histograms.
+
+`RequestTimingMiddleware` starts a `RequestTimer` for every request and keeps it
+in a context variable, which the instrumented code adds to as it runs:
+
+- outbound Spotify calls, per endpoint (`record_spotify_call`, from `spotify.send`);
+- database queries, through an execute wrapper installed on every connection;
+- wrap analytics (`phase('compute')` in `generation`);
+- template rendering (the `TimedDjangoTemplates` backend).
+
+The breakdown goes back to the browser in a `Server-Timing` header and into the
+histograms served in Prometheus' text format at `/metrics`. Phases can overlap
+(a lazy queryset evaluated in a template counts as both db and render) and
+concurrent Spotify calls are summed, so they need not add up to the total.
+
+Recording costs a context variable lookup and a list append per query or call,
+cheap enough to leave on in production. The histograms are per process: with
+several workers, each one only reports the requests it served.
+"""
+import re
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.template.backends.django import DjangoTemplates, Template
+
+# Upper bounds of the latency buckets, in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_current = ContextVar('wrapped_request_timer', default=None)
+
+
+class RequestTimer:
+    """
+    Collects the timed spans of one request.
+
+    Spans may be added from the Spotify fetch pool's threads as well as the
+    request's own, so they are appended to a list (atomic under the GIL) and
+    only summed up when the request is done.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.spans = []
+
+    def add(self, phase, seconds, label=None):
+        self.spans.append((phase, label, seconds))
+
+    def summary(self):
+        """
+            Returns the total seconds and count of each phase, and of each
+            Spotify endpoint.
+
+            Returns:
+                tuple: `{phase: [seconds, count]}` and `{endpoint: [seconds, count]}`.
+        """
+        phases, endpoints = {}, {}
+        for phase, label, seconds in self.spans:
+            totals = phases.setdefault(phase, [0.0, 0])
+            totals[0] += seconds
+            totals[1] += 1
+            if label is not None:
+                totals = endpoints.setdefault(label, [0.0, 0])
+                totals[0] += seconds
+                totals[1] += 1
+        return phases, endpoints
+
+
+def start():
+    """
+        Starts timing the current request and returns its timer.
+    """
+    timer = RequestTimer()
+    _current.set(timer)
+    return timer
+
+
+def stop():
+    _current.set(None)
+
+
+def current():
+    """
+        Returns the timer of the request being served, or None outside a request.
+    """
+    return _current.get()
+
+
+@contextmanager
+def phase(name):
+    """
+        Adds the time spent in the block to phase `name` of the current request.
+    """
+    timer = _current.get()
+    if timer is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timer.add(name, time.perf_counter() - started)
+
+
+class Histogram:
+    """
+    A thread-safe Prometheus histogram with a fixed set of label names.
+    """
+
+    def __init__(self, name, documentation, labelnames, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._series = {}
+
+    def observe(self, labels, value):
+        """
+            Records one observation for the label values in `labels` (a tuple, in
+            the order of `labelnames`).
+        """
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def reset(self):
+        with self._lock:
+            self._series.clear()
+
+    def expose(self):
+        """
+            Returns the histogram in the Prometheus text format, as a list of lines.
+        """
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            series = [(labels, list(counts), total) for labels, (counts, total) in sorted(self._series.items())]
+        for labels, counts, total in series:
+            pairs = [f'{name}="{_escape(value)}"' for name, value in zip(self.labelnames, labels)]
+            cumulative = 0
+            for bound, count in zip([*map(_number, self.buckets), '+Inf'], counts):
+                cumulative += count
+                bucket_labels = ','.join([*pairs, 'le="%s"' % bound])
+                lines.append(f'{self.name}_bucket{{{bucket_labels}}} {cumulative}')
+            selector = f'{{{",".join(pairs)}}}' if pairs else ''
+            lines.append(f'{self.name}_sum{selector} {total!r}')
+            lines.append(f'{self.name}_count{selector} {cumulative}')
+        return lines
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _number(value):
+    return repr(float(value))
+
+
+request_duration = Histogram(
+    'wrapped_request_duration_seconds', "Time spent serving a request.", ('view', 'method'),
+)
+request_phase_duration = Histogram(
+    'wrapped_request_phase_seconds', "Time a request spent in each phase (db, spotify, compute, render).",
+    ('view', 'phase'),
+)
+request_db_queries = Histogram(
+    'wrapped_request_db_queries', "Database queries made by a request.", ('view',),
+    buckets=(0, 1, 2, 5, 10, 20, 50, 100),
+)
+spotify_request_duration = Histogram(
+    'wrapped_spotify_request_duration_seconds', "Duration of outbound Spotify calls.", ('endpoint', 'outcome'),
+)
+
+REGISTRY = [request_duration, request_phase_duration, request_db_queries, spotify_request_duration]
+
+
+def render_metrics():
+    """
+        Returns every histogram in the Prometheus text exposition format.
+    """
+    return '\n'.join(line for histogram in REGISTRY for line in histogram.expose()) + '\n'
+
+
+def record_spotify_call(endpoint, seconds, ok):
+    """
+        Records an outbound Spotify call, for the histogram and the current request.
+    """
+    spotify_request_duration.observe((endpoint, 'ok' if ok else 'error'), seconds)
+    timer = _current.get()
+    if timer is not None:
+        timer.add('spotify', seconds, endpoint)
+
+
+def timed_query(execute, sql, params, many, context):
+    """
+        Database execute wrapper adding each query's time to the current request.
+    """
+    timer = _current.get()
+    if timer is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timer.add('db', time.perf_counter() - started)
+
+
+def instrument_connection(sender, connection, **kwargs):
+    """
+        `connection_created` receiver installing `timed_query` on a connection.
+    """
+    # First in the list: `execute_wrapper()` blocks pop the last one when they exit
+    if timed_query not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, timed_query)
+
+
+def finish(timer, view, method):
+    """
+        Records a finished request in the histograms.
+
+        Args:
+            timer (RequestTimer): The request's timer.
+            view (str): The URL name of the view that served it.
+            method (str): The HTTP method.
+
+        Returns:
+            tuple: The total seconds, and the summary from `RequestTimer.summary`.
+    """
+    total = time.perf_counter() - timer.started
+    phases, endpoints = timer.summary()
+    request_duration.observe((view, method), total)
+    for name, (seconds, _) in phases.items():
+        request_phase_duration.observe((view, name), seconds)
+    request_db_queries.observe((view,), phases.get('db', (0.0, 0))[1])
+    return total, phases, endpoints
+
+
+_METRIC_NAME = re.compile(r'[^A-Za-z0-9]+')
+
+# Phases whose Server-Timing entry says how many spans they had
+UNITS = {'db': 'queries', 'spotify': 'calls'}
+
+
+def server_timing(total, phases, endpoints):
+    """
+        Builds a `Server-Timing` header value from a finished request's summary.
+    """
+    entries = [f'total;dur={total * 1000:.1f}']
+    for name, (seconds, count) in phases.items():
+        entry = f'{name};dur={seconds * 1000:.1f}'
+        if name in UNITS:
+            entry += f';desc="{count} {UNITS[name]}"'
+        entries.append(entry)
+    for endpoint, (seconds, count) in endpoints.items():
+        slug = _METRIC_NAME.sub('-', endpoint).strip('-')
+        entries.append(f'spotify-{slug};dur={seconds * 1000:.1f};desc="{_escape(endpoint)} x{count}"')
+    return ', '.join(entries)
+
+
+class TimedTemplate(Template):
+
+    def render(self, context=None, request=None):
+        with phase('render'):
+            return super().render(context, request)
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """
+    The Django template backend, adding the time spent rendering to the
+    current request's `render` phase.
+    """
+
+    def from_string(self, template_code):
+        return TimedTemplate(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        return TimedTemplate(super().get_template(template_name).template, self)
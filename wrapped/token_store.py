@@ -0,0 +1,148 @@
+"""
+Per-user store for Spotify OAuth tokens.
+
+`callback` used to keep only the access token, in the session, so once it
+expired (after an hour) the user had to go through the whole Spotify login
+redirect again. Logged-in users now get a `SpotifyToken` record holding the
+access and refresh tokens, encrypted with Fernet, and `get_access_token` trades
+the refresh token for a new access token shortly before the old one expires.
+
+Refreshes for one user are deduplicated: threads in a process queue on a lock
+picked by user id (from a fixed set, so the locks do not grow with the users),
+and whoever gets in after the first refresh re-reads the row and finds a fresh
+token, so Spotify sees one refresh per process however many requests noticed
+the expiry at once. The call to Spotify runs outside any transaction, so no
+database lock is held while it waits. The new token is stored only if the row
+still has the expiry read before the call; if another process stored one in the
+meantime, that one is used instead.
+"""
+import base64
+import hashlib
+import logging
+import threading
+from datetime import timedelta
+
+from cryptography.fernet import Fernet, InvalidToken, MultiFernet
+from django.conf import settings
+from django.utils import timezone
+
+from . import spotify
+from .models import SpotifyToken
+
+logger = logging.getLogger(__name__)
+
+# Spotify answers these when a refresh token has been revoked or is invalid
+REVOKED_STATUSES = {400, 401}
+
+# Users share these locks by id; a collision only makes one user's refresh wait on another's
+_refresh_locks = [threading.Lock() for _ in range(64)]
+
+
+def _cipher():
+    keys = settings.SPOTIFY_TOKEN_KEYS
+    if not keys:
+        digest = hashlib.sha256(f'wrapped.token_store:{settings.SECRET_KEY}'.encode()).digest()
+        keys = [base64.urlsafe_b64encode(digest)]
+    return MultiFernet([Fernet(key) for key in keys])
+
+
+def encrypt(value):
+    return _cipher().encrypt(value.encode()).decode() if value else ''
+
+
+def decrypt(value):
+    """
+        Decrypts a stored token; returns None if it is empty or no key can decrypt it.
+    """
+    if not value:
+        return None
+    try:
+        return _cipher().decrypt(value.encode()).decode()
+    except InvalidToken:
+        logger.warning("A stored Spotify token could not be decrypted; was SPOTIFY_TOKEN_KEYS rotated?")
+        return None
+
+
+def _refresh_lock(user_id):
+    return _refresh_locks[hash(user_id) % len(_refresh_locks)]
+
+
+def _expiring(record):
+    return record.expires_at - timezone.now() <= timedelta(seconds=settings.SPOTIFY_TOKEN_REFRESH_MARGIN)
+
+
+def save_tokens(user, tokens):
+    """
+        Stores a token response from Spotify for `user`.
+
+        Args:
+            user (User): The user the tokens belong to.
+            tokens (dict): The JSON body of a `/api/token` response.
+
+        Returns:
+            SpotifyToken: The stored record.
+    """
+    record, _ = SpotifyToken.objects.update_or_create(user=user, defaults=_token_fields(tokens))
+    return record
+
+
+def _token_fields(tokens):
+    fields = {
+        'access_token': encrypt(tokens['access_token']),
+        'expires_at': timezone.now() + timedelta(seconds=int(tokens.get('expires_in', 3600))),
+        'scope': tokens.get('scope', ''),
+    }
+    # Refresh responses only carry a refresh token when Spotify rotates it
+    if tokens.get('refresh_token'):
+        fields['refresh_token'] = encrypt(tokens['refresh_token'])
+    return fields
+
+
+def get_access_token(user):
+    """
+        Returns a usable Spotify access token for `user`.
+
+        A token about to expire (within `SPOTIFY_TOKEN_REFRESH_MARGIN` seconds)
+        is refreshed first.
+
+        Args:
+            user (User): A logged-in user.
+
+        Returns:
+            str: The access token, or None if the user has to log in to Spotify again.
+    """
+    record = SpotifyToken.objects.filter(user=user).first()
+    if record is None:
+        return None
+    if not _expiring(record):
+        return decrypt(record.access_token)
+
+    with _refresh_lock(user.pk):
+        return _refresh(user)
+
+
+def _refresh(user):
+    record = SpotifyToken.objects.filter(user=user).first()
+    if record is None:
+        return None
+    # Someone else refreshed it while we waited for the lock
+    if not _expiring(record):
+        return decrypt(record.access_token)
+
+    refresh_token = decrypt(record.refresh_token)
+    status, tokens = spotify.refresh_access_token(refresh_token) if refresh_token else (None, None)
+    # Only replace the token that was read above
+    unchanged = SpotifyToken.objects.filter(pk=record.pk, expires_at=record.expires_at)
+    if tokens is not None:
+        if unchanged.update(**_token_fields(tokens)):
+            return tokens['access_token']
+        # Another process stored a refreshed token first
+        current = SpotifyToken.objects.filter(user=user).first()
+        return decrypt(current.access_token) if current is not None else None
+
+    if refresh_token is None or status in REVOKED_STATUSES:
+        # Nothing left to refresh with; the user has to log in to Spotify again
+        unchanged.delete()
+        return None
+    # Spotify is unreachable: keep using the current token while it lasts
+    return decrypt(record.access_token) if record.expires_at > timezone.now() else None
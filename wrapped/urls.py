@@ -1,6 +1,13 @@
+from django.conf import settings
 from django.urls import path
 from . import views
 
+if settings.ASYNC_SPOTIFY_VIEWS:
+    # Serve the Spotify-bound views asynchronously (requires running under ASGI)
+    from . import async_views as spotify_views
+else:
+    spotify_views = views
+
 
 urlpatterns = [
     path('', views.landing, name='landing'),
@@ -11,12 +18,18 @@ urlpatterns = [
     path('logout/', views.user_logout, name='logout'),
     path('dashboard/', views.dashboard, name='dashboard'),
     path('spotify-login/', views.spotify_login, name='spotify-login'),
-    path('callback/', views.callback, name='callback'),
-    path('generate-wrap/', views.generate_wrap, name='generate-wrap'),
+    path('callback/', spotify_views.callback, name='callback'),
+    path('generate-wrap/', spotify_views.generate_wrap, name='generate-wrap'),
     path('save-wrap/', views.save_wrap, name='save-wrap'),
+    path('wrap-jobs/', views.enqueue_wrap, name='wrap-job-enqueue'),
+    path('wrap-jobs/<int:job_id>/', views.wrap_job_status, name='wrap-job-status'),
+    path('wrap-jobs/<int:job_id>/result/', views.wrap_job_result, name='wrap-job-result'),
     path('wrap/<int:wrap_id>/', views.wrap_detail, name='wrap_detail'),  # Define the URL pattern for wrap details
     path('wrap/<int:wrap_id>/delete/', views.delete_wrap, name='delete-wrap'),
     path('delete_account/', views.delete_account, name='delete_account'),
     path('wrap/share/<str:share_token>/', views.share_wrap, name='share_wrap'),
     path('wrap/share-view/<str:share_token>/', views.share_view, name='share_view'),
+    path('metrics', views.metrics, name='metrics'),
+    path('profiles/', views.profiles, name='profiles'),
+    path('profiles/<str:profile_id>/', views.profile_detail, name='profile-detail'),
 ]
@@ -1,41 +1,63 @@
+import hmac
 import random
 
-from django.http import JsonResponse
+from django.http import FileResponse, Http404, HttpResponse, JsonResponse
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth import authenticate, login
 from django.contrib.auth.forms import UserCreationForm
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.decorators import login_required
-import requests
 from django.contrib.auth import logout
-from .models import SpotifyWrap, Wrap
+from . import catalog, generation, jobs, page_cache, preferences, profiling, snapshots, spotify, timing, token_store
+from .models import SpotifyWrap, Wrap, WrapJob
 from django.urls import reverse
-from collections import Counter
 from datetime import datetime
 from django.conf import settings
 from django.http import JsonResponse
 from django.contrib.auth.models import User
 from django.contrib import messages
-from collections import defaultdict
-import os
+from django.db.models import Q
+from django.utils import translation
+from django.utils.translation import gettext_lazy as _
+import re
 
 # use the settings instead of hardcoded values
 SPOTIFY_CLIENT_ID = settings.SPOTIFY_CLIENT_ID
 SPOTIFY_CLIENT_SECRET = settings.SPOTIFY_CLIENT_SECRET
+# LOCAL_REDIRECT_URI / HEROKU_REDIRECT_URI, e.g. to point a load test at the app
+SPOTIFY_REDIRECT_URI = settings.SPOTIFY_REDIRECT_URI
+
+# Share tokens: 12 URL-safe characters (older wraps have UUID prefixes)
+SHARE_TOKEN_RE = re.compile(r'[A-Za-z0-9_-]{1,64}')
+
+
+def render_localized(request, template_name, context, language):
+    """
+        Renders a page in the user's language.
 
+        Every page has a single template; its strings are translated through the
+        catalogs in `wrapped/locale` while the language is active. Unknown
+        languages fall back to English.
 
-if 'DYNO' in os.environ:  # Heroku environment
-    SPOTIFY_REDIRECT_URI = 'https://spotifywrapped35-7ed41b719d25.herokuapp.com/callback/'
-else:  # Local environment
-    SPOTIFY_REDIRECT_URI = 'http://localhost:8000/callback/'
-#SPOTIFY_REDIRECT_URI = 'http://localhost:8000/callback/'
+        Args:
+            request (HttpRequest): The HTTP request object.
+            template_name (str): The page template.
+            context (dict): The template context.
+            language (str): The language code stored in the user's settings.
+
+        Returns:
+            HttpResponse: The rendered page.
+    """
+    with translation.override(language):
+        return render(request, template_name, context)
 
 # Landing page view
 def landing(request):
     """
         Handles the landing page with support for view mode and language preferences.
 
-        - Saves user preferences for `view_mode` and `language` in the session.
-        - Renders the appropriate localized landing page template.
+        - Saves user preferences for `view_mode` and `language`.
+        - Renders the landing page in the user's language.
 
         Args:
             request (HttpRequest): The HTTP request object.
@@ -44,37 +66,21 @@ def landing(request):
             HttpResponse: The rendered landing page template.
         """
     if request.method == "POST":
-        view_mode = request.POST.get("view_mode", "dark")
-        language = request.POST.get("language", "en")
-
-        # Save the settings to the session
-        request.session["view_mode"] = view_mode
-        request.session["language"] = language
-
-        if language == "en":
-            return render(request, "landing.html", {"view_mode": view_mode})
-        elif language == "de":
-            return render(request, "landing_de.html", {"view_mode": view_mode})
-        elif language == "es":
-            return render(request, "landing_es.html", {"view_mode": view_mode})
-
-    view_mode = request.session.get("view_mode", "dark")
-    language = request.session.get("language", "en")
-
-    if language == "en":
-        return render(request, "landing.html", {"view_mode": view_mode})
-    elif language == "de":
-        return render(request, "landing_de.html", {"view_mode": view_mode})
-    elif language == "es":
-        return render(request, "landing_es.html", {"view_mode": view_mode})
+        view_mode, language = preferences.update(
+            request, request.POST.get("view_mode"), request.POST.get("language"),
+        )
+    else:
+        view_mode, language = request.preferences
+
+    return render_localized(request, "landing.html", {"view_mode": view_mode}, language)
 
 # Login view
 def login_user(request):
     """
-        Handles user login, authentication, and session preference settings.
+        Handles user login, authentication, and preference settings.
 
         - Authenticates user with provided username and password.
-        - Saves view mode and language preferences in the session.
+        - Saves view mode and language preferences.
         - Redirects authenticated users to the dashboard.
 
         Args:
@@ -85,12 +91,9 @@ def login_user(request):
     """
     if request.method == "POST":
         # Handle view mode and language settings
-        view_mode = request.POST.get("view_mode", "dark")
-        language = request.POST.get("language", "en")
-
-        # Save the settings to the session
-        request.session["view_mode"] = view_mode
-        request.session["language"] = language
+        view_mode, language = preferences.update(
+            request, request.POST.get("view_mode"), request.POST.get("language"),
+        )
 
         # Handle authentication
         username = request.POST["username"]
@@ -100,34 +103,28 @@ def login_user(request):
             login(request, user)
             return redirect("dashboard")  # Redirect to user dashboard
         else:
-            return render(
+            return render_localized(
                 request,
                 "login.html",
                 {
                     "error": "Invalid credentials",
                     "view_mode": view_mode,
                     "language": language,
-                }
+                },
+                language,
             )
 
-    # Retrieve view mode and language settings from the session
-    view_mode = request.session.get("view_mode", "dark")
-    language = request.session.get("language", "en")
+    view_mode, language = request.preferences
 
-    if language == "en":
-        return render(request, "login.html", {"view_mode": view_mode})
-    elif language == "de":
-        return render(request, "login_de.html", {"view_mode": view_mode})
-    elif language == "es":
-        return render(request, "login_es.html", {"view_mode": view_mode})
+    return render_localized(request, "login.html", {"view_mode": view_mode}, language)
 
 # Register user view
 def register_user(request):
     """
-        Handles user registration with session preference settings.
+        Handles user registration with preference settings.
 
         - Processes the registration form.
-        - Saves view mode and language preferences in the session.
+        - Saves view mode and language preferences.
 
         Args:
             request (HttpRequest): The HTTP request object.
@@ -136,28 +133,20 @@ def register_user(request):
             HttpResponse: The registration page or a redirect to the login page.
     """
     # Handle "view_mode" and "language" for GET and POST requests
-    view_mode = request.session.get("view_mode", "dark")
-    language = request.session.get("language", "en")
+    view_mode, language = request.preferences
 
     if request.method == 'POST':
         form = UserCreationForm(request.POST)
         if form.is_valid():
             form.save()
 
-            # Save the settings to the session
-            request.session["view_mode"] = request.POST.get("view_mode", view_mode)
-            request.session["language"] = request.POST.get("language", language)
+            preferences.update(request, request.POST.get("view_mode"), request.POST.get("language"))
 
             return redirect('login')
     else:
         form = UserCreationForm()
 
-    if language == "en":
-        return render(request, "register.html", {"view_mode": view_mode,'form': form,})
-    elif language == "de":
-        return render(request, "register_de.html", {"view_mode": view_mode,'form': form,})
-    elif language == "es":
-        return render(request, "register_es.html", {"view_mode": view_mode,'form': form,})
+    return render_localized(request, "register.html", {"view_mode": view_mode, 'form': form}, language)
 
 
 
@@ -178,35 +167,62 @@ def dashboard(request):
     """
     # Handle POST requests for settings
     if request.method == "POST":
-        view_mode = request.POST.get("view_mode", "dark")
-        language = request.POST.get("language", "en")
+        view_mode, language = preferences.update(
+            request, request.POST.get("view_mode"), request.POST.get("language"),
+        )
+    else:
+        view_mode, language = request.preferences
 
-        # Save the settings to the session
-        request.session["view_mode"] = view_mode
-        request.session["language"] = language
+    # Query one page of the user's saved wraps
+    wraps, next_cursor = paginate_wraps(request.user, request.GET.get("before"))
+    context = {"view_mode": view_mode, "wraps": wraps, "next_cursor": next_cursor}
 
-        # Query the user's saved wraps
-        wraps = request.user.spotify_wraps.all()
-        if language == "en":
-            return render(request, "dashboard.html", {"view_mode": view_mode,"wraps": wraps})
-        elif language == "de":
-            return render(request, "dashboard_de.html", {"view_mode": view_mode,"wraps": wraps})
-        elif language == "es":
-            return render(request, "dashboard_es.html", {"view_mode": view_mode,"wraps": wraps})
+    return render_localized(request, "dashboard.html", context, language)
 
-    # Handle GET requests and retrieve current settings
-    view_mode = request.session.get("view_mode", "dark")
-    language = request.session.get("language", "en")
 
-    # Query the user's saved wraps
-    wraps = request.user.spotify_wraps.all()
+def wrap_listing(user):
+    """
+    Returns a user's wraps, newest first, with only the summary columns loaded.
+    """
+    return (SpotifyWrap.objects.filter(user=user)
+            .only(*SpotifyWrap.SUMMARY_FIELDS)
+            .order_by('-created_at', '-id'))
 
-    if language == "en":
-        return render(request, "dashboard.html", {"view_mode": view_mode, "wraps": wraps})
-    elif language == "de":
-        return render(request, "dashboard_de.html", {"view_mode": view_mode, "wraps": wraps})
-    elif language == "es":
-        return render(request, "dashboard_es.html", {"view_mode": view_mode, "wraps": wraps})
+
+def paginate_wraps(user, cursor=None):
+    """
+    Returns one page of a user's wraps, newest first, using keyset pagination.
+
+    Only the summary columns are loaded, and the page is found by seeking past
+    the `(created_at, id)` of the last wrap on the previous page, so the cost
+    does not depend on how many or how large the user's wraps are.
+
+    Args:
+        user (User): The owner of the wraps.
+        cursor (str): The `next_cursor` of the previous page, or None for the first page.
+
+    Returns:
+        tuple: The wraps on this page and the cursor of the next page (None on the last page).
+    """
+    wraps = wrap_listing(user)
+
+    if cursor:
+        try:
+            created_at, wrap_id = cursor.rsplit('_', 1)
+            created_at, wrap_id = datetime.fromisoformat(created_at), int(wrap_id)
+        except ValueError:
+            created_at = None
+        if created_at is not None:
+            wraps = wraps.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=wrap_id))
+
+    page_size = settings.DASHBOARD_PAGE_SIZE
+    page = list(wraps[:page_size + 1])
+    if len(page) <= page_size:
+        return page, None
+
+    page = page[:page_size]
+    last = page[-1]
+    return page, f"{last.created_at.isoformat()}_{last.id}"
 
 
 def user_logout(request):
@@ -239,7 +255,7 @@ def delete_account(request):
         user.delete()
         messages.success(request, "Your account has been successfully deleted.")
         return redirect('landing')  # Redirect to the landing page or another desired page
-    return render(request, 'delete_account.html')
+    return render_localized(request, 'delete_account.html', {}, request.preferences[1])
 
 # Spotify login view
 def spotify_login(request):
@@ -253,7 +269,7 @@ def spotify_login(request):
             HttpResponse: A redirect to Spotify's authorization endpoint.
     """
     scope = 'user-top-read user-read-recently-played playlist-read-private'
-    spotify_auth_url = f"https://accounts.spotify.com/authorize?client_id={SPOTIFY_CLIENT_ID}&response_type=code&redirect_uri={SPOTIFY_REDIRECT_URI}&scope={scope}"
+    spotify_auth_url = f"{settings.SPOTIFY_ACCOUNTS_BASE_URL}/authorize?client_id={SPOTIFY_CLIENT_ID}&response_type=code&redirect_uri={SPOTIFY_REDIRECT_URI}&scope={scope}"
     return redirect(spotify_auth_url)
 
 # Spotify callback view
@@ -268,43 +284,71 @@ def callback(request):
             HttpResponse: A redirect to the generate-wrap view or an error page.
         """
     code = request.GET.get('code')
-    token_url = 'https://accounts.spotify.com/api/token'
-    token_data = {
-        'grant_type': 'authorization_code',
-        'code': code,
-        'redirect_uri': SPOTIFY_REDIRECT_URI,
-        'client_id': SPOTIFY_CLIENT_ID,
-        'client_secret': SPOTIFY_CLIENT_SECRET,
-    }
-    response = requests.post(token_url, data=token_data)
-    if response.status_code == 200:
-        tokens = response.json()
-        access_token = tokens.get('access_token')
-        request.session['spotify_access_token'] = access_token
+    tokens = spotify.exchange_code(code, SPOTIFY_REDIRECT_URI)
+    if tokens is not None:
+        if request.user.is_authenticated:
+            # Kept with the refresh token so the next visits skip this redirect
+            token_store.save_tokens(request.user, tokens)
+        else:
+            request.session['spotify_access_token'] = tokens.get('access_token')
         return redirect('generate-wrap')  # Redirect to the updated wrap view
     else:
-        return render(request, 'error.html', {'message': 'Spotify login failed.'})
+        return render_localized(request, 'error.html', {'message': _('Spotify login failed.')}, request.preferences[1])
+
+def spotify_access_token(request):
+    """
+        Returns the Spotify access token to use for this request.
+
+        Logged-in users' tokens come from the token store, refreshed when they are
+        about to expire; a token left in the session (from before the store, or
+        obtained while logged out) is the fallback.
+
+        Args:
+            request (HttpRequest): The HTTP request object.
+
+        Returns:
+            str: The access token, or None if the user has to log in to Spotify.
+    """
+    if request.user.is_authenticated:
+        access_token = token_store.get_access_token(request.user)
+        if access_token:
+            return access_token
+    return request.session.get('spotify_access_token')
 
 def get_top_tracks(access_token, time_frame):
-    top_tracks = []
-    limit = 50
-    offset = 0
+    """
+        Fetches all of the user's top tracks for a time frame.
+
+        The pages after the first are fetched concurrently; use
+        `SpotifyClient.iter_items` directly to stream the tracks instead.
+
+        Args:
+            access_token (str): The user's Spotify access token.
+            time_frame (str): The Spotify `time_range`.
 
-    # Loop through to fetch all tracks, 50 at a time
-    while True:
-        url = f'https://api.spotify.com/v1/me/top/tracks?time_range={time_frame}&limit={limit}&offset={offset}'
-        headers = {'Authorization': f'Bearer {access_token}'}
-        response = requests.get(url, headers=headers)
-        data = response.json()
+        Returns:
+            list: The top tracks, in order.
+    """
+    client = spotify.SpotifyClient(access_token)
+    return list(client.iter_items('/me/top/tracks', {'time_range': time_frame}))
 
-        # If there are no more tracks to fetch, break the loop
-        if not data.get('items'):
-            break
+def create_wrap(user, data):
+    """
+        Persists a generated wrap for `user`, with its top tracks and artists in the catalog.
 
-        top_tracks.extend(data['items'])
-        offset += limit  # Move to the next set of 50 tracks
+        Args:
+            user (User): The owner of the wrap.
+            data (dict): The computed wrap data, as staged by `generate_wrap`.
 
-    return top_tracks
+        Returns:
+            SpotifyWrap: The saved wrap.
+    """
+    return catalog.save_wrap(SpotifyWrap(
+        user=user,
+        time_frame=data['time_frame'],  # The time frame the wrap was generated for
+        created_at=datetime.now(),
+        data=data,
+    ))
 
 # Generate the user's Spotify wrap
 @login_required
@@ -322,295 +366,134 @@ def generate_wrap(request):
         Returns:
             HttpResponse: The rendered wrap template or a redirect to Spotify login.
     """
-    access_token = request.session.get('spotify_access_token')
+    saving = request.method == 'POST' and 'save_wrap' in request.POST
+
+    # Save straight from the snapshot staged when the wrap was rendered
+    if saving:
+        staged = snapshots.take_wrap(request.user.pk, request.POST.get('snapshot_id'))
+        if staged is not None:
+            create_wrap(request.user, staged)
+            return redirect('dashboard')
+
+    access_token = spotify_access_token(request)
     if not access_token:
         return redirect('spotify-login')
 
     # Get the time frame from GET request or default to 'short_term'
     time_frame = request.POST.get('time_frame', 'short_term')
     x = time_frame
-    headers = {'Authorization': f'Bearer {access_token}'}
-    view_mode = request.session.get("view_mode", "dark")
-    language = request.session.get("language", "en")
-
-    # Spotify API URLs with the selected time frame
-    top_tracks_url = f'https://api.spotify.com/v1/me/top/tracks?time_range={time_frame}&limit=50'
-    top_artists_url = f'https://api.spotify.com/v1/me/top/artists?time_range={time_frame}&limit=50'
-
-    # Fetch tracks and artists based on time frame
-    response_tracks = requests.get(top_tracks_url, headers=headers)
-    response_artists = requests.get(top_artists_url, headers=headers)
-
-    #set fetched data
-    top_tracks = response_tracks.json().get('items', []) if response_tracks.status_code == 200 else []
-    top_artists = response_artists.json().get('items', []) if response_artists.status_code == 200 else []
-    
-    #display limit to 5
-    top_tracks_display = top_tracks[:3]
-    top_artists_display = top_artists[:3]
-    top_tracks_details = top_tracks[:5]
-    top_artists_details = top_artists[:5]
-
-    total_genres_played = 0
-
-    for artist in top_artists:
-        for genre in artist.get('genres', []):
-            total_genres_played = total_genres_played + 1
-
-    # Calculate genres
-    genres = []
-    for artist in top_artists:
-        for genre in artist.get('genres', []):
-            genres.append(genre)
-    genre_counts = Counter(genres)
-    favorite_genres = [genre for genre, _ in genre_counts.most_common(5)]
-
-    # Extract albums from top tracks
-    top_albums = [
-        {
-            'name': track['album']['name'],
-            'artist': track['album']['artists'][0]['name'],
-            'image_url': track['album']['images'][0]['url'] if track['album']['images'] else None
-        }
-        for track in top_tracks[:3]
-    ]
-
-    # Initialize mood playlists
-    mood_playlists = {
-        'chill_vibes': [],
-        'workout_hits': [],
-        'study_tunes': []
-    }
+    view_mode, language = request.preferences
 
-    # Categorize tracks based on track names and genres (since audio features API is not available)
-    for track in top_tracks[:9]:
-        track_name = track.get('name', '').lower()
-        artist_name = track.get('artists', [{}])[0].get('name', '').lower()
-        
-        # Check for workout/high energy indicators in names
-        workout_keywords = ['workout', 'gym', 'pump', 'energy', 'power', 'strong', 'beat', 'bass', 'dance', 'party', 'fire', 'lit', 'hype']
-        chill_keywords = ['chill', 'calm', 'peace', 'quiet', 'soft', 'gentle', 'slow', 'acoustic', 'ambient', 'dream', 'sleep', 'night']
-        study_keywords = ['study', 'focus', 'concentration', 'classical', 'instrumental', 'piano', 'jazz', 'lofi', 'beats']
-        
-        is_workout = any(keyword in track_name or keyword in artist_name for keyword in workout_keywords)
-        is_chill = any(keyword in track_name or keyword in artist_name for keyword in chill_keywords)
-        is_study = any(keyword in track_name or keyword in artist_name for keyword in study_keywords)
-        
-        if is_workout:
-            mood_playlists['workout_hits'].append(track)
-        elif is_chill:
-            mood_playlists['chill_vibes'].append(track)
-        elif is_study:
-            mood_playlists['study_tunes'].append(track)
-        else:
-            # Distribute evenly if no keywords match
-            if len(mood_playlists['chill_vibes']) <= len(mood_playlists['workout_hits']) and len(mood_playlists['chill_vibes']) <= len(mood_playlists['study_tunes']):
-                mood_playlists['chill_vibes'].append(track)
-            elif len(mood_playlists['workout_hits']) <= len(mood_playlists['study_tunes']):
-                mood_playlists['workout_hits'].append(track)
-            else:
-                mood_playlists['study_tunes'].append(track)
-
-    # Analyze listening patterns from recently played tracks
-    recently_played_url = 'https://api.spotify.com/v1/me/player/recently-played?limit=50'
-    response_recent = requests.get(recently_played_url, headers=headers)
-    recently_played = response_recent.json().get('items', []) if response_recent.status_code == 200 else []
-
-    # Fetch user's playlists for "Most Played Playlist" feature
-    playlists_url = 'https://api.spotify.com/v1/me/playlists?limit=20'
-    response_playlists = requests.get(playlists_url, headers=headers)
-    user_playlists = response_playlists.json().get('items', []) if response_playlists.status_code == 200 else []
-    
-    # Get the most popular playlist (first one is usually most relevant)
-    most_played_playlist = user_playlists[0] if user_playlists else None
-
-
-    #analyze the listening times throughout the day for the bar graph
-    def analyze_listening_patterns(recently_played):
-        """
-            Analyzes listening patterns from recently played tracks.
+    if settings.WRAP_JOBS_ENABLED:
+        # Hand the work to a wrap worker and let the page poll for the result
+        job = jobs.enqueue_wrap_job(request.user, access_token, time_frame, view_mode, language, save=saving)
+        return render_localized(request, "wrap_pending.html", {"job": job, "view_mode": view_mode}, language)
 
-            Args:
-                recently_played (list): A list of recently played track data.
+    client = spotify.SpotifyClient(access_token, cache_user=request.user.pk)
+    context, wrap_data = generation.build_wrap(
+        client, time_frame, view_mode, language, user=request.user, save=saving,
+    )
 
-            Returns:
-                dict: The analyzed listening patterns by time of day.
-        """
-        patterns = {
-            'time_of_day': {
-                'morning': 0,
-                'afternoon': 0,
-                'evening': 0,
-                'night': 0,
-            },
-        }
-
-        for item in recently_played:
-            played_at_raw = item['played_at']  # Raw timestamp with fractional seconds
-            played_at = datetime.strptime(played_at_raw.split('.')[0],
-                                          "%Y-%m-%dT%H:%M:%S")  # Remove fractional seconds and parse
-            hour = played_at.hour
-
-            # Time of day
-            if 5 <= hour < 12:
-                patterns['time_of_day']['morning'] += 1
-            elif 12 <= hour < 17:
-                patterns['time_of_day']['afternoon'] += 1
-            elif 17 <= hour < 22:
-                patterns['time_of_day']['evening'] += 1
-            else:
-                patterns['time_of_day']['night'] += 1
-
-        total = sum(patterns['time_of_day'].values())
-        if total > 0:
-            for key in patterns['time_of_day']:
-                patterns['time_of_day'][key] = round((patterns['time_of_day'][key] / total) * 100, 2)
-
-        return patterns
-
-    #analyze the genre breakdowns for graphs
-    def analyze_genres(top_artists):
-        """
-            Analyzes genre data from top artists.
+    # Save the wrap if requested (the snapshot was missing or had expired)
+    if saving:
+        create_wrap(request.user, wrap_data)
+        # Redirect back to the dashboard after saving
+        return redirect('dashboard')
 
-            Args:
-                top_artists (list): A list of top artist data.
+    context['snapshot_id'] = snapshots.stage_wrap(request.user.pk, wrap_data)
+    return render_wrap(request, context)
 
-            Returns:
-                dict: A dictionary of genre counts.
-        """
-        genre_counts_graph = {}
+def render_wrap(request, context):
+    """
+        Renders a generated wrap in the language stored in its context.
 
-        for artist in top_artists:
-            for genre in artist.get('genres', []):
-                genre_counts_graph[genre] = genre_counts_graph.get(genre, 0) + 1
+        Args:
+            request (HttpRequest): The HTTP request object.
+            context (dict): The context built by `generation.build_wrap`.
 
-        # Sort by frequency and return the top 5 genres
-        sorted_genres = sorted(genre_counts_graph.items(), key=lambda x: x[1], reverse=True)[:5]
-        return dict(sorted_genres)
+        Returns:
+            HttpResponse: The rendered wrap template.
+    """
+    return render_localized(request, "wrapper.html", context, context["language"])
 
-    # Analyze longest track streaks
-    def get_longest_streaks(recently_played):
-        """
-            Calculates the longest track streaks from recently played data.
+@login_required
+def enqueue_wrap(request):
+    """
+        Queues a wrap to be generated by a background worker.
 
-            Args:
-                recently_played (list): A list of recently played track data.
+        Args:
+            request (HttpRequest): The HTTP request object.
 
-            Returns:
-                list: The top 3 longest track streaks.
-        """
-        streaks = defaultdict(int)  # Track streaks per song
-        longest_streaks = []  # Final list of longest streaks
-
-        if not recently_played:
-            return []
-
-        last_track_id = None
-        current_streak_count = 0
-
-        for item in recently_played:
-            track = item['track']
-            track_id = track['id']
-            track_name = track['name']
-
-            if track_id == last_track_id:
-                current_streak_count += 1
-            else:
-                if last_track_id:
-                    # Save streak for the previous track
-                    streaks[last_track_id] = max(streaks[last_track_id], current_streak_count)
-                last_track_id = track_id
-                current_streak_count = 1
-
-        # Ensure the final track's streak is saved
-        if last_track_id:
-            streaks[last_track_id] = max(streaks[last_track_id], current_streak_count)
-
-        # Sort streaks by length (descending) and return top 3 streaks
-        sorted_streaks = sorted(streaks.items(), key=lambda x: x[1], reverse=True)[:3]
-        for track_id, streak_count in sorted_streaks:
-            track_data = next((item['track'] for item in recently_played if item['track']['id'] == track_id), None)
-            if track_data:
-                # Get album artwork URL
-                album_art_url = track_data['album']['images'][1]['url'] if 'images' in track_data['album'] else None
-                longest_streaks.append({
-                    'name': track_data['name'],
-                    'streak': streak_count,
-                    'album_art_url': album_art_url  # Add album art URL here
-                })
-
-        return longest_streaks
-
-    #listening patterns and genre breakdown called
-    listening_patterns = analyze_listening_patterns(recently_played)
-    genre_breakdown = analyze_genres(top_artists)
-
-    # Call the function to calculate streaks
-    longest_streaks = get_longest_streaks(recently_played)
-    total_songs_played = len(top_tracks)
-
-    # Metric 3: Total Listening Time (in hours)
-    total_duration_ms = sum(track['duration_ms'] for track in top_tracks)
-    total_duration_minutes = round(total_duration_ms / (1000 * 60), 2)  # Convert ms to minutes
-
-    # Save the wrap if requested
-    wrap_name = f"Top Tracks - {time_frame.replace('_', ' ').title()}"
-    if request.method == 'POST' and 'save_wrap' in request.POST:
-        time_frame = request.POST.get('time_frame', 'short_term')  # Use the time_frame from the form
-        wrap = SpotifyWrap.objects.create(
-            user=request.user,
-            time_frame=time_frame,  # This ensures the selected time frame is correctly saved
-            created_at=datetime.now(),
-            data={
-                'wrap_name': wrap_name,
-                'time_frame': time_frame,
-                'top_tracks': top_tracks_details,
-                'top_artists': top_artists_details,
-                'favorite_genres': favorite_genres,
-                'top_albums': top_albums,
-                'longest_streaks': longest_streaks,
-                'total_songs_played': total_songs_played,  # Total number of songs played
-                'total_duration_minutes': total_duration_minutes,  # Total listening time in minutes
-                'total_genres_played': total_genres_played,  # Total number of genres played
-                'listening_patterns': listening_patterns,  # The time-of-day patterns
-                'genre_breakdown': genre_breakdown,  # Detailed genre breakdown (if needed for charts)
-                "view_mode": view_mode,
-                "language": language
-            }
-        )
-        # Redirect back to the dashboard after saving
-        return redirect('dashboard')
+        Returns:
+            JsonResponse: The queued job and the URL to poll for its status.
+    """
+    if request.method != 'POST':
+        return JsonResponse({'error': 'POST required.'}, status=405)
 
-    context = {  # Ensure wrap is passed correctly
-        'time_frame': time_frame,
-        'top_tracks': top_tracks_display,
-        'top_artists': top_artists_display,
-        'favorite_genres': favorite_genres,
-        'top_albums': top_albums,
-        'listening_patterns': listening_patterns,
-        'genre_breakdown': genre_breakdown,
-        'mood_playlists': mood_playlists,
-        'longest_streaks': longest_streaks,
-        'total_songs_played': total_songs_played,
-        'total_genres_played': total_genres_played,
-        'total_duration_minutes': total_duration_minutes,
-        'most_played_playlist': most_played_playlist,
-        "view_mode": view_mode,
-        "language": language
+    access_token = spotify_access_token(request)
+    if not access_token:
+        return JsonResponse({'error': 'Spotify access token is missing.'}, status=400)
+
+    view_mode, language = request.preferences
+    job = jobs.enqueue_wrap_job(
+        request.user, access_token, request.POST.get('time_frame', 'short_term'), view_mode, language,
+    )
+    return JsonResponse({
+        'job_id': job.id,
+        'status': job.status,
+        'status_url': reverse('wrap-job-status', args=[job.id]),
+    }, status=202)
+
+@login_required
+def wrap_job_status(request, job_id):
+    """
+        Reports the progress of a queued wrap as JSON.
+
+        Args:
+            request (HttpRequest): The HTTP request object.
+            job_id (int): The ID of the job to report on.
+
+        Returns:
+            JsonResponse: The job's status, progress and, once done, its result.
+    """
+    job = get_object_or_404(WrapJob, id=job_id, user=request.user)
+    payload = {
+        'job_id': job.id,
+        'status': job.status,
+        'progress': job.progress,
+        'error': job.error or None,
     }
+    if job.status == WrapJob.STATUS_DONE:
+        payload['result'] = job.result['data']
+        # Saved wraps are listed on the dashboard, as after a synchronous save
+        payload['result_url'] = (reverse('dashboard') if job.result.get('wrap_id')
+                                 else reverse('wrap-job-result', args=[job.id]))
+    return JsonResponse(payload)
 
-    if language == "en":
-        return render(request, "wrapper.html", context)
-    elif language == "de":
-        return render(request, "wrapper_de.html", context)
-    elif language == "es":
-        return render(request, "wrapper_es.html", context)
+@login_required
+def wrap_job_result(request, job_id):
+    """
+        Renders the wrap produced by a finished job.
+
+        Args:
+            request (HttpRequest): The HTTP request object.
+            job_id (int): The ID of the finished job.
+
+        Returns:
+            HttpResponse: The rendered wrap, or the job status while it is unfinished.
+    """
+    job = get_object_or_404(WrapJob, id=job_id, user=request.user)
+    if job.status != WrapJob.STATUS_DONE:
+        return wrap_job_status(request, job_id)
+
+    context = dict(job.result['context'])
+    context['snapshot_id'] = snapshots.stage_wrap(request.user.pk, job.result['data'])
+    return render_wrap(request, context)
 
 @login_required
 def save_wrap(request):
     if request.method == 'POST':
-        access_token = request.session.get('spotify_access_token')
+        access_token = spotify_access_token(request)
         if not access_token:
             return JsonResponse({'error': 'Spotify access token is missing.'}, status=400)
 
@@ -642,29 +525,13 @@ def about(request):
         HttpResponse: The rendered About page template.
     """
     if request.method == "POST":
-        view_mode = request.POST.get("view_mode", "dark")
-        language = request.POST.get("language", "en")
-
-        # Save the settings to the session
-        request.session["view_mode"] = view_mode
-        request.session["language"] = language
-
-        if language == "en":
-            return render(request, "about.html", {"view_mode": view_mode})
-        elif language == "de":
-            return render(request, "about_de.html", {"view_mode": view_mode})
-        elif language == "es":
-            return render(request, "about_es.html", {"view_mode": view_mode})
-
-    view_mode = request.session.get("view_mode", "dark")
-    language = request.session.get("language", "en")
-
-    if language == "en":
-        return render(request, "about.html", {"view_mode": view_mode})
-    elif language == "de":
-        return render(request, "about_de.html", {"view_mode": view_mode})
-    elif language == "es":
-        return render(request, "about_es.html", {"view_mode": view_mode})
+        view_mode, language = preferences.update(
+            request, request.POST.get("view_mode"), request.POST.get("language"),
+        )
+    else:
+        view_mode, language = request.preferences
+
+    return render_localized(request, "about.html", {"view_mode": view_mode}, language)
 
 # wrap features and attributes views go below
 def get_user_top_tracks(access_token):
@@ -677,16 +544,10 @@ def get_user_top_tracks(access_token):
         Returns:
             list: The user's top tracks or None if the request fails.
     """
-    url = 'https://api.spotify.com/v1/me/top/tracks?limit=10'
-    headers = {
-        'Authorization': f'Bearer {access_token}',
-    }
-    response = requests.get(url, headers=headers)
+    response = spotify.SpotifyClient(access_token).get('/me/top/tracks', {'limit': 10})
 
-    if response.status_code == 200:
-        return response.json()['items']
-    else:
-        return None
+    page = spotify.parse_page(response, '/me/top/tracks')
+    return page['items'] if page is not None else None
 
 @login_required
 def wrap_detail(request, wrap_id):
@@ -703,51 +564,49 @@ def wrap_detail(request, wrap_id):
         Returns:
             HttpResponse: The rendered wrap detail template.
     """
-    wrap = get_object_or_404(SpotifyWrap, id=wrap_id)
-
     if request.method == "POST":
         # Handle settings update
-        view_mode = request.POST.get("view_mode", "dark")
-        language = request.POST.get("language", "en")
-
-        # Save the settings to the session
-        request.session["view_mode"] = view_mode
-        request.session["language"] = language
-
-        # Context for rendering after POST
-        context = {
-            'wrap': wrap,
-            'top_tracks': wrap.data.get('top_tracks', []),
-            'top_artists': wrap.data.get('top_artists', []),
-            "view_mode": view_mode,
-            "language": language,
-        }
-        if language == "en":
-            return render(request, "wrap_detail.html", context)
-        elif language == "de":
-            return render(request, "wrap_detail_de.html", context)
-        elif language == "es":
-            return render(request, "wrap_detail_es.html", context)
-
-    # Retrieve session data for GET requests
-    view_mode = request.session.get("view_mode", "dark")
-    language = request.session.get("language", "en")
-
-    # Context for rendering in GET requests
+        view_mode, language = preferences.update(
+            request, request.POST.get("view_mode"), request.POST.get("language"),
+        )
+    else:
+        view_mode, language = request.preferences
+
+    def render_page(csrf_token):
+        wrap = get_object_or_404(SpotifyWrap, id=wrap_id)
+        return render_wrap_detail(request, wrap, view_mode, language, csrf_token), wrap
+
+    # Saved wraps never change, so the rendered page is cached
+    return page_cache.cached_wrap_page(
+        request, page_cache.detail_page_id(wrap_id), language, view_mode, render_page,
+        SpotifyWrap.objects.filter(id=wrap_id),
+    )
+
+def render_wrap_detail(request, wrap, view_mode, language, csrf_token):
+    """
+        Renders the localized detail page of a saved wrap.
+
+        Args:
+            request (HttpRequest): The HTTP request object.
+            wrap (SpotifyWrap): The wrap to display.
+            view_mode (str): The page view mode.
+            language (str): The page language.
+            csrf_token (str): The CSRF token to embed, so it can be swapped out of a cached copy.
+
+        Returns:
+            HttpResponse: The rendered wrap detail template.
+    """
+    catalog.hydrate_wraps([wrap])
     context = {
         'wrap': wrap,
         'top_tracks': wrap.data.get('top_tracks', []),
         'top_artists': wrap.data.get('top_artists', []),
         "view_mode": view_mode,
         "language": language,
+        "csrf_token": csrf_token,
     }
 
-    if language == "en":
-        return render(request, "wrap_detail.html", context)
-    elif language == "de":
-        return render(request, "wrap_detail_de.html", context)
-    elif language == "es":
-        return render(request, "wrap_detail_es.html", context)
+    return render_localized(request, "wrap_detail.html", context, language)
 
 
 def index(request):
@@ -760,7 +619,7 @@ def delete_account(request):
         user.delete()
         messages.success(request, "Your account has been successfully deleted.")
         return redirect('landing')  # Redirect to the landing page or another desired page
-    return render(request, 'delete_account.html')
+    return render_localized(request, 'delete_account.html', {}, request.preferences[1])
 
 def user_settings(request):
     """
@@ -773,29 +632,13 @@ def user_settings(request):
             HttpResponse: The rendered user settings template.
     """
     if request.method == "POST":
-        view_mode = request.POST.get("view_mode", "dark")
-        language = request.POST.get("language", "en")
-
-        # Save the settings to the session
-        request.session["view_mode"] = view_mode
-        request.session["language"] = language
-
-        if language == "en":
-            return render(request, "user_settings.html", {"view_mode": view_mode})
-        elif language == "de":
-            return render(request, "user_settings_de.html", {"view_mode": view_mode})
-        elif language == "es":
-            return render(request, "user_settings_es.html", {"view_mode": view_mode})
-
-    view_mode = request.session.get("view_mode", "dark")
-    language = request.session.get("language", "en")
+        view_mode, language = preferences.update(
+            request, request.POST.get("view_mode"), request.POST.get("language"),
+        )
+    else:
+        view_mode, language = request.preferences
 
-    if language == "en":
-        return render(request, "user_settings.html", {"view_mode": view_mode})
-    elif language == "de":
-        return render(request, "user_settings_de.html", {"view_mode": view_mode})
-    elif language == "es":
-        return render(request, "user_settings_es.html", {"view_mode": view_mode})
+    return render_localized(request, "user_settings.html", {"view_mode": view_mode}, language)
 
 
 @login_required
@@ -822,15 +665,23 @@ def delete_wrap(request, wrap_id):
     return redirect('dashboard')  # If not a POST request, redirect back to dashboard
 
 def share_wrap(request, share_token):
-    # Get the wrap using the share_token
-    wrap = get_object_or_404(SpotifyWrap, share_token=share_token)
+    # Tokens are short URL-safe strings; anything else cannot match a wrap,
+    # so reject it without touching the database
+    if not SHARE_TOKEN_RE.fullmatch(share_token):
+        raise Http404("No SpotifyWrap matches the given query.")
 
-    # Context data to pass to the template
-    context = {
-        'wrap': wrap,
-    }
+    view_mode, language = request.preferences
+
+    def render_page(csrf_token):
+        # Get the wrap using the share_token (a unique index lookup)
+        wrap = get_object_or_404(SpotifyWrap, share_token=share_token)
+        return render_wrap_detail(request, wrap, view_mode, language, csrf_token), wrap
 
-    return render(request, 'shared_wrap.html', context)
+    # Shared wraps are public and immutable, so repeat views come from the page cache
+    return page_cache.cached_wrap_page(
+        request, page_cache.share_page_id(share_token), language, view_mode, render_page,
+        SpotifyWrap.objects.filter(share_token=share_token),
+    )
 
 @login_required
 def share_view(request, share_token):
@@ -851,3 +702,66 @@ def share_view(request, share_token):
         'title': title,
         'summary': summary,
     })
+
+def metrics(request):
+    """
+        Serves this process' request and Spotify latency histograms in the
+        Prometheus text format.
+
+        Readable by staff users, and with `Authorization: Bearer <METRICS_TOKEN>`
+        when that setting is set.
+
+        Args:
+            request (HttpRequest): The HTTP request object.
+
+        Returns:
+            HttpResponse: The metrics, or a 404 for anyone else.
+    """
+    authorization = request.headers.get('Authorization', '')
+    token_ok = bool(settings.METRICS_TOKEN) and hmac.compare_digest(authorization, f'Bearer {settings.METRICS_TOKEN}')
+    if not (token_ok or request.user.is_staff):
+        raise Http404
+    return HttpResponse(timing.render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+@staff_member_required
+def profiles(request):
+    """
+        Lists the stored request profiles, with a header value to trigger new ones.
+
+        Args:
+            request (HttpRequest): The HTTP request object.
+
+        Returns:
+            HttpResponse: The rendered profiles template.
+    """
+    return render(request, 'profiles.html', {
+        'profiles': profiling.list_profiles(),
+        'enabled': settings.REQUEST_PROFILING_ENABLED,
+        'header': profiling.HEADER,
+        'header_value': profiling.trigger_header_value(),
+        'header_ttl_minutes': settings.REQUEST_PROFILING_TOKEN_TTL // 60,
+    })
+
+@staff_member_required
+def profile_detail(request, profile_id):
+    """
+        Shows the functions that took the longest in a stored request profile.
+
+        Args:
+            request (HttpRequest): The HTTP request object.
+            profile_id (str): The profile's id.
+
+        Returns:
+            HttpResponse: The rendered profile template, or the `.prof` file with `?download`.
+    """
+    profile = profiling.load_profile(profile_id)
+    if profile is None:
+        raise Http404
+    if 'download' in request.GET:
+        return FileResponse(profiling.profile_path(profile_id).open('rb'), as_attachment=True)
+    sort = 'tottime' if request.GET.get('sort') == 'tottime' else 'cumulative'
+    return render(request, 'profile_detail.html', {
+        'profile': profile,
+        'sort': sort,
+        'entries': profiling.top_entries(profile_id, sort),
+    })